@@ -0,0 +1,239 @@
+import argparse
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from partition import TickerPartition
+from schema import connect, ensure_schema, upsert_dataframe
+
+# Split and dividend adjustment computed from the stored `splits` and
+# `dividends` tables instead of re-downloading back-adjusted history.
+#
+# Every action becomes a ratio on the first bar on or after its date: 1 / r
+# for an r-for-1 split and 1 - dividend / previous close for a dividend, the
+# same convention as Yahoo's Adj Close. A bar's factor is the product of the
+# ratios of all later bars (a reverse cumulative product), so the newest bar
+# always has factor 1 and appending bars never changes older factors. Volume
+# only moves with splits, inversely.
+#
+# Yahoo's unadjusted history (populate_db --raw) already has splits applied,
+# so by default only dividends are applied; include_splits (--splits) is for
+# sources with truly raw prices. Without --raw populate_db stores prices that
+# are already adjusted, and adjusting them again would count every dividend
+# twice, so both entry points refuse tickers whose sync_state.mode isn't raw.
+
+ADJUSTED_TABLE = "prices_adjusted"
+PRICE_COLUMNS = ["Open", "High", "Low", "Close"]
+
+
+def adjustment_factors(dates, close, split_dates=(), split_ratios=(), dividend_dates=(), dividends=()):
+    """
+    (price factor, volume factor) for one ticker's bars, dates sorted
+    ascending. Action dates only need to order like the bar dates (the stored
+    text dates do).
+    """
+    n = len(dates)
+    dates = np.asarray(dates)
+    close = np.asarray(close, dtype=np.float64)
+    # ratio[i] belongs to the action on bar i; slot n holds actions after the last bar
+    price_ratio = np.ones(n + 1)
+    volume_ratio = np.ones(n + 1)
+
+    bars = np.searchsorted(dates, np.asarray(split_dates))
+    ratios = np.asarray(split_ratios, dtype=np.float64)
+    # Actions on or before the first bar are already reflected in every price
+    valid = (bars > 0) & (ratios > 0)
+    np.multiply.at(price_ratio, bars[valid], 1.0 / ratios[valid])
+    np.multiply.at(volume_ratio, bars[valid], ratios[valid])
+
+    bars = np.searchsorted(dates, np.asarray(dividend_dates))
+    amounts = np.asarray(dividends, dtype=np.float64)
+    valid = (bars > 0) & (amounts > 0)
+    np.multiply.at(price_ratio, bars[valid], 1.0 - amounts[valid] / close[bars[valid] - 1])
+
+    # factor[t] is the product of the ratios of every later bar
+    price_factor = np.cumprod(price_ratio[::-1])[::-1][1:]
+    volume_factor = np.cumprod(volume_ratio[::-1])[::-1][1:]
+    return price_factor, volume_factor
+
+
+def _actions_by_ticker(actions):
+    if actions is None or actions.empty:
+        return {}
+    actions = actions.sort_values(["ticker", "Date"])
+    return {ticker: (group["Date"].to_numpy(), group["value"].to_numpy(np.float64))
+            for ticker, group in actions.groupby("ticker", sort=False)}
+
+
+def adjust_prices(prices, splits=None, dividends=None, include_splits=False):
+    """
+    Adjusted copy of a prices frame (any number of tickers): OHLC times the
+    price factor, Volume times the volume factor, plus the factor column.
+    splits and dividends are frames of the stored tables (ticker, Date, value).
+    """
+    data = TickerPartition(prices)
+    df = data.df.copy()
+    split_actions = _actions_by_ticker(splits) if include_splits else {}
+    dividend_actions = _actions_by_ticker(dividends)
+    dates = df["Date"].to_numpy()
+    close = df["Close"].to_numpy(np.float64)
+    price_factor = np.ones(len(df))
+    volume_factor = np.ones(len(df))
+    for ticker, start, end in zip(data.tickers, data.starts, data.ends):
+        if ticker not in split_actions and ticker not in dividend_actions:
+            continue
+        split_dates, split_ratios = split_actions.get(ticker, ((), ()))
+        dividend_dates, amounts = dividend_actions.get(ticker, ((), ()))
+        price_factor[start:end], volume_factor[start:end] = adjustment_factors(
+            dates[start:end], close[start:end], split_dates, split_ratios, dividend_dates, amounts,
+        )
+    for column in PRICE_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].to_numpy(np.float64) * price_factor
+    if "Volume" in df.columns:
+        df["Volume"] = df["Volume"].to_numpy(np.float64) * volume_factor
+    df["factor"] = price_factor
+    return df
+
+
+def check_raw(conn, tickers=None, assume_raw=False):
+    """
+    Raise ValueError unless populate_db recorded the stored prices of tickers
+    (all when None) as raw. assume_raw accepts tickers with no recorded mode,
+    e.g. from a database ingested before the mode was kept.
+    """
+    try:
+        modes = dict(conn.execute(
+            "SELECT p.ticker, s.mode FROM (SELECT DISTINCT ticker FROM prices) p "
+            "LEFT JOIN sync_state s ON s.ticker = p.ticker AND s.table_name = 'prices'"
+        ).fetchall())
+    except sqlite3.OperationalError:
+        # No sync_state (or no mode column) yet: nothing is recorded
+        modes = dict.fromkeys(ticker for ticker, in conn.execute("SELECT DISTINCT ticker FROM prices"))
+    if tickers is not None:
+        modes = {ticker: modes[ticker] for ticker in tickers if ticker in modes}
+    refused = sorted(ticker for ticker, mode in modes.items() if mode != "raw" and not (assume_raw and mode is None))
+    if refused:
+        raise ValueError(
+            f"the prices of {len(refused)} tickers ({', '.join(refused[:5])}{', ...' if len(refused) > 5 else ''}) "
+            "are not recorded as raw; reload them with populate_db --raw --full, or pass --assume-raw if they are raw"
+        )
+
+
+def _read(conn, query, tickers=None):
+    if tickers is None:
+        return pd.read_sql_query(query, conn)
+    frames = []
+    tickers = list(tickers)
+    # Stay under SQLite's bound parameter limit
+    for i in range(0, len(tickers), 500):
+        batch = tickers[i:i + 500]
+        frames.append(pd.read_sql_query(f"{query} WHERE ticker IN ({', '.join('?' for _ in batch)})", conn, params=batch))
+    return pd.concat(frames, ignore_index=True) if frames else pd.read_sql_query(f"{query} LIMIT 0", conn)
+
+
+def load_adjusted(db_path="stock_data.db", tickers=None, include_splits=False, assume_raw=False):
+    """ Adjust on load: read prices and the action tables and apply the factors in memory """
+    conn = connect(db_path, readonly=True)
+    try:
+        check_raw(conn, tickers, assume_raw)
+        prices = _read(conn, "SELECT * FROM prices", tickers)
+        splits = _read(conn, "SELECT ticker, Date, value FROM splits", tickers) if include_splits else None
+        dividends = _read(conn, "SELECT ticker, Date, value FROM dividends", tickers)
+    finally:
+        conn.close()
+    return adjust_prices(prices, splits, dividends, include_splits)
+
+
+def action_fingerprints(conn, include_splits=False):
+    """ {ticker: text that changes whenever one of its actions is added, removed or restated} """
+    tables = ["dividends"] + (["splits"] if include_splits else [])
+    parts = {}
+    for table in tables:
+        for ticker, count, last, total in conn.execute(
+            f"SELECT ticker, COUNT(*), MAX(Date), TOTAL(value) FROM {table} GROUP BY ticker"
+        ):
+            parts.setdefault(ticker, []).append(f"{table}:{count}:{last}:{total!r}")
+    return {ticker: "|".join(values) for ticker, values in parts.items()}
+
+
+def refresh_adjusted(db_path="stock_data.db", include_splits=False, full=False, assume_raw=False):
+    """
+    Keep the prices_adjusted table in step with prices. Tickers whose actions
+    changed (or whose stored prices were restated) are rewritten; tickers that
+    only gained bars get just the new bars, whose factor is 1 until a later
+    action arrives. Raises ValueError (see check_raw) before writing anything
+    when prices aren't raw. Returns (tickers rewritten, tickers appended).
+    """
+    conn = connect(db_path)
+    ensure_schema(conn)
+    try:
+        check_raw(conn, assume_raw=assume_raw)
+    except ValueError:
+        conn.close()
+        raise
+    if full:
+        conn.execute(f"DELETE FROM {ADJUSTED_TABLE}")
+        conn.execute("DELETE FROM adjustment_state")
+    fingerprints = action_fingerprints(conn, include_splits)
+    state = {ticker: (actions, last_date, last_close) for ticker, actions, last_date, last_close in
+             conn.execute("SELECT ticker, actions, last_date, last_close FROM adjustment_state")}
+    latest = dict(conn.execute("SELECT ticker, MAX(Date) FROM prices GROUP BY ticker").fetchall())
+
+    rewrite, append = [], {}
+    for ticker, last_date in latest.items():
+        saved = state.get(ticker)
+        if saved is None or saved[0] != fingerprints.get(ticker, ""):
+            rewrite.append(ticker)
+            continue
+        close = conn.execute("SELECT Close FROM prices WHERE ticker = ? AND Date = ?", (ticker, saved[1])).fetchone()
+        if close is None or close[0] != saved[2]:
+            rewrite.append(ticker)
+        elif last_date > saved[1]:
+            append[ticker] = saved[1]
+
+    conn.executemany(f"DELETE FROM {ADJUSTED_TABLE} WHERE ticker = ?", [(ticker,) for ticker in rewrite])
+    for i in range(0, len(rewrite), 200):
+        batch = rewrite[i:i + 200]
+        prices = _read(conn, "SELECT ticker, Date, Open, High, Low, Close, Volume FROM prices", batch)
+        splits = _read(conn, "SELECT ticker, Date, value FROM splits", batch) if include_splits else None
+        dividends = _read(conn, "SELECT ticker, Date, value FROM dividends", batch)
+        _store(conn, adjust_prices(prices, splits, dividends, include_splits), fingerprints)
+    for ticker, last_date in append.items():
+        prices = pd.read_sql_query(
+            "SELECT ticker, Date, Open, High, Low, Close, Volume FROM prices WHERE ticker = ? AND Date > ? ORDER BY Date",
+            conn, params=[ticker, last_date],
+        )
+        prices["factor"] = 1.0
+        _store(conn, prices, fingerprints)
+    conn.close()
+    return len(rewrite), len(append)
+
+
+def _store(conn, adjusted, fingerprints):
+    upsert_dataframe(conn, ADJUSTED_TABLE, adjusted, commit=False)
+    # The raw close of each ticker's newest bar, to notice restated prices next time
+    latest = adjusted.groupby("ticker").tail(1)
+    raw_close = latest["Close"].to_numpy() / latest["factor"].to_numpy()
+    conn.executemany(
+        "INSERT OR REPLACE INTO adjustment_state (ticker, actions, last_date, last_close) VALUES (?, ?, ?, ?)",
+        [(ticker, fingerprints.get(ticker, ""), date, float(close))
+         for ticker, date, close in zip(latest["ticker"], latest["Date"], raw_close)],
+    )
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize split/dividend adjusted prices")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--splits", action="store_true", help="also apply splits (for prices that are not split-adjusted)")
+    parser.add_argument("--full", action="store_true", help="recompute every ticker")
+    parser.add_argument("--assume-raw", action="store_true", help="treat prices with no recorded raw/adjusted mode as raw")
+    args = parser.parse_args()
+    rewritten, appended = refresh_adjusted(args.db, args.splits, args.full, args.assume_raw)
+    print(f"Rewrote {rewritten} tickers, appended new bars for {appended}")
+
+
+if __name__ == "__main__":
+    main()
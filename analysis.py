@@ -1,11 +1,11 @@
 import asyncio
-import sqlite3
-import pandas as pd
 import autogen
 
+from query_service import QueryService
+
 query_db_declaration = {
     "name": "query_db",
-    "description": "Query function to query the sqlite db.",
+    "description": "Query function to query the sqlite db. The db is read-only and results are capped at 1000 rows.",
     "parameters": {
         "type": "object",
         "properties": {
@@ -18,21 +18,35 @@ query_db_declaration = {
     },
 }
 
+# One pooled, cached reader per database shared by every agent call
+query_services = {}
+
 def query_db(query, db_path="stock_data.db"):
-    conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
-
-config_list = autogen.filter_config(
-    config_list=[
-        {
-            "model": "gpt-4o",
-            "api_key": "",
-        }
-    ],
-    filter_dict=None,
-)
+    if db_path not in query_services:
+        query_services[db_path] = QueryService(db_path, max_rows=1000)
+    return query_services[db_path].query(query)
+
+def report_query_stats():
+    """ Print each database's query_db counters: cache hit rate, latency, truncated results """
+    for db_path, service in query_services.items():
+        stats = service.stats()
+        print(
+            f"query_db {db_path}: {stats['queries']} queries, {stats['hit_rate']:.0%} cache hits, "
+            f"{stats['avg_latency_ms']:.1f} ms average, {stats['errors']} errors, "
+            f"{stats['truncated']} truncated at {service.max_rows} rows, "
+            f"{stats['cached_entries']} cached results ({stats['cached_bytes'] / 1024 ** 2:.1f} MiB)"
+        )
+
+def load_config_list():
+    return autogen.filter_config(
+        config_list=[
+            {
+                "model": "gpt-4o",
+                "api_key": "",
+            }
+        ],
+        filter_dict=None,
+    )
 
 
 # Define a termination message checker
@@ -43,6 +57,7 @@ def is_termination_msg(data):
 
 # Define the chat initiation function
 async def stock_research():
+    config_list = load_config_list()
 
     manager_agent = autogen.AssistantAgent(
         name="manager_agent",
@@ -97,6 +112,8 @@ async def stock_research():
 
         You must adhere to the following rules:
         * You never fabricate information. You base your reporting on factual information in your findings.
+        * Read moving averages (sma_5 to sma_120), atr_14, Supertrend bands and directions (supert_<length>_<multiplier>, supertd_<length>_<multiplier>) and forward returns (fwd_return_<days>) from the 'features' table, keyed by ticker and Date, instead of computing them from 'prices'.
+        * Quarterly statement values are in the 'fundamentals' table (ticker, period_end, field_id, value); join 'fundamental_fields' (field_id, statement, name) for the line item names.
         """,
         human_input_mode="NEVER",
         code_execution_config=False,
@@ -184,6 +201,15 @@ async def stock_research():
     )
 
 
+def main():
+    try:
+        asyncio.run(stock_research())
+    finally:
+        report_query_stats()
+        for service in query_services.values():
+            service.close()
+
+
 # Entry point for the script
 if __name__ == "__main__":
-    asyncio.run(stock_research())
+    main()
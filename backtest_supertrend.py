@@ -1,73 +1,96 @@
+import argparse
 import sqlite3
-import pandas as pd
 import numpy as np
+import pandas as pd
 from tqdm import tqdm
 import warnings
 
-warnings.simplefilter("ignore")
+from numeric import as_array, jit
+from partition import TickerPartition
+
+# This script keeps its own Supertrend variant rather than pandas_ta's: ATR is
+# a simple rolling mean of the true range (the first bar's range is just
+# High - Low), both final bands start at 0, each band ratchets only while the
+# previous close stayed on its side of it, and the line is the lower band
+# while the close is above the upper band. supertrend.py follows pandas_ta.
 
 
-def query_db(query, db_path="stock_data.db"):
+def query_db(query, db_path="stock_data.db", params=None):
     conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query(query, conn)
+    df = pd.read_sql_query(query, conn, params=params)
     conn.close()
     return df
 
 
-df = query_db("select * from prices limit 7000")
+def calculate_atr(high, low, close, length):
+    """ Rolling mean of the true range over length bars """
+    high, low, close = as_array(high), as_array(low), as_array(close)
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    return pd.Series(tr).rolling(window=length).mean().to_numpy()
+
+
+@jit
+def _final_bands_kernel(close, upper, lower):
+    n = len(close)
+    final_upper = np.zeros(n)
+    final_lower = np.zeros(n)
+    trend = np.zeros(n)
+    for i in range(1, n):
+        # min()/max() as Python evaluates them, so a NaN band carries through
+        if close[i - 1] <= final_upper[i - 1]:
+            final_upper[i] = final_upper[i - 1] if final_upper[i - 1] < upper[i] else upper[i]
+        else:
+            final_upper[i] = upper[i]
+        if close[i - 1] >= final_lower[i - 1]:
+            final_lower[i] = final_lower[i - 1] if final_lower[i - 1] > lower[i] else lower[i]
+        else:
+            final_lower[i] = lower[i]
+    for i in range(n):
+        trend[i] = final_lower[i] if close[i] > final_upper[i] else final_upper[i]
+    return trend
 
 
-def calculate_atr(df, length):
-    df["H-L"] = df["High"] - df["Low"]
-    df["H-PC"] = np.abs(df["High"] - df["Close"].shift(1))
-    df["L-PC"] = np.abs(df["Low"] - df["Close"].shift(1))
-    df["TR"] = df[["H-L", "H-PC", "L-PC"]].max(axis=1)
-    df["ATR"] = df["TR"].rolling(window=length).mean()
-    return df
+def supertrend_line(high, low, close, multiplier, length):
+    """ This script's Supertrend line over plain arrays """
+    high, low, close = as_array(high), as_array(low), as_array(close)
+    hl2 = (high + low) / 2
+    matr = multiplier * calculate_atr(high, low, close, length)
+    return _final_bands_kernel(close, hl2 + matr, hl2 - matr)
 
 
 # Function to calculate Supertrend
-def calculate_supertrend(df, multiplier, length):
-    data = calculate_atr(df, length)
-    data['BU'] = (data['High'] + data['Low']) / 2 + (multiplier * data['ATR'])
-    data['BL'] = (data['High'] + data['Low']) / 2 - (multiplier * data['ATR'])
-
-    # Initialize columns for Final Upper Band (FU), Final Lower Band (FL), and Supertrend
-    data['FU'] = 0.0
-    data['FL'] = 0.0
-    data[f'Supertrend_{multiplier}_{length}'] = 0.0
-
-    # Calculate Final Upper Band (FU) and Final Lower Band (FL)
-    for i in range(1, len(data)):
-        if data['Close'][i-1] <= data['FU'][i-1]:
-            data['FU'][i] = min(data['BU'][i], data['FU'][i-1])
-        else:
-            data['FU'][i] = data['BU'][i]
-
-        if data['Close'][i-1] >= data['FL'][i-1]:
-            data['FL'][i] = max(data['BL'][i], data['FL'][i-1])
-        else:
-            data['FL'][i] = data['BL'][i]
-
-    # Calculate Supertrend
-    for i in range(len(data)):
-        if data['Close'][i] > data['FU'][i]:
-            data[f'Supertrend_{multiplier}_{length}'][i] = data['FL'][i]
-        else:
-            data[f'Supertrend_{multiplier}_{length}'][i] = data['FU'][i]
-    return data
-
-
-# Apply Supertrend calculation for each ticker and each set of parameters
-tickers = df["ticker"].unique()
-results = []
-for ticker in tqdm(tickers):
-    ticker_df = df[df["ticker"] == ticker].sort_values(by="Date")
-    for factor, length in [(3, 12), (2, 11), (1, 10)]:
-        result_df = calculate_supertrend(ticker_df, factor, length)
-        results.append(result_df)
-
-# Combine all results
-final_df = pd.concat(results)
-pd.set_option("display.max_rows", None)
-print(final_df.tail()[["Date", "ticker", "Supertrend_1_10", "Supertrend_2_11", "Supertrend_3_12"]])
+def calculate_supertrend(data, multiplier, length):
+    """ Fill Supertrend_<multiplier>_<length> for every ticker of a TickerPartition """
+    data.fill(
+        f"Supertrend_{multiplier}_{length}",
+        lambda high, low, close: supertrend_line(high, low, close, multiplier, length),
+        ["High", "Low", "Close"],
+    )
+    return data.df
+
+
+def run(db_path="stock_data.db", limit=7000):
+    """ Supertrend_3_12, _2_11 and _1_10 over the first limit rows of prices """
+    df = query_db("select * from prices limit ?", db_path, [limit])
+    # Apply Supertrend calculation for each ticker and each set of parameters
+    data = TickerPartition(df)
+    final_df = data.df
+    for factor, length in tqdm([(3, 12), (2, 11), (1, 10)]):
+        final_df = calculate_supertrend(data, factor, length)
+    return final_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Supertrend on a sample of the prices table")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--limit", type=int, default=7000, help="rows of prices to read")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+    final_df = run(args.db, args.limit)
+    pd.set_option("display.max_rows", None)
+    print(final_df.tail()[["Date", "ticker", "Supertrend_1_10", "Supertrend_2_11", "Supertrend_3_12"]])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,145 +1,175 @@
 # IMPORTING PACKAGES
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import pandas as pd
-import numpy as np
+import argparse
+import os
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
 from tqdm import tqdm
-import pandas_ta as ta
+
+from indicator_cache import DEFAULT_MAX_BYTES, IndicatorCache
+from instrument import Metrics, frame_bytes, metrics
+from partition import CHUNK_ROWS, make_chunks, ticker_offsets
+from result_store import DEFAULT_RESULTS, ResultWriter, write_partition
+from supertrend import SUPERTREND_PARAMS, supertrend_grid, supertrend_grid_columns
+from universe import load_prices, ticker_fingerprints, to_days
 
 
-def query_db(query, db_path="stock_data.db"):
+def query_db(query, db_path="stock_data.db", params=None):
     conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query(query, conn)
+    df = pd.read_sql_query(query, conn, params=params)
     conn.close()
     return df
 
-# SUPERTREND CALCULATION
-def get_supertrend(high, low, close, lookback, multiplier):
-    
-    # ATR
-    
-    tr1 = pd.DataFrame(high - low)
-    tr2 = pd.DataFrame(abs(high - close.shift(1)))
-    tr3 = pd.DataFrame(abs(low - close.shift(1)))
-    frames = [tr1, tr2, tr3]
-    tr = pd.concat(frames, axis = 1, join = 'inner').max(axis = 1)
-    atr = tr.ewm(lookback).mean()
-    
-    # H/L AVG AND BASIC UPPER & LOWER BAND
-    
-    hl_avg = (high + low) / 2
-    upper_band = (hl_avg + multiplier * atr).dropna()
-    lower_band = (hl_avg - multiplier * atr).dropna()
-    
-    # FINAL UPPER BAND
-    
-    final_bands = pd.DataFrame(columns = ['upper', 'lower'])
-    final_bands.iloc[:,0] = [x for x in upper_band - upper_band]
-    final_bands.iloc[:,1] = final_bands.iloc[:,0]
-    
-    for i in range(len(final_bands)):
-        if i == 0:
-            final_bands.iloc[i,0] = 0
-        else:
-            if (upper_band[i] < final_bands.iloc[i-1,0]) | (close[i-1] > final_bands.iloc[i-1,0]):
-                final_bands.iloc[i,0] = upper_band[i]
-            else:
-                final_bands.iloc[i,0] = final_bands.iloc[i-1,0]
-    
-    # FINAL LOWER BAND
-    
-    for i in range(len(final_bands)):
-        if i == 0:
-            final_bands.iloc[i, 1] = 0
-        else:
-            if (lower_band[i] > final_bands.iloc[i-1,1]) | (close[i-1] < final_bands.iloc[i-1,1]):
-                final_bands.iloc[i,1] = lower_band[i]
-            else:
-                final_bands.iloc[i,1] = final_bands.iloc[i-1,1]
-    
-    # SUPERTREND
-    
-    supertrend = pd.DataFrame(columns = [f'supertrend_{lookback}'])
-    supertrend.iloc[:,0] = [x for x in final_bands['upper'] - final_bands['upper']]
-    
-    for i in range(len(supertrend)):
-        if i == 0:
-            supertrend.iloc[i, 0] = 0
-        elif supertrend.iloc[i-1, 0] == final_bands.iloc[i-1, 0] and close[i] < final_bands.iloc[i, 0]:
-            supertrend.iloc[i, 0] = final_bands.iloc[i, 0]
-        elif supertrend.iloc[i-1, 0] == final_bands.iloc[i-1, 0] and close[i] > final_bands.iloc[i, 0]:
-            supertrend.iloc[i, 0] = final_bands.iloc[i, 1]
-        elif supertrend.iloc[i-1, 0] == final_bands.iloc[i-1, 1] and close[i] > final_bands.iloc[i, 1]:
-            supertrend.iloc[i, 0] = final_bands.iloc[i, 1]
-        elif supertrend.iloc[i-1, 0] == final_bands.iloc[i-1, 1] and close[i] < final_bands.iloc[i, 1]:
-            supertrend.iloc[i, 0] = final_bands.iloc[i, 0]
-    
-    supertrend = supertrend.set_index(upper_band.index)
-    supertrend = supertrend.dropna()[1:]
-    
-    # ST UPTREND/DOWNTREND
-    
-    upt = []
-    dt = []
-    close = close.iloc[len(close) - len(supertrend):]
-
-    for i in range(1, len(supertrend)):
-        if close[i] > supertrend.iloc[i, 0]:
-            upt.append(supertrend.iloc[i, 0])
-            dt.append(np.nan)
-        elif close[i] < supertrend.iloc[i, 0]:
-            upt.append(np.nan)
-            dt.append(supertrend.iloc[i, 0])
-        else:
-            upt.append(np.nan)
-            dt.append(np.nan)
-            
-    st, upt, dt = pd.Series(supertrend.iloc[:, 0]), pd.Series(upt), pd.Series(dt)
-    # upt.index, dt.index = supertrend.index, supertrend.index
-    
-    return st, upt, dt
+def process_chunk(tickers, db_path="stock_data.db", params=SUPERTREND_PARAMS, profile_top=0, cache_dir=None):
+    """
+    Read a whole chunk of tickers with one query (or from a saved universe
+    when db_path is one) and compute the Supertrend grid for each, through
+    the indicator cache when cache_dir is set. Returns the result store frame
+    of the tickers that succeeded (their bars plus the Supertrend columns,
+    None when none did), the failed ones, and the chunk's metrics to merge.
+    """
+    chunk_metrics = Metrics(profile_top=profile_top)
+    with chunk_metrics.stage("read") as stage:
+        df = load_prices(db_path, tickers)
+        stage.add(rows=len(df), bytes_read=frame_bytes(df))
 
-def process_ticker(ticker):
-    df = query_db(f'select * from prices where ticker = "{ticker}"')
-    ticker_df = df.sort_values(by="Date")
-    results = []
-    for factor, length in [(3, 12), (2, 11), (1, 10)]:
-        sub_ticker_df = ta.supertrend(ticker_df['High'], ticker_df['Low'], ticker_df['Close'], length, factor)
-        output_df = pd.concat([ticker_df, sub_ticker_df], axis=1)
-        results.append(output_df)
-    combined_df = pd.concat(results, axis=1)
-    combined_df = combined_df.reset_index(drop=True)  # Ensure index is reset
-    combined_df = combined_df.loc[:, ~combined_df.columns.duplicated()]  # Remove duplicate columns if any
-    return combined_df
+    ticker_values = df["ticker"].to_numpy()
+    names, starts, ends = ticker_offsets(ticker_values)
 
-def main():
-    tickers = query_db('select distinct(ticker) from prices')["ticker"].tolist()
-    final_results = []
-    
-    with ThreadPoolExecutor(max_workers=100) as executor:
-        futures = {executor.submit(process_ticker, ticker): ticker for ticker in tickers}
-        for future in tqdm(as_completed(futures), total=len(futures)):
-            ticker = futures[future]
+    high, low, close = (df[column].to_numpy(np.float64) for column in ["High", "Low", "Close"])
+    cache = IndicatorCache(cache_dir) if cache_dir else None
+    days = to_days(df["Date"].to_numpy()) if cache else None
+    trend = np.full((len(df), len(params)), np.nan)
+    direction = np.zeros((len(df), len(params)), dtype=np.int8)
+    ok = np.ones(len(names), dtype=np.bool_)
+    errors = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        with chunk_metrics.stage("supertrend") as stage, chunk_metrics.profile(names[i]):
             try:
-                result = future.result()
-                final_results.append(result)
+                if cache is None:
+                    trend[start:end], direction[start:end] = supertrend_grid(high[start:end], low[start:end], close[start:end], params)
+                else:
+                    trend[start:end], direction[start:end] = cache.supertrend_grid(
+                        names[i], days[start:end], high[start:end], low[start:end], close[start:end], params,
+                    )
+                stage.add(rows=end - start)
             except Exception as exc:
-                print(f'Ticker {ticker} generated an exception: {exc}')
-    
-    # Ensure all indices are unique before concatenation
-    for i, df in enumerate(final_results):
-        df['unique_index'] = range(len(df))
-        final_results[i] = df.set_index('unique_index')
-    
-    final_df = pd.concat(final_results, axis=0, ignore_index=True)
-    return final_df
+                ok[i] = False
+                errors.append((names[i], type(exc).__name__, str(exc)))
+
+    if cache is not None:
+        for outcome, count in cache.counts.items():
+            chunk_metrics.add_stage(f"cache_{outcome}", 0.0, 0.0, calls=count)
+    frame = None
+    if ok.any():
+        keep = np.repeat(ok, ends - starts)
+        kept_starts = np.cumsum(np.concatenate([[0], (ends - starts)[ok][:-1]]))
+        indicators = supertrend_grid_columns(trend[keep], direction[keep], params, kept_starts)
+        frame = pd.DataFrame({**{column: df[column].to_numpy()[keep] for column in df.columns}, **indicators})
+    return {"frame": frame, "errors": errors, "metrics": chunk_metrics.snapshot()}
+
+def write_chunk(tickers, output_path, name, db_path="stock_data.db", params=SUPERTREND_PARAMS, profile_top=0, cache_dir=None,
+                compress=False):
+    """
+    Worker: process_chunk, then write the frame straight into the result
+    store as partition `name`, so the bars cross no process boundary. Returns
+    the manifest entry (None when every ticker failed), the frame's columns
+    and last rows, the failed tickers and the chunk's metrics.
+    """
+    result = process_chunk(tickers, db_path, params, profile_top, cache_dir)
+    frame = result.pop("frame")
+    result.update({"partition": None, "columns": None, "tail": None})
+    if frame is not None:
+        chunk_metrics = Metrics(profile_top=profile_top)
+        chunk_metrics.merge(result["metrics"])
+        with chunk_metrics.stage("write") as stage:
+            result["partition"] = write_partition(output_path, name, frame, compress)
+            stage.add(rows=len(frame))
+        result["metrics"] = chunk_metrics.snapshot()
+        result["columns"] = list(frame.columns)
+        result["tail"] = frame.tail(20)
+    return result
+
+def run_backtest(db_path="stock_data.db", output_path=DEFAULT_RESULTS, workers=None, chunk_rows=CHUNK_ROWS, compress=False,
+                 profile_top=0, cache_dir=None, cache_bytes=DEFAULT_MAX_BYTES, full=False):
+    """
+    Shard tickers over a process pool; each worker writes its chunk into the
+    result store and the parent only records it in the manifest. Unless full
+    is set, partitions of an earlier run whose tickers all still have the
+    same bar count, last date and last close are kept, and only the other
+    tickers are computed. With cache_dir, tickers whose bars haven't changed
+    since the last run reuse their cached Supertrends and ones that only
+    gained bars extend them. Returns the last rows written.
+    """
+    with metrics.stage("plan"):
+        fingerprints = ticker_fingerprints(db_path)
+        writer = ResultWriter(output_path, compress, resume=not full)
+        params = [[int(length), float(multiplier)] for length, multiplier in SUPERTREND_PARAMS]
+        kept = []
+        if writer.manifest.get("params") == params:
+            kept = [partition for partition in writer.manifest["partitions"] if partition.get("fingerprints")
+                    and all(fingerprints.get(ticker) == saved for ticker, saved in partition["fingerprints"].items())]
+        writer.keep(kept, params=params)
+        done = {ticker for partition in kept for ticker in partition["tickers"]}
+        rows = {ticker: fingerprint[0] for ticker, fingerprint in fingerprints.items() if ticker not in done}
+    print(f"{len(done)} tickers unchanged, {len(rows)} to compute")
+    chunks = make_chunks(rows, chunk_rows)
+    workers = workers or os.cpu_count()
+    tail = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(write_chunk, chunk, output_path, writer.reserve(), db_path, SUPERTREND_PARAMS, profile_top,
+                                   cache_dir, compress): chunk for chunk in chunks}
+        with tqdm(total=sum(rows.values()), unit="bars") as progress:
+            for future in as_completed(futures):
+                chunk = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    print(f'Chunk starting at {chunk[0]} ({len(chunk)} tickers) generated an exception: {exc}')
+                    for ticker in chunk:
+                        metrics.failure(ticker, type(exc).__name__, "chunk", str(exc))
+                    continue
+                metrics.merge(result["metrics"])
+                for ticker, cause, error in result["errors"]:
+                    print(f'Ticker {ticker} generated an exception: {error}')
+                    metrics.failure(ticker, cause, "supertrend", error)
+                if result["partition"] is not None:
+                    partition = result["partition"]
+                    partition["fingerprints"] = {ticker: fingerprints[ticker] for ticker in partition["tickers"]}
+                    writer.add(partition, result["columns"])
+                    tail = result["tail"]
+                progress.update(sum(rows[ticker] for ticker in chunk))
+    writer.close()
+    if cache_dir:
+        with metrics.stage("cache_evict"):
+            IndicatorCache(cache_dir, cache_bytes).evict()
+    return tail
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute Supertrend indicators for every ticker")
+    parser.add_argument("--db", default="stock_data.db", help="SQLite database or saved universe directory")
+    parser.add_argument("--out", default=DEFAULT_RESULTS, help="result store directory")
+    parser.add_argument("--compress", action="store_true", help="zip-compress each partition")
+    parser.add_argument("--full", action="store_true", help="recompute every ticker instead of only the changed ones")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of cores")
+    parser.add_argument("--metrics", default=None, help="JSON lines metrics file (defaults to $METRICS_PATH)")
+    parser.add_argument("--profile-top", type=int, default=0, help="keep cProfile output of the N slowest tickers")
+    parser.add_argument("--cache", default=None, help="indicator cache directory, e.g. indicator_cache")
+    parser.add_argument("--cache-mb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2, help="indicator cache size cap")
+    args = parser.parse_args()
 
-# Call the main function and print the last 20 rows of the selected columns
-final_df = main()
-columns_to_print = ['Date', 'ticker'] + [col for col in final_df.columns if col.startswith('SUPERT_')]
-print(final_df[columns_to_print].tail(20))
+    metrics.configure(args.metrics, args.profile_top)
+    with metrics.stage("backtest"):
+        tail = run_backtest(args.db, args.out, args.workers, compress=args.compress, profile_top=args.profile_top,
+                                  cache_dir=args.cache, cache_bytes=int(args.cache_mb * 1024 ** 2), full=args.full)
+    metrics.close()
+    if tail is not None:
+        # Print the last 20 rows of the selected columns
+        columns_to_print = ['Date', 'ticker'] + [col for col in tail.columns if col.startswith('SUPERT_')]
+        print(tail[columns_to_print])
 
-# Save the final dataframe to a CSV file
-final_df.to_csv("dataset.csv", index=False)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest_supertrend_2 import process_chunk
+from cli import COMMANDS
+from partition import TickerPartition
+from portfolio import simulate_portfolio
+from schema import connect, ensure_schema, upsert_dataframe
+from simulate import simulate_trades
+from supertrend import SUPERTREND_PARAMS, njit, param_grid, supertrend, supertrend_arrays, supertrend_grid
+
+try:
+    import pandas_ta as ta
+except ImportError:
+    ta = None
+
+# Benchmarks for the backtest paths on synthetic data, so they can be run
+# without stock_data.db or yfinance. Every size is N tickers x M bars in the
+# `prices` schema, generated deterministically from the seed; results go to
+# a JSON file that a later run can be compared against with --baseline.
+
+DEFAULT_SIZES = "10x1000,100x2500,500x5000"
+DEFAULT_OUTPUT = "benchmark.json"
+
+
+def synthetic_ohlc(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    spread = np.abs(rng.normal(0, 0.01, n)) * close
+    high = close + spread * rng.random(n)
+    low = close - spread * rng.random(n)
+    return pd.Series(high), pd.Series(low), pd.Series(close)
+
+
+def synthetic_prices(n_tickers, n_bars, seed=0, start="1990-01-01"):
+    """ n_tickers x n_bars of daily bars laid out like the `prices` table, rows in random order """
+    dates = pd.bdate_range(start, periods=n_bars).strftime("%Y-%m-%d %H:%M:%S").to_numpy()
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(n_tickers):
+        high, low, close = synthetic_ohlc(n_bars, seed + i)
+        open_ = (low + (high - low) * rng.random(n_bars)).to_numpy()
+        frames.append(pd.DataFrame({
+            "ticker": f"T{i:05d}",
+            "Date": dates,
+            "Open": open_,
+            "High": high.to_numpy(),
+            "Low": low.to_numpy(),
+            "Close": close.to_numpy(),
+            "Volume": rng.integers(1_000, 1_000_000, n_bars).astype(np.float64),
+            "Dividends": 0.0,
+            "Stock Splits": 0.0,
+        }))
+    prices = pd.concat(frames, ignore_index=True)
+    # Unordered like rows appended by concurrent ingest workers
+    return prices.iloc[rng.permutation(len(prices))].reset_index(drop=True)
+
+
+def write_prices(db_path, prices):
+    conn = connect(db_path)
+    ensure_schema(conn)
+    upsert_dataframe(conn, "prices", prices)
+    conn.close()
+
+
+def reference_supertrend(high, low, close, length, multiplier):
+    """ Row-by-row pandas loop equivalent to pandas_ta.supertrend, used as the slow baseline """
+    if ta is not None:
+        return ta.supertrend(high, low, close, length, multiplier)
+
+    high_low = high - low
+    if high_low.eq(0).any():
+        high_low += np.finfo(float).eps
+    prev_close = close.shift(1)
+    tr = pd.concat([high_low, high - prev_close, prev_close - low], axis=1).abs().max(axis=1)
+    tr.iloc[:1] = np.nan
+    matr = multiplier * tr.ewm(alpha=1.0 / length, min_periods=length).mean()
+    hl2 = 0.5 * (high + low)
+    upperband = hl2 + matr
+    lowerband = hl2 - matr
+
+    m = close.size
+    dir_, trend = [1] * m, [0] * m
+    long, short = [np.nan] * m, [np.nan] * m
+    for i in range(1, m):
+        if close.iloc[i] > upperband.iloc[i - 1]:
+            dir_[i] = 1
+        elif close.iloc[i] < lowerband.iloc[i - 1]:
+            dir_[i] = -1
+        else:
+            dir_[i] = dir_[i - 1]
+            if dir_[i] > 0 and lowerband.iloc[i] < lowerband.iloc[i - 1]:
+                lowerband.iloc[i] = lowerband.iloc[i - 1]
+            if dir_[i] < 0 and upperband.iloc[i] > upperband.iloc[i - 1]:
+                upperband.iloc[i] = upperband.iloc[i - 1]
+        if dir_[i] > 0:
+            trend[i] = long[i] = lowerband.iloc[i]
+        else:
+            trend[i] = short[i] = upperband.iloc[i]
+
+    props = f"_{length}_{float(multiplier)}"
+    return pd.DataFrame({
+        f"SUPERT{props}": trend,
+        f"SUPERTd{props}": dir_,
+        f"SUPERTl{props}": long,
+        f"SUPERTs{props}": short,
+    }, index=close.index)
+
+
+def check_parity(n=2000, params=((12, 3), (11, 2), (10, 1))):
+    high, low, close = synthetic_ohlc(n)
+    for length, factor in params:
+        expected = reference_supertrend(high, low, close, length, factor)
+        actual = supertrend(high, low, close, length, factor)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    if ta is not None:
+        print("parity ok against pandas_ta")
+    else:
+        # Not a parity check: tests/test_supertrend.py compares against pandas_ta itself
+        print("pandas_ta not installed, only checked against the reference loop")
+
+
+def timed(func, *args, repeat=3, setup=None):
+    """ Best wall time of repeat calls; setup() runs untimed before each call and returns extra args """
+    best = float("inf")
+    for _ in range(repeat):
+        extra = setup() if setup is not None else ()
+        start = time.perf_counter()
+        func(*args, *extra)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def supertrend_all(data, params=SUPERTREND_PARAMS):
+    """ The backtest's per-ticker Supertrend grid over a whole partition """
+    high, low, close = (data.df[column].to_numpy(np.float64) for column in ["High", "Low", "Close"])
+    for start, end in zip(data.starts, data.ends):
+        supertrend_grid(high[start:end], low[start:end], close[start:end], params)
+
+
+def signal_partition(prices):
+    """ Partition with the entry/exit columns of simulate_supertrend.py filled in """
+    data = TickerPartition(prices.rename(columns={"Close": "Close_x"}))
+    df = data.df
+    high, low, close = (df[column].to_numpy(np.float64) for column in ["High", "Low", "Close_x"])
+    above = np.zeros((len(df), len(SUPERTREND_PARAMS)), dtype=bool)
+    for start, end in zip(data.starts, data.ends):
+        trend, _ = supertrend_grid(high[start:end], low[start:end], close[start:end], SUPERTREND_PARAMS)
+        above[start:end] = close[start:end, None] > trend
+    df["entry"] = above.all(axis=1)
+    df["exit"] = above.sum(axis=1) <= 1
+    return data
+
+
+def bench_size(n_tickers, n_bars, workdir, seed=0, repeat=3):
+    """ Time every stage at one data size, returns {case: seconds} """
+    prices = synthetic_prices(n_tickers, n_bars, seed)
+    tickers = sorted(prices["ticker"].unique())
+    db_path = os.path.join(workdir, f"bench_{n_tickers}x{n_bars}.db")
+
+    def fresh_db():
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        return ()
+
+    results = {}
+    results["db_write"] = timed(write_prices, db_path, prices, repeat=repeat, setup=fresh_db)
+
+    def read_all():
+        conn = sqlite3.connect(db_path)
+        pd.read_sql_query("select * from prices order by ticker, Date", conn)
+        conn.close()
+
+    def read_by_ticker():
+        conn = sqlite3.connect(db_path)
+        for ticker in tickers:
+            pd.read_sql_query("select * from prices where ticker = ?", conn, params=[ticker])
+        conn.close()
+
+    results["db_read_all"] = timed(read_all, repeat=repeat)
+    results["db_read_by_ticker"] = timed(read_by_ticker, repeat=repeat)
+    results["partition"] = timed(TickerPartition, prices, repeat=repeat)
+    data = TickerPartition(prices)
+    results["supertrend"] = timed(supertrend_all, data, repeat=repeat)
+    results["backtest_chunk"] = timed(process_chunk, tickers, db_path, repeat=repeat)
+    signals = signal_partition(prices)
+    results["simulate"] = timed(simulate_trades, signals, "entry", "exit", repeat=repeat)
+    results["portfolio"] = timed(simulate_portfolio, signals, "entry", "exit", repeat=repeat)
+    return results
+
+
+def bench_supertrend_engine(repeat=3):
+    """ The engine against the row-by-row reference, plus a 50 x 50 parameter sweep """
+    results = {}
+    for n in (1_000, 5_000):
+        high, low, close = synthetic_ohlc(n)
+        results[f"supertrend_reference_{n}"] = timed(reference_supertrend, high, low, close, 12, 3, repeat=1)
+        results[f"supertrend_engine_{n}"] = timed(supertrend, high, low, close, 12, 3, repeat=repeat)
+
+    grid = param_grid(range(5, 55), np.linspace(0.5, 5.0, 50))
+    high, low, close = synthetic_ohlc(5_000)
+    results["supertrend_grid_looped_50x50"] = timed(
+        lambda: [supertrend_arrays(high, low, close, length, m) for length, m in grid], repeat=1
+    )
+    results["supertrend_grid_50x50"] = timed(supertrend_grid, high, low, close, grid, repeat=1)
+    return results
+
+
+def bench_startup(repeat=3):
+    """
+    Cold start of `cli.py -h` and of importing every cli.py target, each in a
+    fresh interpreter. Targets whose dependencies are not installed here are
+    skipped.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+
+    def run(*args):
+        subprocess.run([sys.executable, *args], cwd=root, check=True, capture_output=True)
+
+    results = {"cli_help": timed(run, "cli.py", "-h", repeat=repeat)}
+    modules = sorted({module for _, targets in COMMANDS.values() for module in targets.values()})
+    for module in modules:
+        try:
+            results[f"import_{module}"] = timed(run, "-c", f"import {module}", repeat=repeat)
+        except subprocess.CalledProcessError as e:
+            print(f"skipping import_{module}: {e.stderr.decode().strip().splitlines()[-1]}")
+    return results
+
+
+def environment():
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "numba": njit is not None,
+    }
+
+
+def parse_sizes(sizes):
+    return [tuple(int(part) for part in size.lower().split("x")) for size in sizes.split(",") if size]
+
+
+def compare(results, baseline_path, tolerance):
+    """ Print every case that got more than `tolerance` slower than in the baseline file, returns their count """
+    with open(baseline_path, "r") as file:
+        baseline = {(row["size"], row["case"]): row["seconds"] for row in json.load(file)["results"]}
+    regressions = 0
+    for row in results:
+        before = baseline.get((row["size"], row["case"]))
+        if before and row["seconds"] > before * (1 + tolerance):
+            regressions += 1
+            print(f"REGRESSION {row['size']} {row['case']}: {before:.4f}s -> {row['seconds']:.4f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backtest paths on synthetic prices")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated TICKERSxBARS sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="report the best of this many runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=None, help="earlier output to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument("--skip-engine", action="store_true", help="skip the parity check and reference timings")
+    parser.add_argument("--skip-startup", action="store_true", help="skip the cold start and import timings")
+    args = parser.parse_args()
+
+    results = []
+    if not args.skip_engine:
+        check_parity()
+        supertrend(*synthetic_ohlc(100), 10, 1)
+        for case, seconds in bench_supertrend_engine(args.repeat).items():
+            results.append({"size": "engine", "case": case, "seconds": seconds})
+
+    if not args.skip_startup:
+        for case, seconds in bench_startup(args.repeat).items():
+            results.append({"size": "startup", "case": case, "seconds": seconds})
+            print(f"{'startup':>12} {case:<32} {seconds:9.4f}s")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Compile (or load from cache) every jitted kernel before anything is timed
+        bench_size(2, 200, workdir, repeat=1)
+        for n_tickers, n_bars in parse_sizes(args.sizes):
+            size = f"{n_tickers}x{n_bars}"
+            for case, seconds in bench_size(n_tickers, n_bars, workdir, args.seed, args.repeat).items():
+                rows = n_tickers * n_bars
+                results.append({"size": size, "case": case, "seconds": seconds, "rows_per_second": rows / seconds})
+                print(f"{size:>12} {case:<20} {seconds:9.4f}s {rows / seconds:14,.0f} rows/s")
+
+    with open(args.out, "w") as file:
+        json.dump({"environment": environment(), "results": results}, file, indent=2)
+    print(f"Wrote {len(results)} results to {args.out}")
+
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
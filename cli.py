@@ -0,0 +1,92 @@
+import argparse
+import importlib
+import os
+import sys
+
+# Single entry point for the pipeline: python cli.py <command> [target] [options].
+# Each target is one of the scripts, run with the remaining options exactly
+# as if it were called directly, so `python cli.py scan --db x` is
+# `python scan.py --db x` and `-h` after a target shows that script's options.
+#
+# Only argparse and importlib load up front. A script, and with it pandas,
+# numba, yfinance or autogen, is imported once its command is chosen, so help
+# and dispatch take milliseconds; benchmark.py tracks the import time of every
+# target.
+
+# command: (help, {target: module}); the first target is the default
+COMMANDS = {
+    "ingest": ("download and maintain stock_data.db", {
+        "prices": "populate_db",
+        "ledger": "ingest_ledger",
+        "schema": "schema",
+        "adjust": "adjust",
+        "fundamentals": "fundamentals",
+        "universe": "universe",
+        "price-store": "price_store",
+    }),
+    "indicators": ("compute indicators over the stored prices", {
+        "backtest": "backtest_supertrend_2",
+        "features": "features",
+        "cache": "indicator_cache",
+        "sample": "backtest_supertrend",
+    }),
+    "simulate": ("simulate strategies over the indicators", {
+        "supertrend": "simulate_supertrend",
+        "sma-stack": "simulate_shitty_strategy",
+        "portfolio": "portfolio",
+        "panel": "panel",
+        "optimize": "optimize",
+    }),
+    "scan": ("today's entry and exit signals", {
+        "signals": "scan",
+    }),
+    "research": ("agent-driven strategy research", {
+        "agents": "analysis",
+    }),
+}
+
+
+def prog():
+    """ cli.py, or the console script name when installed from pyproject.toml """
+    return os.path.basename(sys.argv[0]) or "cli.py"
+
+
+def command_help(command):
+    help_text, targets = COMMANDS[command]
+    default = next(iter(targets))
+    lines = [f"usage: {prog()} {command} [target] [options]", "", help_text, "", "targets:"]
+    lines += [f"  {target:<14} {module}.py{' (default)' if target == default else ''}" for target, module in targets.items()]
+    lines += ["", f"{prog()} {command} <target> -h shows the options of a target"]
+    return "\n".join(lines)
+
+
+def resolve(command, rest):
+    """ (target, module, options) of a command line; a leading target name picks the script """
+    targets = COMMANDS[command][1]
+    if rest and rest[0] in targets:
+        return rest[0], targets[rest[0]], rest[1:]
+    target = next(iter(targets))
+    return target, targets[target], rest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog=prog(), description="Stock data, backtest and research pipeline",
+        epilog=f"{prog()} <command> -h lists the targets of a command",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for command, (help_text, _) in COMMANDS.items():
+        # Options belong to the target script, so the subparsers accept anything
+        subparsers.add_parser(command, help=help_text, add_help=False)
+    args, rest = parser.parse_known_args(argv)
+
+    if rest in (["-h"], ["--help"]):
+        print(command_help(args.command))
+        return
+    target, module, options = resolve(args.command, rest)
+    sys.argv = [f"{prog()} {args.command} {target}"] + options
+    importlib.import_module(module).main()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
-import pandas as pd
+from result_store import iter_partitions
 
-df = pd.read_csv("dataset.csv", nrows=100, low_memory=False)
-print(df.head())
\ No newline at end of file
+
+def main():
+    df = next(iter_partitions()).head(100)
+    print(df.head())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from indicators import ATR, SMA, HistoryChanged, Supertrend
+from partition import TickerPartition, make_chunks
+from schema import TABLES, connect, ensure_schema, quote, upsert_dataframe
+from supertrend import SUPERTREND_PARAMS, atr, supertrend_grid
+
+# Materializes the `features` table: one row per (ticker, Date) with the
+# indicators the research agents otherwise compute in window queries over
+# raw prices. Everything up to a bar only depends on that bar and earlier
+# ones, except the forward returns.
+#
+# A refresh is incremental. feature_state keeps each ticker's FeatureState,
+# the streaming indicators of indicators.py after its last materialized bar
+# plus the last FORWARD_DAYS[-1] dates and closes, stored as versioned JSON
+# (FeatureState.to_state) rather than pickled objects, so a refresh reads only the
+# bars after it, steps the state through them, writes their rows, and fills
+# in the forward returns of the earlier rows that were still open. The
+# result is bit for bit a rebuild from full history. A ticker is rebuilt
+# when its close on the last materialized bar no longer matches, i.e.
+# populate_db reloaded a restated history, or when a new bar changes values
+# already written (indicators.HistoryChanged), or when its saved state is
+# from another STATE_VERSION or other indicator parameters.
+
+SMA_WINDOWS = [5, 10, 20, 60, 120]
+ATR_LENGTH = 14
+FORWARD_DAYS = [1, 5, 10, 20]
+FEATURE_COLUMNS = [name for name, _ in TABLES["features"]["columns"]]
+FORWARD_COLUMNS = [f"fwd_return_{days}" for days in FORWARD_DAYS]
+CHUNK_ROWS = 250_000
+# Bumped whenever FeatureState.to_state changes shape; older states are rebuilt
+STATE_VERSION = 1
+
+
+def compute_features(ticker, dates, high, low, close):
+    """ Feature columns for one ticker's bars, oldest first """
+    closes = pd.Series(close)
+    columns = {"ticker": ticker, "Date": dates, "Close": close}
+    for window in SMA_WINDOWS:
+        # Same rolling mean simulate_shitty_strategy.py uses for its SMA stack
+        columns[f"sma_{window}"] = closes.rolling(window).mean().to_numpy()
+    columns[f"atr_{ATR_LENGTH}"] = atr(high, low, close, ATR_LENGTH)
+    trend, direction = supertrend_grid(high, low, close, SUPERTREND_PARAMS)
+    for i, (length, multiplier) in enumerate(SUPERTREND_PARAMS):
+        columns[f"supert_{length}_{multiplier}"] = trend[:, i]
+        columns[f"supertd_{length}_{multiplier}"] = direction[:, i].astype(np.int64)
+    for days in FORWARD_DAYS:
+        # Conventional sign: positive when the price rose over the next `days` bars
+        columns[f"fwd_return_{days}"] = (closes.shift(-days) / closes - 1).to_numpy()
+    return pd.DataFrame(columns, columns=FEATURE_COLUMNS)
+
+
+class FeatureState:
+    """ compute_features one batch of bars at a time """
+
+    def __init__(self):
+        self.smas = [SMA(window) for window in SMA_WINDOWS]
+        self.atr = ATR(ATR_LENGTH)
+        self.supertrends = [Supertrend(length, float(multiplier)) for length, multiplier in SUPERTREND_PARAMS]
+        # Dates and closes of the last FORWARD_DAYS[-1] bars, whose forward returns are still open
+        self.tail_dates = []
+        self.tail_closes = []
+
+    def batch(self, ticker, dates, high, low, close):
+        """
+        (feature rows of the new bars, ticker/Date/forward return rows of the
+        earlier bars those returns now reach). Raises HistoryChanged when the
+        new bars change rows already emitted; the state is then unusable.
+        """
+        high, low, close = (np.asarray(values, dtype=np.float64) for values in (high, low, close))
+        columns = {"ticker": ticker, "Date": dates, "Close": close}
+        atr_values = self.atr.batch(high, low, close)
+        for sma, window in zip(self.smas, SMA_WINDOWS):
+            columns[f"sma_{window}"] = sma.batch(close)
+        columns[f"atr_{ATR_LENGTH}"] = atr_values
+        for supertrend, (length, multiplier) in zip(self.supertrends, SUPERTREND_PARAMS):
+            trend, direction, _, _ = supertrend.batch(high, low, close)
+            columns[f"supert_{length}_{multiplier}"] = trend
+            columns[f"supertd_{length}_{multiplier}"] = direction.astype(np.int64)
+
+        # Forward returns over the open tail followed by the new bars
+        held = len(self.tail_closes)
+        closes = pd.Series(np.concatenate([np.asarray(self.tail_closes, dtype=np.float64), close]))
+        forward = {column: (closes.shift(-days) / closes - 1).to_numpy() for column, days in zip(FORWARD_COLUMNS, FORWARD_DAYS)}
+        for column, values in forward.items():
+            columns[column] = values[held:]
+        reopened = pd.DataFrame({"ticker": ticker, "Date": self.tail_dates, **{column: values[:held] for column, values in forward.items()}},
+                                columns=["ticker", "Date"] + FORWARD_COLUMNS)
+
+        keep = FORWARD_DAYS[-1]
+        self.tail_dates = [str(date) for date in (list(self.tail_dates) + list(dates))[-keep:]]
+        self.tail_closes = closes.to_numpy()[-keep:].tolist()
+        return pd.DataFrame(columns, columns=FEATURE_COLUMNS), reopened
+
+    def to_state(self):
+        """ The state as plain JSON data, tagged with STATE_VERSION """
+        return {
+            "version": STATE_VERSION,
+            "smas": [sma.to_state() for sma in self.smas],
+            "atr": self.atr.to_state(),
+            "supertrends": [supertrend.to_state() for supertrend in self.supertrends],
+            "tail_dates": list(self.tail_dates),
+            "tail_closes": list(self.tail_closes),
+        }
+
+    @classmethod
+    def from_state(cls, saved):
+        """ Rebuild from to_state() output; ValueError when it was saved by another version or other parameters """
+        if saved.get("version") != STATE_VERSION:
+            raise ValueError(f"feature state version {saved.get('version')}, expected {STATE_VERSION}")
+        state = cls()
+        state.smas = [SMA.from_state(sma) for sma in saved["smas"]]
+        state.atr = ATR.from_state(saved["atr"])
+        state.supertrends = [Supertrend.from_state(supertrend) for supertrend in saved["supertrends"]]
+        if [sma.window for sma in state.smas] != SMA_WINDOWS or state.atr.length != ATR_LENGTH or \
+                [(st.length, st.multiplier) for st in state.supertrends] != [(length, float(m)) for length, m in SUPERTREND_PARAMS]:
+            raise ValueError("feature state was saved with other indicator parameters")
+        state.tail_dates = list(saved["tail_dates"])
+        state.tail_closes = [float(close) for close in saved["tail_closes"]]
+        return state
+
+
+def stale_tickers(conn):
+    """
+    {ticker: last materialized Date, or None to rebuild from scratch} for every
+    ticker whose prices moved past its feature_state. A ticker is rebuilt when
+    it has no state or its close on the last materialized bar no longer
+    matches, i.e. populate_db reloaded a restated history.
+    """
+    rows = conn.execute(
+        """
+        WITH p AS (SELECT ticker, MAX(Date) AS last_date FROM prices GROUP BY ticker)
+        SELECT p.ticker, p.last_date, s.last_date, s.last_close,
+               (SELECT Close FROM prices WHERE ticker = s.ticker AND Date = s.last_date)
+        FROM p LEFT JOIN feature_state s ON s.ticker = p.ticker
+        """
+    ).fetchall()
+    stale = {}
+    for ticker, price_date, state_date, state_close, price_close in rows:
+        if state_date is None or price_close is None or state_close != price_close:
+            stale[ticker] = None
+        elif price_date > state_date:
+            stale[ticker] = state_date
+    return stale
+
+
+def _read_prices(conn, tickers):
+    # Only the bars after each ticker's saved state (all of them for a rebuild)
+    placeholders = ", ".join("?" for _ in tickers)
+    return pd.read_sql_query(
+        f"SELECT p.ticker, p.Date, p.High, p.Low, p.Close FROM prices p LEFT JOIN feature_state s ON s.ticker = p.ticker "
+        f"WHERE p.ticker IN ({placeholders}) AND p.Date > COALESCE(s.last_date, '') ORDER BY p.ticker, p.Date",
+        conn, params=tickers,
+    )
+
+
+def _load_state(saved):
+    """ The FeatureState of a feature_state row, None when it can't be used and the ticker needs a rebuild """
+    try:
+        return FeatureState.from_state(json.loads(saved))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        # Another STATE_VERSION, other parameters, or a state pickled by an older version
+        return None
+
+
+def _load_states(conn, tickers):
+    placeholders = ", ".join("?" for _ in tickers)
+    return {ticker: _load_state(state) for ticker, state in
+            conn.execute(f"SELECT ticker, state FROM feature_state WHERE ticker IN ({placeholders})", tickers)}
+
+
+def _rebuild(conn, ticker):
+    """ Drop a ticker's features and compute them again from its full history """
+    _drop(conn, [ticker])
+    bars = _read_prices(conn, [ticker])
+    state = FeatureState()
+    features, forward = state.batch(ticker, *(bars[column].to_numpy() for column in ["Date", "High", "Low", "Close"]))
+    return state, features, forward
+
+
+def _drop(conn, tickers):
+    conn.executemany("DELETE FROM features WHERE ticker = ?", [(ticker,) for ticker in tickers])
+    conn.executemany("DELETE FROM feature_state WHERE ticker = ?", [(ticker,) for ticker in tickers])
+
+
+def refresh_features(db_path="stock_data.db", full=False, chunk_rows=CHUNK_ROWS):
+    """ Bring the features table up to date with prices, returns the number of rows written """
+    conn = connect(db_path)
+    ensure_schema(conn)
+    if full:
+        conn.execute("DELETE FROM features")
+        conn.execute("DELETE FROM feature_state")
+    stale = stale_tickers(conn)
+    _drop(conn, [ticker for ticker, last_date in stale.items() if last_date is None])
+
+    # Bars each stale ticker will read
+    counts = dict(conn.execute(
+        "SELECT p.ticker, COUNT(*) FROM prices p LEFT JOIN feature_state s ON s.ticker = p.ticker "
+        "WHERE p.Date > COALESCE(s.last_date, '') GROUP BY p.ticker"
+    ).fetchall())
+    written = 0
+    for chunk in make_chunks({ticker: counts[ticker] for ticker in stale if ticker in counts}, chunk_rows):
+        states = _load_states(conn, chunk)
+        prices = _read_prices(conn, chunk)
+        data = TickerPartition(prices, presorted=True)
+        columns = [prices[column].to_numpy() for column in ["Date", "High", "Low", "Close"]]
+        frames, reopened, saved = [], [], []
+        for ticker, start, end in zip(data.tickers, data.starts, data.ends):
+            state = states.get(ticker, FeatureState())
+            if state is None:
+                # Saved by another version: only the bars after its last date were read
+                state, features, forward = _rebuild(conn, ticker)
+            else:
+                try:
+                    features, forward = state.batch(ticker, *(values[start:end] for values in columns))
+                except HistoryChanged:
+                    state, features, forward = _rebuild(conn, ticker)
+            frames.append(features)
+            reopened.append(forward)
+            saved.append((ticker, state.tail_dates[-1], float(state.tail_closes[-1]), json.dumps(state.to_state())))
+        if frames:
+            written += upsert_dataframe(conn, "features", pd.concat(frames, ignore_index=True), commit=False)
+            upsert_dataframe(conn, "features", pd.concat(reopened, ignore_index=True), commit=False)
+            conn.executemany("INSERT OR REPLACE INTO feature_state (ticker, last_date, last_close, state) VALUES (?, ?, ?, ?)", saved)
+        conn.commit()
+    conn.execute(f"ANALYZE {quote('features')}")
+    conn.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize the per-ticker daily features table")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--full", action="store_true", help="rebuild every ticker instead of only the stale ones")
+    args = parser.parse_args()
+    written = refresh_features(args.db, args.full)
+    print(f"Wrote {written} feature rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from schema import connect, ensure_schema, quote, upsert_dataframe
+from universe import text_to_days
+
+# Long-format store for the quarterly statements. yfinance hands each
+# statement over as a (line item x period) frame; stored as is, every new line
+# item became another column of income_statements / balance_sheets /
+# cash_flows. Here every value is one row of `fundamentals` keyed by (ticker,
+# period_end, field_id), and `fundamental_fields` interns each (statement,
+# line item) name to a small integer once.
+#
+# yfinance gives no filing date, so a period's values are only treated as
+# known REPORT_LAG_DAYS after the period ends (10-Q filings are due 40-45
+# days after the quarter). asof_join attaches to every price bar the latest
+# value known by then, so nothing leaks from the future.
+
+STATEMENTS = {
+    "income_statements": "income",
+    "balance_sheets": "balance",
+    "cash_flows": "cash_flow",
+}
+REPORT_LAG_DAYS = 45
+
+
+def melt_statement(dataframe, statement):
+    """
+    A statement frame as fetch_data returns it (ticker, index = period end,
+    one column per line item) as long rows: ticker, period_end, statement,
+    name, value. Empty line items are dropped.
+    """
+    items = [column for column in dataframe.columns if column not in ("ticker", "index")]
+    long = dataframe.melt(id_vars=["ticker", "index"], value_vars=items, var_name="name", value_name="value")
+    long["value"] = pd.to_numeric(long["value"], errors="coerce")
+    long = long.dropna(subset=["index", "value"]).rename(columns={"index": "period_end"})
+    long.insert(2, "statement", statement)
+    return long.reset_index(drop=True)
+
+
+def load_fields(conn):
+    """ {(statement, name): field_id} """
+    return {(statement, name): field_id for field_id, statement, name in
+            conn.execute("SELECT field_id, statement, name FROM fundamental_fields")}
+
+
+def intern_fields(conn, pairs):
+    """ field_id of every (statement, name), adding the ones not seen before """
+    fields = load_fields(conn)
+    new = sorted(set(pairs) - set(fields))
+    if new:
+        next_id = max(fields.values(), default=0) + 1
+        rows = [(next_id + i, statement, name) for i, (statement, name) in enumerate(new)]
+        conn.executemany("INSERT INTO fundamental_fields (field_id, statement, name) VALUES (?, ?, ?)", rows)
+        fields.update({(statement, name): field_id for field_id, statement, name in rows})
+    return fields
+
+
+def store_fundamentals(conn, long, commit=True):
+    """
+    Upsert melt_statement rows. Periods that drop out of yfinance's window
+    are kept, so the history grows with every ingest; restated values
+    replace the stored ones.
+    """
+    if long.empty:
+        return 0
+    fields = intern_fields(conn, zip(long["statement"], long["name"]))
+    rows = pd.DataFrame({
+        "ticker": long["ticker"],
+        "period_end": long["period_end"],
+        "field_id": [fields[pair] for pair in zip(long["statement"], long["name"])],
+        "value": long["value"],
+    })
+    return upsert_dataframe(conn, "fundamentals", rows, commit)
+
+
+def normalize(db_path="stock_data.db"):
+    """ Copy the wide statement tables of an existing stock_data.db into the long store """
+    conn = connect(db_path)
+    ensure_schema(conn)
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    total = 0
+    for table_name, statement in STATEMENTS.items():
+        if table_name not in existing:
+            continue
+        wide = pd.read_sql_query(f"SELECT * FROM {quote(table_name)}", conn)
+        total += store_fundamentals(conn, melt_statement(wide, statement), commit=False)
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    return total
+
+
+def resolve_fields(fields, dictionary):
+    """ field_id per requested name; "statement:name" picks one statement, a bare name must be unambiguous """
+    ids = {}
+    for field in fields:
+        statement, _, name = field.rpartition(":")
+        matches = [field_id for (s, n), field_id in dictionary.items() if n == name and (not statement or s == statement)]
+        if not matches:
+            raise KeyError(f"unknown fundamental field {field!r}")
+        if len(matches) > 1:
+            raise ValueError(f"{field!r} is in several statements; prefix it, e.g. 'income:{name}'")
+        ids[field] = matches[0]
+    return ids
+
+
+def load_fundamentals(db_path, fields, tickers=None):
+    """ Long frame (ticker, day, field, value) of the requested fields, day being the period end as int32 days """
+    conn = connect(db_path, readonly=True)
+    try:
+        ids = resolve_fields(fields, load_fields(conn))
+        names = {field_id: field for field, field_id in ids.items()}
+        placeholders = ", ".join("?" for _ in names)
+        df = pd.read_sql_query(
+            f"SELECT ticker, period_end, field_id, value FROM fundamentals WHERE field_id IN ({placeholders})",
+            conn, params=list(names),
+        )
+    finally:
+        conn.close()
+    if tickers is not None:
+        df = df[df["ticker"].isin(set(tickers))]
+    return pd.DataFrame({
+        "ticker": df["ticker"].to_numpy(),
+        "day": text_to_days(df["period_end"].to_numpy()),
+        "field": df["field_id"].map(names).to_numpy(),
+        "value": df["value"].to_numpy(np.float64),
+    })
+
+
+def asof_join(tickers, codes, days, fundamentals, lag_days=REPORT_LAG_DAYS):
+    """
+    For every price bar (codes into tickers, int32 days; e.g. a Universe's
+    codes and days) the latest value of each field whose period ended at
+    least lag_days before the bar. Returns {field: float64 array per bar},
+    NaN before the first known value.
+
+    Bars and values are both turned into one sortable int64 key, ticker code
+    in the high bits and day in the low ones, so a single searchsorted per
+    field finds each bar's latest value without a per-ticker loop.
+    """
+    position = {ticker: i for i, ticker in enumerate(tickers)}
+    codes = np.asarray(codes, dtype=np.int64)
+    bar_keys = (codes << 32) + (np.asarray(days, dtype=np.int64) + 2 ** 31)
+    out = {}
+    for field, group in fundamentals.groupby("field", sort=False):
+        value_codes = group["ticker"].map(position)
+        known = value_codes.notna().to_numpy()
+        value_codes = value_codes.to_numpy()[known].astype(np.int64)
+        available = group["day"].to_numpy(np.int64)[known] + lag_days
+        if not len(value_codes):
+            out[field] = np.full(len(codes), np.nan)
+            continue
+        keys = (value_codes << 32) + (available + 2 ** 31)
+        order = np.argsort(keys, kind="stable")
+        keys, values = keys[order], group["value"].to_numpy(np.float64)[known][order]
+        # Last value with key <= the bar's key, if it belongs to the same ticker
+        index = np.searchsorted(keys, bar_keys, side="right") - 1
+        same = (index >= 0) & ((keys[np.maximum(index, 0)] >> 32) == codes)
+        out[field] = np.where(same, values[np.maximum(index, 0)], np.nan)
+    return out
+
+
+def attach(universe, db_path, fields, lag_days=REPORT_LAG_DAYS):
+    """ Add the as-of value of each field to a Universe's columns (and so to its panels and frames) """
+    fundamentals = load_fundamentals(db_path, fields, universe.tickers)
+    joined = asof_join(universe.tickers, universe.codes, universe.days, fundamentals, lag_days)
+    for field in fields:
+        universe.columns[field] = joined.get(field, np.full(len(universe.days), np.nan))
+    return universe
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-format fundamentals store")
+    parser.add_argument("command", choices=["normalize", "fields"])
+    parser.add_argument("--db", default="stock_data.db")
+    args = parser.parse_args()
+    if args.command == "normalize":
+        print(f"Stored {normalize(args.db)} fundamental values")
+    else:
+        conn = connect(args.db, readonly=True)
+        for (statement, name), field_id in sorted(load_fields(conn).items()):
+            print(f"{field_id:>6} {statement}:{name}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
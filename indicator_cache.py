@@ -0,0 +1,179 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+
+from indicators import RMA, HistoryChanged, TrueRange, _run, _supertrend_step_kernel
+
+# Persistent cache of computed indicator series. An entry is addressed by the
+# hash of (ticker, indicator name, parameters) and holds the output arrays,
+# the indicator's streaming state after the last bar, and a fingerprint of the
+# input bars it was computed from: their count, last date and a digest of
+# their bytes.
+#
+# A lookup compares the fingerprint against the current bars. Identical bars
+# are a hit. Bars that extend the cached ones unchanged are an append: the
+# saved state (indicators.py objects resume from it) runs over just the new
+# bars. Anything else, e.g. history restated by a split, is recomputed.
+# Entries are .npz files written atomically, so backtest workers in several
+# processes can share one cache; evict() trims it to max_bytes, least
+# recently used first.
+
+DEFAULT_CACHE = "indicator_cache"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def _digest(inputs, n):
+    digest = hashlib.blake2b(digest_size=16)
+    for values in inputs:
+        digest.update(np.ascontiguousarray(values[:n]).tobytes())
+    return np.frombuffer(digest.digest(), dtype=np.uint8)
+
+
+class SupertrendGrid:
+    """
+    Resumable supertrend.supertrend_grid: batch() returns (trend, direction)
+    as (bar x params) arrays. Like supertrend_grid it computes the true range
+    once and the ATR once per distinct length, and keeps one band state per
+    (length, multiplier).
+    """
+
+    def __init__(self, params):
+        self.params = [(int(length), float(multiplier)) for length, multiplier in params]
+        self.true_range = TrueRange()
+        self.rmas = {length: RMA(length) for length, _ in self.params}
+        self.states = [[0.0] * 4 for _ in self.params]
+
+    def batch(self, high, low, close):
+        high, low, close = (np.ascontiguousarray(values, dtype=np.float64) for values in (high, low, close))
+        tr = self.true_range.batch(high, low, close)
+        atrs = {length: rma.batch(tr) for length, rma in self.rmas.items()}
+        hl2 = 0.5 * (high + low)
+        n = len(close)
+        trend = np.empty((n, len(self.params)))
+        direction = np.empty((n, len(self.params)), dtype=np.int8)
+        for j, ((length, multiplier), state) in enumerate(zip(self.params, self.states)):
+            matr = multiplier * atrs[length]
+            outputs = [np.empty(n), np.empty(n, dtype=np.int64), np.empty(n), np.empty(n)]
+            values, signs, _, _ = _run(_supertrend_step_kernel, [close, hl2 + matr, hl2 - matr], state, outputs)
+            trend[:, j], direction[:, j] = values, signs
+        return trend, direction
+
+
+class IndicatorCache:
+    def __init__(self, root=DEFAULT_CACHE, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.counts = {"hit": 0, "append": 0, "miss": 0}
+
+    def path(self, ticker, name, params):
+        key = hashlib.sha1(json.dumps([ticker, name, params], default=str).encode()).hexdigest()
+        return os.path.join(self.root, key[:2], key + ".npz")
+
+    def _read(self, path):
+        try:
+            with np.load(path) as entry:
+                return {name: entry[name] for name in entry.files}
+        except (OSError, ValueError, EOFError):
+            return None
+
+    def _write(self, path, outputs, indicator, n, last_date, digest):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {f"out_{i}": values for i, values in enumerate(outputs)}
+        state = np.frombuffer(pickle.dumps(indicator), dtype=np.uint8)
+        scratch = f"{path}.{os.getpid()}.tmp"
+        with open(scratch, "wb") as file:
+            np.savez(file, n=n, last_date=last_date, digest=digest, state=state, **arrays)
+        os.replace(scratch, path)
+
+    def compute(self, ticker, name, params, factory, inputs, dates):
+        """
+        factory() builds a fresh indicator whose batch(*inputs) returns an
+        array or a tuple of arrays, one value per bar, and which carries on
+        from where it stopped when batch() is called again (as indicators.py
+        objects do). dates are the bars' int64 or int32 dates. Returns the
+        outputs for all bars as a tuple and records hit, append or miss.
+        """
+        dates = np.asarray(dates)
+        n = len(dates)
+        path = self.path(ticker, name, params)
+        entry = self._read(path) if os.path.exists(path) else None
+        if entry is not None:
+            cached = int(entry["n"])
+            if 0 < cached <= n and int(entry["last_date"]) == int(dates[cached - 1]) \
+                    and np.array_equal(entry["digest"], _digest([dates, *inputs], cached)):
+                outputs = tuple(entry[f"out_{i}"] for i in range(sum(name.startswith("out_") for name in entry)))
+                if cached == n:
+                    self.counts["hit"] += 1
+                    os.utime(path)
+                    return outputs
+                indicator = pickle.loads(entry["state"].tobytes())
+                try:
+                    new = indicator.batch(*(values[cached:] for values in inputs))
+                except HistoryChanged:
+                    new = None
+                if new is not None:
+                    new = new if isinstance(new, tuple) else (new,)
+                    outputs = tuple(np.concatenate([old, values]) for old, values in zip(outputs, new))
+                    self._write(path, outputs, indicator, n, dates[-1], _digest([dates, *inputs], n))
+                    self.counts["append"] += 1
+                    return outputs
+
+        indicator = factory()
+        outputs = indicator.batch(*inputs)
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        if n:
+            self._write(path, outputs, indicator, n, dates[-1], _digest([dates, *inputs], n))
+        self.counts["miss"] += 1
+        return outputs
+
+    def supertrend_grid(self, ticker, dates, high, low, close, params):
+        """ Cached supertrend.supertrend_grid of one ticker """
+        inputs = [np.ascontiguousarray(values, dtype=np.float64) for values in (high, low, close)]
+        params = [(int(length), float(multiplier)) for length, multiplier in params]
+        # Versioned: entries pickled before SupertrendGrid shared its ATRs hold another layout
+        return self.compute(ticker, "supertrend_grid.2", params, lambda: SupertrendGrid(params), inputs, dates)
+
+    def entries(self):
+        """ (mtime, size, path) of every entry """
+        found = []
+        if not os.path.isdir(self.root):
+            return found
+        for directory in os.scandir(self.root):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if entry.name.endswith(".npz"):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+
+    def evict(self, max_bytes=None):
+        """ Delete least recently used entries until the cache fits in max_bytes; returns (entries, bytes) left """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > max_bytes:
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return len(entries), total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or trim the indicator cache")
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--max-mb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2, help="evict down to this size")
+    args = parser.parse_args()
+    cache = IndicatorCache(args.cache, int(args.max_mb * 1024 ** 2))
+    entries, size = cache.evict()
+    print(f"{entries} entries, {size / 1024 ** 2:.1f} MB in {args.cache}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+import math
+import sys
+
+import numpy as np
+
+from numeric import as_array, jit, njit
+
+# Streaming versions of the indicators in supertrend.py and the pandas
+# rolling mean. Each object keeps a few floats of state (plus the window for
+# SMA), so a new bar costs O(1) instead of a full-history recompute:
+#
+#     st = Supertrend(10, 1.0)
+#     trend, direction, long, short = st.batch(high, low, close)  # whole history
+#     trend, direction, long, short = st.update(h, l, c)           # each new bar
+#
+# batch() and update() run the same kernels (update() calls the plain Python
+# version, which skips numba's dispatch and array overhead for a single bar),
+# and a fresh object's batch() output is bit-for-bit what
+# true_range/rma/atr/supertrend_arrays and Series.rolling(window).mean()
+# return for the same array. RollingATR is the streaming form of
+# backtest_supertrend.calculate_atr.
+#
+# to_state() returns an indicator's parameters and state as plain JSON-able
+# lists and numbers (floats round-trip exactly), and from_state() rebuilds
+# it, so callers can persist indicators without pickling the classes.
+
+
+class HistoryChanged(ValueError):
+    """ A new bar changes values already emitted; rebuild the indicator from full history """
+
+
+EPSILON = sys.float_info.epsilon
+
+
+def _python(kernel):
+    return getattr(kernel, "py_func", kernel)
+
+
+def _run(kernel, inputs, state, outputs, *args):
+    """
+    Run a kernel over whole arrays, resuming from and saving back the
+    indicator's state list. Returns the output arrays.
+    """
+    if njit is None:
+        # Plain Python indexes lists much faster than NumPy arrays
+        inputs = [as_array(values).tolist() for values in inputs]
+        kernel(*inputs, *args, state, *outputs)
+        return outputs
+    inputs = [as_array(values) for values in inputs]
+    state_array = np.array(state, dtype=np.float64)
+    kernel(*inputs, *args, state_array, *outputs)
+    state[:] = state_array.tolist()
+    return outputs
+
+
+@jit
+def _sma_kernel(values, window, min_periods, ring, state, out):
+    """
+    pandas' roll_mean (Kahan-compensated running sum) one bar at a time,
+    NaN until the window holds min_periods (at least 1) values.
+    state: count, nobs, sum, negative count, add/remove compensation,
+    run length of equal values and the previous value. ring holds the last
+    `window` inputs so the one leaving the window can be subtracted.
+    """
+    count, nobs, sum_x, neg_ct = state[0], state[1], state[2], state[3]
+    comp_add, comp_remove, same, prev = state[4], state[5], state[6], state[7]
+    for i in range(len(values)):
+        val = values[i]
+        slot = int(count) % window
+        if count == 0 or window == 1:
+            # pandas re-seeds the sums whenever the window doesn't overlap the last one
+            nobs, sum_x, neg_ct, comp_add, comp_remove, same, prev = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, val
+        elif count >= window:
+            old = ring[slot]
+            if old == old:
+                nobs -= 1
+                y = -old - comp_remove
+                t = sum_x + y
+                comp_remove = t - sum_x - y
+                sum_x = t
+                if math.copysign(1.0, old) < 0:
+                    neg_ct -= 1
+        if val == val:
+            nobs += 1
+            y = val - comp_add
+            t = sum_x + y
+            comp_add = t - sum_x - y
+            sum_x = t
+            if math.copysign(1.0, val) < 0:
+                neg_ct += 1
+            if val == prev:
+                same += 1
+            else:
+                same = 1.0
+            prev = val
+        ring[slot] = val
+        count += 1
+
+        if nobs >= min_periods and nobs > 0:
+            result = sum_x / nobs
+            if same >= nobs:
+                result = prev
+            elif neg_ct == 0 and result < 0:
+                result = 0.0
+            elif neg_ct == nobs and result > 0:
+                result = 0.0
+            out[i] = result
+        else:
+            out[i] = np.nan
+    state[0], state[1], state[2], state[3] = count, nobs, sum_x, neg_ct
+    state[4], state[5], state[6], state[7] = comp_add, comp_remove, same, prev
+
+
+@jit
+def _ewm_kernel(values, alpha, min_periods, state, out):
+    """ pandas' ewm(alpha, adjust=True).mean() recurrence; state: count, weighted, old weight, nobs """
+    count, weighted, old_wt, nobs = state[0], state[1], state[2], state[3]
+    old_wt_factor = 1.0 - alpha
+    for i in range(len(values)):
+        cur = values[i]
+        is_obs = cur == cur
+        if count == 0:
+            weighted = cur
+            old_wt = 1.0
+            nobs = 1.0 if is_obs else 0.0
+        else:
+            if is_obs:
+                nobs += 1
+            if weighted == weighted:
+                old_wt *= old_wt_factor
+                if is_obs:
+                    if weighted != cur:
+                        weighted = ((old_wt * weighted) + cur) / (old_wt + 1.0)
+                    old_wt += 1.0
+            elif is_obs:
+                weighted = cur
+        count += 1
+        out[i] = weighted if nobs >= min_periods else np.nan
+    state[0], state[1], state[2], state[3] = count, weighted, old_wt, nobs
+
+
+@jit
+def _true_range_kernel(high, low, close, nudge, state, out):
+    """ pandas_ta true range; state: count, previous close """
+    count, prev_close = state[0], state[1]
+    for i in range(len(close)):
+        high_low = high[i] - low[i]
+        if nudge:
+            high_low = high_low + EPSILON
+        if count == 0:
+            out[i] = np.nan
+        else:
+            # np.fmax(|high - low|, np.fmax(|high - prev close|, |prev close - low|))
+            a, b, c = abs(high_low), abs(high[i] - prev_close), abs(prev_close - low[i])
+            if b != b or c >= b:
+                b = c if c == c or b != b else b
+            if a != a or b >= a:
+                a = b if b == b or a != a else a
+            out[i] = a
+        prev_close = close[i]
+        count += 1
+    state[0], state[1] = count, prev_close
+
+
+@jit
+def _plain_true_range_kernel(high, low, close, state, out):
+    """ backtest_supertrend's true range: no nudge, high - low on the first bar; state: count, previous close """
+    count, prev_close = state[0], state[1]
+    for i in range(len(close)):
+        high_low = high[i] - low[i]
+        if count == 0:
+            out[i] = high_low
+        else:
+            # np.fmax(high - low, np.fmax(|high - prev close|, |low - prev close|))
+            b, c = abs(high[i] - prev_close), abs(low[i] - prev_close)
+            b = c if b != b or c > b else b
+            out[i] = b if high_low != high_low or b > high_low else high_low
+        prev_close = close[i]
+        count += 1
+    state[0], state[1] = count, prev_close
+
+
+@jit
+def _supertrend_step_kernel(close, upper, lower, state, trend, direction, long, short):
+    """ _supertrend_kernel resumed from state: count, previous upper, lower and direction """
+    count, prev_upper, prev_lower, prev_direction = state[0], state[1], state[2], state[3]
+    for i in range(len(close)):
+        up, lo = upper[i], lower[i]
+        long[i] = np.nan
+        short[i] = np.nan
+        if count == 0:
+            trend[i] = 0.0
+            direction[i] = 1
+        else:
+            if close[i] > prev_upper:
+                direction[i] = 1
+            elif close[i] < prev_lower:
+                direction[i] = -1
+            else:
+                direction[i] = int(prev_direction)
+                if direction[i] > 0 and lo < prev_lower:
+                    lo = prev_lower
+                if direction[i] < 0 and up > prev_upper:
+                    up = prev_upper
+            if direction[i] > 0:
+                trend[i] = lo
+                long[i] = lo
+            else:
+                trend[i] = up
+                short[i] = up
+        prev_upper, prev_lower, prev_direction = up, lo, direction[i]
+        count += 1
+    state[0], state[1], state[2], state[3] = count, prev_upper, prev_lower, prev_direction
+
+
+class SMA:
+    """ Simple moving average, equal to Series.rolling(window).mean() """
+
+    def __init__(self, window):
+        self.window = int(window)
+        self.ring = np.full(self.window, np.nan)
+        self.state = [0.0] * 8
+
+    def batch(self, values):
+        out = np.empty(len(values))
+        return _run(_sma_kernel, [values], self.state, [out], self.window, self.window, self.ring)[0]
+
+    def update(self, value):
+        out = [0.0]
+        _python(_sma_kernel)([float(value)], self.window, self.window, self.ring, self.state, out)
+        return out[0]
+
+    def to_state(self):
+        return {"window": self.window, "state": list(self.state), "ring": self.ring.tolist()}
+
+    @classmethod
+    def from_state(cls, saved):
+        sma = cls(saved["window"])
+        sma.state = [float(value) for value in saved["state"]]
+        sma.ring = np.array(saved["ring"], dtype=np.float64)
+        return sma
+
+
+class EMA:
+    """ Exponential moving average, equal to Series.ewm(alpha=alpha, min_periods=min_periods).mean() """
+
+    def __init__(self, alpha, min_periods=0):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.state = [0.0] * 4
+
+    def batch(self, values):
+        out = np.empty(len(values))
+        return _run(_ewm_kernel, [values], self.state, [out], self.alpha, self.min_periods)[0]
+
+    def update(self, value):
+        out = [0.0]
+        _python(_ewm_kernel)([float(value)], self.alpha, self.min_periods, self.state, out)
+        return out[0]
+
+    def to_state(self):
+        return {"alpha": float(self.alpha), "min_periods": int(self.min_periods), "state": list(self.state)}
+
+    @classmethod
+    def from_state(cls, saved):
+        ema = cls.__new__(cls)
+        EMA.__init__(ema, saved["alpha"], saved["min_periods"])
+        ema.state = [float(value) for value in saved["state"]]
+        return ema
+
+
+class RMA(EMA):
+    """ Wilder's moving average, equal to supertrend.rma """
+
+    def __init__(self, length):
+        super().__init__(1.0 / length, max(int(length), 1))
+
+
+class TrueRange:
+    """ Equal to supertrend.true_range """
+
+    def __init__(self):
+        self.nudge = False
+        self.state = [0.0] * 2
+
+    def _check_nudge(self, zero_range):
+        # pandas_ta nudges every bar's range once any bar has high == low, so
+        # the first such bar after some output rewrites that output
+        if zero_range and not self.nudge:
+            if self.state[0] > 0:
+                raise HistoryChanged("a bar with high == low changes the true range of every earlier bar")
+            self.nudge = True
+
+    def batch(self, high, low, close):
+        self._check_nudge(bool((as_array(high) - as_array(low) == 0).any()))
+        out = np.empty(len(close))
+        return _run(_true_range_kernel, [high, low, close], self.state, [out], self.nudge)[0]
+
+    def update(self, high, low, close):
+        high, low, close = float(high), float(low), float(close)
+        self._check_nudge(high - low == 0)
+        out = [0.0]
+        _python(_true_range_kernel)([high], [low], [close], self.nudge, self.state, out)
+        return out[0]
+
+    def to_state(self):
+        return {"nudge": self.nudge, "state": list(self.state)}
+
+    @classmethod
+    def from_state(cls, saved):
+        true_range = cls()
+        true_range.nudge = bool(saved["nudge"])
+        true_range.state = [float(value) for value in saved["state"]]
+        return true_range
+
+
+class ATR:
+    """ Wilder ATR, equal to supertrend.atr """
+
+    def __init__(self, length):
+        self.length = length
+        self.true_range = TrueRange()
+        self.rma = RMA(length)
+
+    def batch(self, high, low, close):
+        return self.rma.batch(self.true_range.batch(high, low, close))
+
+    def update(self, high, low, close):
+        return self.rma.update(self.true_range.update(high, low, close))
+
+    def to_state(self):
+        return {"length": int(self.length), "true_range": self.true_range.to_state(), "rma": self.rma.to_state()}
+
+    @classmethod
+    def from_state(cls, saved):
+        atr = cls(saved["length"])
+        atr.true_range = TrueRange.from_state(saved["true_range"])
+        atr.rma = RMA.from_state(saved["rma"])
+        return atr
+
+
+class PlainTrueRange:
+    """ The true range backtest_supertrend.calculate_atr averages """
+
+    def __init__(self):
+        self.state = [0.0] * 2
+
+    def batch(self, high, low, close):
+        out = np.empty(len(close))
+        return _run(_plain_true_range_kernel, [high, low, close], self.state, [out])[0]
+
+    def update(self, high, low, close):
+        out = [0.0]
+        _python(_plain_true_range_kernel)([float(high)], [float(low)], [float(close)], self.state, out)
+        return out[0]
+
+    def to_state(self):
+        return {"state": list(self.state)}
+
+    @classmethod
+    def from_state(cls, saved):
+        true_range = cls()
+        true_range.state = [float(value) for value in saved["state"]]
+        return true_range
+
+
+class RollingATR:
+    """ Rolling-mean ATR, equal to backtest_supertrend.calculate_atr """
+
+    def __init__(self, length):
+        self.length = length
+        self.true_range = PlainTrueRange()
+        self.sma = SMA(length)
+
+    def batch(self, high, low, close):
+        return self.sma.batch(self.true_range.batch(high, low, close))
+
+    def update(self, high, low, close):
+        return self.sma.update(self.true_range.update(high, low, close))
+
+    def to_state(self):
+        return {"length": int(self.length), "true_range": self.true_range.to_state(), "sma": self.sma.to_state()}
+
+    @classmethod
+    def from_state(cls, saved):
+        atr = cls(saved["length"])
+        atr.true_range = PlainTrueRange.from_state(saved["true_range"])
+        atr.sma = SMA.from_state(saved["sma"])
+        return atr
+
+
+class Supertrend:
+    """ Equal to supertrend.supertrend_arrays: batch/update return (trend, direction, long, short) """
+
+    def __init__(self, length=7, multiplier=3.0):
+        self.length = length
+        self.multiplier = multiplier
+        self.atr = ATR(length)
+        self.state = [0.0] * 4
+
+    def batch(self, high, low, close):
+        high, low, close = as_array(high), as_array(low), as_array(close)
+        matr = self.multiplier * self.atr.batch(high, low, close)
+        hl2 = 0.5 * (high + low)
+        n = len(close)
+        outputs = [np.empty(n), np.empty(n, dtype=np.int64), np.empty(n), np.empty(n)]
+        return tuple(_run(_supertrend_step_kernel, [close, hl2 + matr, hl2 - matr], self.state, outputs))
+
+    def update(self, high, low, close):
+        high, low, close = float(high), float(low), float(close)
+        matr = self.multiplier * self.atr.update(high, low, close)
+        hl2 = 0.5 * (high + low)
+        outputs = [[0.0], [0], [0.0], [0.0]]
+        _python(_supertrend_step_kernel)([close], [hl2 + matr], [hl2 - matr], self.state, *outputs)
+        return tuple(values[0] for values in outputs)
+
+    def to_state(self):
+        return {"length": int(self.length), "multiplier": float(self.multiplier), "atr": self.atr.to_state(), "state": list(self.state)}
+
+    @classmethod
+    def from_state(cls, saved):
+        supertrend = cls(saved["length"], saved["multiplier"])
+        supertrend.atr = ATR.from_state(saved["atr"])
+        supertrend.state = [float(value) for value in saved["state"]]
+        return supertrend
+
+
+def batch_by_ticker(data, factory, columns):
+    """
+    One indicator per ticker of a TickerPartition, each initialized from its
+    full history: {ticker: indicator}. factory() builds a fresh indicator and
+    columns name the arrays its batch() takes.
+    """
+    indicators = {}
+    sources = [data.df[column].to_numpy() for column in columns]
+    for ticker, start, end in zip(data.tickers, data.starts, data.ends):
+        indicator = factory()
+        indicator.batch(*(source[start:end] for source in sources))
+        indicators[ticker] = indicator
+    return indicators
@@ -0,0 +1,240 @@
+import argparse
+import os
+import zlib
+from datetime import datetime, timedelta
+
+from schema import TABLES, connect, create_table_sql, ensure_schema, quote, table_columns
+
+# Job ledger of populate_db. ingest_status holds one row per (ticker,
+# dataset): the status of its last fetch ("ok", "failed", or "unsupported"
+# when yfinance has no such data for the ticker), the rows it stored, the
+# error class and message of a failure, consecutive failed attempts, and the
+# times of the last attempt and the last success. The BatchWriter records it
+# in the same transaction as the rows themselves, so after a crash the ledger
+# never claims more than the database holds.
+#
+# plan() turns the ledger into the work of the next run: datasets that
+# succeeded within max_age_hours are skipped, so a rerun after a crash
+# resumes where the last one stopped; with failed_only only failed datasets
+# are retried; and tickers go stalest first, never fetched before anything
+# else. shard() splits the ticker list by a stable hash so several
+# processes or machines can each ingest into their own database file, and
+# merge() folds those shard files into one database.
+
+STATUS_TABLE = "ingest_status"
+DEFAULT_MAX_AGE_HOURS = 12.0
+# Built from the ingested tables by features.py and adjust.py; rebuild them after a merge
+DERIVED_TABLES = {"features", "feature_state", "prices_adjusted", "adjustment_state"}
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def now():
+    return datetime.now().strftime(TIME_FORMAT)
+
+
+def status_rows(ticker, outcomes, when=None):
+    """
+    Ledger rows of one ticker from fetch_ticker's outcomes ({dataset: (rows,
+    error)}, error being None or (error class, message)).
+    """
+    when = when or now()
+    rows = []
+    for dataset, (count, error) in outcomes.items():
+        if error is None:
+            rows.append((ticker, dataset, "ok", count, None, None, 0, when, when))
+        elif error[0] == "NotImplementedError":
+            # A definite answer, so it counts as done
+            rows.append((ticker, dataset, "unsupported", 0, error[0], error[1], 0, when, when))
+        else:
+            rows.append((ticker, dataset, "failed", None, error[0], error[1], 1, when, None))
+    return rows
+
+
+def failed_rows(ticker, datasets, error, when=None):
+    """ Ledger rows marking every dataset of a ticker failed with one (error class, message) """
+    return status_rows(ticker, {dataset: (None, error) for dataset in datasets}, when)
+
+
+def record_status(conn, rows, commit=False):
+    """
+    Upsert status_rows. A failure keeps the last success time and row count
+    and counts the attempt; a success resets the count.
+    """
+    conn.executemany(
+        f"INSERT INTO {STATUS_TABLE} (ticker, dataset, status, rows, error_class, error, attempts, last_attempt, last_success) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (ticker, dataset) DO UPDATE SET status = excluded.status, "
+        "rows = COALESCE(excluded.rows, rows), error_class = excluded.error_class, error = excluded.error, "
+        "attempts = CASE WHEN excluded.status = 'failed' THEN attempts + 1 ELSE 0 END, "
+        "last_attempt = excluded.last_attempt, last_success = COALESCE(excluded.last_success, last_success)",
+        rows,
+    )
+    if commit:
+        conn.commit()
+
+
+def load_ledger(conn):
+    """ {ticker: {dataset: (status, last_success)}} """
+    ledger = {}
+    for ticker, dataset, status, last_success in conn.execute(
+        f"SELECT ticker, dataset, status, last_success FROM {STATUS_TABLE}"
+    ):
+        ledger.setdefault(ticker, {})[dataset] = (status, last_success)
+    return ledger
+
+
+def plan(ledger, tickers, datasets, max_age_hours=DEFAULT_MAX_AGE_HOURS, failed_only=False):
+    """
+    [(ticker, [datasets to fetch])] for the next run, stalest ticker first.
+    A dataset is done when it succeeded within max_age_hours (0 or None
+    fetches everything); failed_only keeps just the datasets that failed.
+    """
+    cutoff = (datetime.now() - timedelta(hours=max_age_hours)).strftime(TIME_FORMAT) if max_age_hours else None
+    work = []
+    for position, ticker in enumerate(tickers):
+        entries = ledger.get(ticker, {})
+        if failed_only:
+            todo = [dataset for dataset in datasets if entries.get(dataset, (None,))[0] == "failed"]
+        else:
+            todo = [
+                dataset for dataset in datasets
+                if cutoff is None or entries.get(dataset, (None, None))[0] == "failed"
+                or (entries.get(dataset, (None, None))[1] or "") < cutoff
+            ]
+        if todo:
+            # Never succeeded sorts before any date
+            stalest = min((entries.get(dataset, (None, None))[1] or "") for dataset in todo)
+            work.append((stalest, position, ticker, todo))
+    work.sort()
+    return [(ticker, todo) for _, _, ticker, todo in work]
+
+
+def shard(tickers, index, count):
+    """ The tickers of shard index (0-based) out of count, by a hash that is the same on every machine """
+    return [ticker for ticker in tickers if zlib.crc32(ticker.encode()) % count == index]
+
+
+def parse_shard(text):
+    """ "i/n" (1-based, as on the command line) as (index, count) """
+    index, _, count = text.partition("/")
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(f"shard {text!r} is not of the form i/n with 1 <= i <= n")
+    return index - 1, count
+
+
+def shard_path(db_path, index, count):
+    """ stock_data.db -> stock_data.shard-2-of-4.db for index 1 of 4 """
+    stem, extension = os.path.splitext(db_path)
+    return f"{stem}.shard-{index + 1}-of-{count}{extension}"
+
+
+def _copy_table(conn, table_name, columns, where):
+    column_list = ", ".join(quote(column) for column in columns)
+    conn.execute(f"DELETE FROM main.{quote(table_name)} WHERE ticker IN (SELECT ticker FROM temp.merge_tickers)")
+    conn.execute(
+        f"INSERT OR REPLACE INTO main.{quote(table_name)} ({column_list}) "
+        f"SELECT {column_list} FROM shard.{quote(table_name)} {where}"
+    )
+
+
+def merge(db_path, sources, full=False):
+    """
+    Fold shard databases into db_path. Shards own disjoint tickers, so each
+    ticker's rows in every ingested table are replaced by the shard's copy,
+    inside SQLite (ATTACH and INSERT ... SELECT) in one transaction per shard.
+    Only tickers the shard's ledger attempted since the last merge are copied
+    unless full is set or the shard has no ledger. Fundamental field ids are
+    interned per database, so they are remapped by (statement, name).
+    Returns {source: tickers copied}.
+    """
+    from fundamentals import intern_fields
+
+    conn = connect(db_path)
+    ensure_schema(conn)
+    copied = {}
+    for source in sources:
+        conn.execute("ATTACH DATABASE ? AS shard", [source])
+        try:
+            shard_tables = {row[0] for row in conn.execute("SELECT name FROM shard.sqlite_master WHERE type = 'table'")}
+            conn.execute("CREATE TEMP TABLE merge_tickers (ticker TEXT PRIMARY KEY)")
+            has_ledger = STATUS_TABLE in shard_tables and conn.execute(f"SELECT 1 FROM shard.{STATUS_TABLE} LIMIT 1").fetchone()
+            if has_ledger and not full:
+                conn.execute(
+                    f"INSERT OR IGNORE INTO temp.merge_tickers SELECT s.ticker FROM shard.{STATUS_TABLE} s "
+                    f"LEFT JOIN main.{STATUS_TABLE} m ON m.ticker = s.ticker AND m.dataset = s.dataset "
+                    "WHERE m.last_attempt IS NULL OR s.last_attempt > m.last_attempt"
+                )
+            else:
+                for table_name in shard_tables & set(TABLES):
+                    if "ticker" in dict(TABLES[table_name]["columns"]):
+                        conn.execute(f"INSERT OR IGNORE INTO temp.merge_tickers SELECT DISTINCT ticker FROM shard.{quote(table_name)}")
+            where = "WHERE ticker IN (SELECT ticker FROM temp.merge_tickers)"
+
+            for table_name in sorted(shard_tables & set(TABLES) - DERIVED_TABLES - {"fundamentals", "fundamental_fields"}):
+                info = conn.execute(f"PRAGMA shard.table_info({quote(table_name)})").fetchall()
+                columns = [(row[1], row[2] or "BLOB") for row in info]
+                conn.execute(create_table_sql(table_name, TABLES[table_name], columns))
+                existing = set(table_columns(conn, table_name))
+                for column, sql_type in columns:
+                    if column not in existing:
+                        conn.execute(f"ALTER TABLE main.{quote(table_name)} ADD COLUMN {quote(column)} {sql_type}")
+                _copy_table(conn, table_name, [column for column, _ in columns], where)
+
+            if {"fundamentals", "fundamental_fields"} <= shard_tables:
+                intern_fields(conn, conn.execute("SELECT statement, name FROM shard.fundamental_fields").fetchall())
+                conn.execute("DELETE FROM main.fundamentals WHERE ticker IN (SELECT ticker FROM temp.merge_tickers)")
+                conn.execute(
+                    "INSERT OR REPLACE INTO main.fundamentals (ticker, period_end, field_id, value) "
+                    "SELECT f.ticker, f.period_end, m.field_id, f.value FROM shard.fundamentals f "
+                    "JOIN shard.fundamental_fields s ON s.field_id = f.field_id "
+                    "JOIN main.fundamental_fields m ON m.statement = s.statement AND m.name = s.name "
+                    "WHERE f.ticker IN (SELECT ticker FROM temp.merge_tickers)"
+                )
+            copied[source] = conn.execute("SELECT COUNT(*) FROM temp.merge_tickers").fetchone()[0]
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.execute("DROP TABLE IF EXISTS temp.merge_tickers")
+            conn.execute("DETACH DATABASE shard")
+    conn.execute("ANALYZE")
+    conn.close()
+    return copied
+
+
+def summary(db_path="stock_data.db"):
+    """ Item counts per dataset and status, and the most common error classes """
+    import pandas as pd
+
+    conn = connect(db_path, readonly=True)
+    try:
+        by_status = pd.read_sql_query(
+            f"SELECT dataset, status, COUNT(*) AS items, MIN(last_success) AS oldest_success "
+            f"FROM {STATUS_TABLE} GROUP BY dataset, status ORDER BY dataset, status", conn)
+        errors = pd.read_sql_query(
+            f"SELECT error_class, COUNT(*) AS items, MAX(attempts) AS max_attempts FROM {STATUS_TABLE} "
+            "WHERE status = 'failed' GROUP BY error_class ORDER BY items DESC", conn)
+    finally:
+        conn.close()
+    return by_status, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the ingest ledger or merge shard databases")
+    parser.add_argument("command", choices=["status", "merge"])
+    parser.add_argument("shards", nargs="*", help="shard databases to merge into --db")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--full", action="store_true", help="copy every ticker of each shard, not only the ones attempted since the last merge")
+    args = parser.parse_args()
+    if args.command == "merge":
+        for source, count in merge(args.db, args.shards, args.full).items():
+            print(f"Merged {count} tickers from {source}")
+    else:
+        by_status, errors = summary(args.db)
+        print(by_status.to_string(index=False))
+        if not errors.empty:
+            print(errors.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
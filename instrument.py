@@ -0,0 +1,224 @@
+import cProfile
+import heapq
+import json
+import marshal
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Lightweight run metrics shared by populate_db, backtest_supertrend_2 and the
+# simulate scripts. Stages accumulate wall time, CPU time, rows and bytes
+# read; failures are counted per (stage, cause). Each failure is appended to
+# a JSON lines file as it happens and close() appends one summary line with
+# the stage totals, failure counts, peak RSS and I/O counters. With
+# profile_top > 0 the work wrapped in profile(key) runs under cProfile and the
+# slowest profile_top keys are dumped as .prof files next to the log.
+#
+# Only one cProfile profiler can be active per process (Python 3.12+ raises
+# ValueError for a second one), so when populate_db's fetch threads overlap
+# only one of them is profiled at a time and the others run unprofiled.
+#
+# Scripts call metrics.configure() once at startup; the file is their
+# --metrics flag or else METRICS_PATH from the environment. Without either
+# the summary is only printed.
+
+
+# Held while a profile() block runs, by whichever thread of the process got it
+_PROFILER = threading.Lock()
+
+
+def peak_rss(who=None):
+    """ Peak resident set size in bytes of this process (or its finished children), None if unknown """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def io_counters():
+    """ Bytes this process read through syscalls (rchar) and from storage (read_bytes), Linux only """
+    try:
+        with open("/proc/self/io", "r") as file:
+            counters = dict(line.split(": ") for line in file.read().splitlines())
+        return {name: int(counters[name]) for name in ["rchar", "read_bytes"]}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def frame_bytes(dataframe):
+    """ In-memory size of what was read into a DataFrame, the bytes_read measure for SQLite and CSV reads """
+    return int(dataframe.memory_usage(index=False, deep=True).sum())
+
+
+class Stage:
+    """ Handle yielded by Metrics.stage(); add() rows and bytes while the stage runs """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.bytes_read = 0
+
+    def add(self, rows=0, bytes_read=0):
+        self.rows += int(rows)
+        self.bytes_read += int(bytes_read)
+
+
+class Metrics:
+    def __init__(self, path=None, profile_top=0):
+        self.lock = threading.Lock()
+        self._reset(path, profile_top)
+
+    def configure(self, path=None, profile_top=0):
+        """ Reset all counters and start a fresh log at path (or $METRICS_PATH) """
+        path = path or os.environ.get("METRICS_PATH")
+        self._reset(path, profile_top)
+        if path:
+            open(path, "w").close()
+
+    def _reset(self, path, profile_top):
+        with self.lock:
+            self.path = path
+            self.profile_top = profile_top
+            self.stages = {}
+            self.failures = {}
+            self.profiles = []  # min-heap of (wall, key, stats)
+            self.started = time.time()
+            self.io_start = io_counters()
+
+    def _write(self, event):
+        if self.path:
+            with open(self.path, "a") as file:
+                file.write(json.dumps(event, default=str) + "\n")
+
+    def add_stage(self, name, wall, cpu, rows=0, bytes_read=0, calls=1, max_wall=None):
+        with self.lock:
+            totals = self.stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "rows": 0, "bytes_read": 0, "max_wall": 0.0})
+            totals["calls"] += calls
+            totals["wall"] += wall
+            totals["cpu"] += cpu
+            totals["rows"] += rows
+            totals["bytes_read"] += bytes_read
+            totals["max_wall"] = max(totals["max_wall"], wall if max_wall is None else max_wall)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a block. CPU time is the whole process's, so a stage that waits
+        on worker threads is charged for their work too.
+        """
+        handle = Stage(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield handle
+        finally:
+            self.add_stage(name, time.perf_counter() - wall, time.process_time() - cpu, handle.rows, handle.bytes_read)
+
+    def failure(self, ticker, cause, stage, message=""):
+        """ Count one failed unit of work; cause is usually the exception class name """
+        key = f"{stage}:{cause}"
+        with self.lock:
+            self.failures[key] = self.failures.get(key, 0) + 1
+            self._write({"event": "failure", "time": time.time(), "ticker": ticker, "stage": stage, "cause": cause, "message": message})
+
+    def add_profile(self, key, wall, stats):
+        with self.lock:
+            entry = (wall, str(key), stats)
+            if len(self.profiles) < self.profile_top:
+                heapq.heappush(self.profiles, entry)
+            elif self.profiles and wall > self.profiles[0][0]:
+                heapq.heapreplace(self.profiles, entry)
+
+    @contextmanager
+    def profile(self, key):
+        """
+        Run a block under cProfile, keeping it if it is among the slowest
+        profile_top. The block runs unprofiled while another one in this
+        process holds the profiler.
+        """
+        if not self.profile_top or not _PROFILER.acquire(blocking=False):
+            yield
+            return
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # A profiler from outside Metrics (e.g. python -m cProfile) is already active
+                profiler = None
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.create_stats()
+                    self.add_profile(key, time.perf_counter() - start, profiler.stats)
+        finally:
+            _PROFILER.release()
+
+    def snapshot(self):
+        """ Plain-data copy of the counters, to send back from a worker process and merge() """
+        with self.lock:
+            return {
+                "stages": {name: dict(totals) for name, totals in self.stages.items()},
+                "failures": dict(self.failures),
+                "profiles": list(self.profiles),
+                "peak_rss": peak_rss(),
+            }
+
+    def merge(self, snapshot):
+        for name, totals in snapshot["stages"].items():
+            self.add_stage(name, totals["wall"], totals["cpu"], totals["rows"], totals["bytes_read"], totals["calls"], totals["max_wall"])
+        with self.lock:
+            for key, count in snapshot["failures"].items():
+                self.failures[key] = self.failures.get(key, 0) + count
+        for wall, key, stats in snapshot["profiles"]:
+            self.add_profile(key, wall, stats)
+
+    def summary(self):
+        io_end = io_counters()
+        with self.lock:
+            return {
+                "event": "summary",
+                "time": time.time(),
+                "elapsed": time.time() - self.started,
+                "stages": self.stages,
+                "failures": self.failures,
+                "peak_rss": peak_rss(),
+                "peak_rss_children": peak_rss(resource.RUSAGE_CHILDREN) if resource is not None else None,
+                "io": {name: io_end[name] - self.io_start.get(name, 0) for name in io_end},
+                "profiles": [{"key": key, "wall": wall} for wall, key, _ in sorted(self.profiles, reverse=True)],
+            }
+
+    def close(self):
+        """ Print the stage totals and write the summary line and any profiles """
+        summary = self.summary()
+        for name, totals in summary["stages"].items():
+            print(f"{name:<16} {totals['calls']:>8} calls {totals['wall']:10.2f}s wall {totals['cpu']:10.2f}s cpu "
+                  f"{totals['rows']:>12,} rows {totals['bytes_read'] / 1024 ** 2:10.1f} MB read")
+        for key, count in sorted(summary["failures"].items(), key=lambda item: -item[1]):
+            print(f"failed {key}: {count}")
+        if summary["peak_rss"] is not None:
+            print(f"peak RSS {summary['peak_rss'] / 1024 ** 2:.0f} MB")
+        self._write(summary)
+
+        if self.path and self.profiles:
+            directory = self.path + ".profiles"
+            os.makedirs(directory, exist_ok=True)
+            for _, key, stats in self.profiles:
+                # Same format as Profile.dump_stats, readable with pstats / snakeviz
+                with open(os.path.join(directory, key.replace(os.sep, "_") + ".prof"), "wb") as file:
+                    marshal.dump(stats, file)
+        return summary
+
+
+# The process-wide collector the scripts record into
+metrics = Metrics()
@@ -0,0 +1,21 @@
+import numpy as np
+
+# Helpers shared by the numeric kernels. numba is optional: without it the
+# kernels run as plain Python loops, which is still far faster than per-row
+# pandas indexing, but numba is what gets a ticker down to about a
+# millisecond. Callers check `njit is None` to hand the plain loops lists,
+# which Python indexes much faster than NumPy arrays.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def jit(func):
+    """ numba.njit(cache=True) when numba is installed, otherwise func unchanged """
+    return njit(cache=True)(func) if njit is not None else func
+
+
+def as_array(values):
+    """ A contiguous float64 array of values """
+    return np.ascontiguousarray(np.asarray(values, dtype=np.float64))
@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from partition import make_chunks, ticker_offsets
+from price_store import dates_to_int64
+from simulate import find_trades
+from supertrend import supertrend_grid
+from universe import date_bounds, load_prices, ticker_rows
+
+# Walk-forward search over Supertrend ladder strategies. A config is a
+# ladder of `rungs` Supertrends starting at (length, multiplier) and stepping
+# both by one, e.g. length 10, multiplier 1, 3 rungs is the hand-picked
+# (12, 3), (11, 2), (10, 1) of the simulate scripts. Entry is every rung's
+# Supertrend below the close, exit is most of them above it, as in
+# simulate_supertrend.py.
+#
+# Work is split by ticker chunk. A worker computes the Supertrend of every
+# distinct (length, multiplier) in the grid once per ticker (sharing the ATR
+# between multipliers), then reuses those arrays for every config and fold.
+# It returns the trade statistics per (config, fold, train/test); a trade
+# counts in the window it was entered in and is closed at that window's last
+# bar if it runs past it, so train scores never see test prices. Each
+# finished chunk is checkpointed, so an interrupted run resumes where it
+# stopped.
+
+STATS = ["trades", "sum", "sum_sq", "sum_log", "wins"]
+SPLITS = ["train", "test"]
+RUN_FILE = "run.json"
+# Bumped when the statistics change meaning, so old checkpoints aren't mixed in
+RUN_VERSION = 2
+CHUNK_ROWS = 100_000
+NS_PER_YEAR = int(365.25 * 86_400 * 10 ** 9)
+
+
+def ladder(length, multiplier, rungs=1):
+    """ The (length, multiplier) pairs of one config, widest first like SUPERTREND_PARAMS """
+    return [(int(length) + i, float(multiplier) + i) for i in reversed(range(rungs))]
+
+
+def make_configs(lengths, multipliers, rungs=1):
+    return [ladder(length, multiplier, rungs) for length in lengths for multiplier in multipliers]
+
+
+def make_folds(first, last, train_years=5, test_years=1):
+    """
+    Rolling walk-forward windows over [first, last] (int64 ns): each fold
+    trains on train_years and tests on the test_years right after it, and the
+    next fold starts test_years later. Returns [(train_start, test_start, test_end)].
+    """
+    train, test = int(train_years * NS_PER_YEAR), int(test_years * NS_PER_YEAR)
+    folds = []
+    start = first
+    while start + train < last:
+        folds.append((start, start + train, min(start + train + test, last + 1)))
+        start += test
+    return folds
+
+
+def window_ends(starts, ends, dates, bounds):
+    """ Per ticker, the last row dated before each bound: shaped (bound, ticker), start - 1 when there is none """
+    last = np.empty((len(bounds), len(starts)), dtype=np.int64)
+    for t, (start, end) in enumerate(zip(starts, ends)):
+        last[:, t] = start + np.searchsorted(dates[start:end], bounds, side="left") - 1
+    return last
+
+
+def fold_stats(starts, ends, dates, close, entry, exit, folds):
+    """
+    Trade statistics of one config's signals, shaped (fold, split, stat).
+    A trade belongs to the window it was entered in and is closed at the
+    window's last bar if it is still open there, so no trade is scored on
+    prices from after its window, and trades still open when the data ends
+    count too.
+    """
+    entry_rows, exit_rows, _ = find_trades(starts, ends, entry, exit, keep_open=True)
+    ticker = np.searchsorted(starts, entry_rows, side="right") - 1
+    entered = dates[entry_rows]
+    bounds = np.array([bound for fold in folds for bound in fold[1:]], dtype=np.int64)
+    last = window_ends(starts, ends, dates, bounds).reshape(len(folds), len(SPLITS), len(starts))
+    stats = np.zeros((len(folds), len(SPLITS), len(STATS)))
+    for f, fold in enumerate(folds):
+        for split in range(len(SPLITS)):
+            lo, hi = fold[split], fold[split + 1]
+            inside = (entered >= lo) & (entered < hi)
+            exits = np.minimum(exit_rows[inside], last[f, split, ticker[inside]])
+            r = close[exits] / close[entry_rows[inside]] - 1
+            r = r[np.isfinite(r)]
+            stats[f, split] = [len(r), r.sum(), (r * r).sum(), np.log1p(r).sum(), (r > 0).sum()]
+    return stats
+
+
+def evaluate_chunk(tickers, db_path, configs, folds):
+    """ Worker: trade statistics of every config on a chunk of tickers, shaped (config, fold, split, stat) """
+    df = load_prices(db_path, tickers, ["High", "Low", "Close"])
+    _, starts, ends = ticker_offsets(df["ticker"].to_numpy())
+    dates = dates_to_int64(df["Date"])
+    high, low, close = (df[column].to_numpy(np.float64) for column in ["High", "Low", "Close"])
+
+    params = sorted({pair for config in configs for pair in config})
+    column = {pair: j for j, pair in enumerate(params)}
+    above = np.zeros((len(df), len(params)), dtype=bool)
+    for start, end in zip(starts, ends):
+        trend, _ = supertrend_grid(high[start:end], low[start:end], close[start:end], params)
+        above[start:end] = close[start:end, None] > trend
+
+    stats = np.zeros((len(configs), len(folds), len(SPLITS), len(STATS)))
+    for c, config in enumerate(configs):
+        count = above[:, [column[pair] for pair in config]].sum(axis=1)
+        stats[c] = fold_stats(starts, ends, dates, close, count == len(config), count * 2 < len(config), folds)
+    return stats
+
+
+def _summarize(stats, prefix):
+    trades = stats[..., 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = stats[..., 1] / trades
+        std = np.sqrt(np.maximum(stats[..., 2] / trades - mean ** 2, 0) * trades / (trades - 1))
+        return {
+            f"{prefix}_trades": trades,
+            f"{prefix}_mean_return": mean,
+            f"{prefix}_geo_return": np.expm1(stats[..., 3] / trades),
+            f"{prefix}_win_rate": stats[..., 4] / trades,
+            f"{prefix}_t_stat": mean / std * np.sqrt(trades),
+        }
+
+
+def rank_configs(stats, configs, rank_by="test_mean_return"):
+    """
+    One row per config with in-sample (train) and out-of-sample (test)
+    statistics pooled over all folds, plus how many folds were profitable
+    out of sample, sorted by rank_by.
+    """
+    pooled = stats.sum(axis=1)
+    columns = {"config": [json.dumps(config) for config in configs]}
+    columns.update(_summarize(pooled[:, 0], "train"))
+    columns.update(_summarize(pooled[:, 1], "test"))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fold_means = stats[:, :, 1, 1] / stats[:, :, 1, 0]
+    columns["test_folds_positive"] = (fold_means > 0).sum(axis=1)
+    columns["folds"] = np.full(len(configs), stats.shape[1])
+    return pd.DataFrame(columns).sort_values(rank_by, ascending=False, na_position="last").reset_index(drop=True)
+
+
+def walk_forward_selection(stats, configs, metric="mean_return"):
+    """ Per fold, the config that did best in training and how it then did in the test window """
+    rows = []
+    for f in range(stats.shape[1]):
+        train = _summarize(stats[:, f, 0], "train")[f"train_{metric}"]
+        test = _summarize(stats[:, f, 1], "test")
+        if np.isnan(train).all():
+            continue
+        best = int(np.nanargmax(train))
+        rows.append({"fold": f, "config": json.dumps(configs[best]), f"train_{metric}": train[best],
+                     **{name: values[best] for name, values in test.items()}})
+    return pd.DataFrame(rows)
+
+
+def _chunk_file(checkpoint, i):
+    return os.path.join(checkpoint, f"chunk-{i:05d}.npy")
+
+
+def load_run(checkpoint, db_path, configs, folds, chunk_rows):
+    """ Chunks of a checkpointed run, or plan a new one; a resumed run must search the same grid """
+    path = os.path.join(checkpoint, RUN_FILE)
+    run = {"version": RUN_VERSION, "db": db_path, "configs": configs, "folds": folds}
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            saved = json.load(file)
+        if {key: saved.get(key) for key in run} != json.loads(json.dumps(run)):
+            raise ValueError(f"{checkpoint} holds a different search; pick another --checkpoint or delete it")
+        return saved["chunks"]
+
+    run["chunks"] = make_chunks(ticker_rows(db_path), chunk_rows)
+    os.makedirs(checkpoint, exist_ok=True)
+    with open(path + ".tmp", "w") as file:
+        json.dump(run, file)
+    os.replace(path + ".tmp", path)
+    return run["chunks"]
+
+
+def optimize(db_path, configs, train_years=5, test_years=1, checkpoint="optimize", workers=None, chunk_rows=CHUNK_ROWS):
+    """ Run (or resume) the search and return the summed statistics, shaped (config, fold, split, stat) """
+    first, last = date_bounds(db_path)
+    folds = make_folds(first, last, train_years, test_years)
+    if not folds:
+        raise ValueError(f"the prices table spans less than {train_years} years, not enough for one fold")
+    chunks = load_run(checkpoint, db_path, configs, folds, chunk_rows)
+
+    total = np.zeros((len(configs), len(folds), len(SPLITS), len(STATS)))
+    todo = []
+    for i in range(len(chunks)):
+        if os.path.exists(_chunk_file(checkpoint, i)):
+            total += np.load(_chunk_file(checkpoint, i))
+        else:
+            todo.append(i)
+    print(f"{len(chunks) - len(todo)} of {len(chunks)} chunks already done")
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(evaluate_chunk, chunks[i], db_path, configs, folds): i for i in todo}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            i = futures.pop(future)
+            stats = future.result()
+            scratch = _chunk_file(checkpoint, i) + ".tmp"
+            with open(scratch, "wb") as file:
+                np.save(file, stats)
+            os.replace(scratch, _chunk_file(checkpoint, i))
+            total += stats
+    return total, folds
+
+
+def _parse_range(values, cast):
+    """ "5:30" (inclusive, step 1), "5:30:5" or "1,1.5,2" """
+    if ":" in values:
+        parts = [cast(part) for part in values.split(":")]
+        step = parts[2] if len(parts) > 2 else 1
+        return list(np.arange(parts[0], parts[1] + step / 2, step).astype(type(parts[0])).tolist())
+    return [cast(value) for value in values.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward search over Supertrend ladder strategies")
+    parser.add_argument("--db", default="stock_data.db", help="SQLite database or saved universe directory")
+    parser.add_argument("--lengths", default="5:30", help='e.g. "5:30", "5:30:5" or "7,10,14"')
+    parser.add_argument("--multipliers", default="0.5:5:0.5")
+    parser.add_argument("--rungs", type=int, default=3, help="Supertrends per config")
+    parser.add_argument("--train-years", type=float, default=5)
+    parser.add_argument("--test-years", type=float, default=1)
+    parser.add_argument("--checkpoint", default="optimize", help="directory to checkpoint into and resume from")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of cores")
+    parser.add_argument("--rank-by", default="test_mean_return")
+    parser.add_argument("--out", default="optimize_results.csv")
+    args = parser.parse_args()
+
+    configs = make_configs(_parse_range(args.lengths, int), _parse_range(args.multipliers, float), args.rungs)
+    stats, folds = optimize(args.db, configs, args.train_years, args.test_years, args.checkpoint, args.workers)
+    ranking = rank_configs(stats, configs, args.rank_by)
+    ranking.to_csv(args.out, index=False)
+    print(f"{len(configs)} configs, {len(folds)} folds")
+    print(ranking.head(10).to_string())
+    print(walk_forward_selection(stats, configs).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+import argparse
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from indicators import _sma_kernel
+from numeric import jit, njit
+from partition import TickerPartition, as_partition
+from simulate import add_returns, simulate_trades, write_roi
+from supertrend import SUPERTREND_PARAMS, _supertrend_kernel, rma
+from universe import COLUMNS, Universe, is_universe, to_days
+
+# Dense date x ticker view of the prices for cross-sectional strategies.
+# Every column becomes a 2-D (day, ticker) array with NaN where a ticker has
+# no bar, plus a boolean mask of the cells that do. Whole-universe operators
+# work on these arrays: shift and rolling run in each ticker's own bar time
+# (a gap day is skipped, not counted, the same as the per-ticker pandas code
+# in the simulate scripts), while rank and top_k compare tickers within a day.
+#
+# Bar-time operators go through a "packed" layout of shape (bar, ticker),
+# where row i holds each ticker's i-th bar; pack() and unpack() move between
+# the two with one fancy-index each. The recursive indicators (Wilder ATR,
+# Supertrend) step over packed rows with all tickers updated together and
+# reproduce supertrend.py bit for bit.
+
+SMA_WINDOWS = [5, 10, 20, 60, 120]
+
+
+class Panel:
+    """
+    The bars of a universe aligned on the union of their dates. Columns are
+    read with panel[name], which is a (day, ticker) array.
+    """
+
+    def __init__(self, tickers, codes, row_days, columns):
+        """ codes and row_days locate each long-format row (sorted by ticker, then date) in the panel """
+        self.tickers = np.asarray(tickers)
+        self.days = np.unique(row_days)
+        self.rows = np.searchsorted(self.days, row_days)
+        self.cols = np.asarray(codes, dtype=np.int64)
+        starts = np.searchsorted(self.cols, np.arange(len(self.tickers)))
+        self.bars = np.arange(len(self.cols)) - starts[self.cols]
+        self.lengths = np.bincount(self.cols, minlength=len(self.tickers))
+        self.mask = np.zeros(self.shape, dtype=bool)
+        self.mask[self.rows, self.cols] = True
+        self.columns = {name: self.scatter(values) for name, values in columns.items()}
+
+    @classmethod
+    def from_universe(cls, universe, columns=COLUMNS):
+        columns = [column for column in columns if column in universe.columns]
+        return cls(universe.tickers, universe.codes, universe.days, {column: universe.columns[column] for column in columns})
+
+    @classmethod
+    def from_frame(cls, data, columns=COLUMNS, date_column="Date"):
+        """ From a prices-shaped frame or TickerPartition """
+        data = as_partition(data)
+        df = data.df
+        columns = [column for column in columns if column in df.columns]
+        return cls(data.tickers, data.codes, to_days(df[date_column].to_numpy()),
+                   {column: df[column].to_numpy(np.float64) for column in columns})
+
+    @classmethod
+    def load(cls, source, columns=COLUMNS, tickers=None):
+        """ From a saved universe directory or a SQLite database """
+        universe = Universe.load(source, columns) if is_universe(source) else Universe.from_sqlite(source, tickers, columns)
+        if tickers is not None and is_universe(source):
+            universe = universe.select(tickers)
+        return cls.from_universe(universe, columns)
+
+    @property
+    def shape(self):
+        return len(self.days), len(self.tickers)
+
+    @property
+    def dates(self):
+        return self.days.astype("datetime64[D]")
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __setitem__(self, name, values):
+        self.columns[name] = values
+
+    def scatter(self, values, fill=np.nan):
+        """ Long-format values (one per row, ticker-major) into a (day, ticker) array """
+        values = np.asarray(values)
+        out = np.full(self.shape, fill, dtype=np.result_type(values.dtype, np.asarray(fill).dtype))
+        out[self.rows, self.cols] = values
+        return out
+
+    def gather(self, values):
+        """ The inverse of scatter: one value per bar, ticker-major with dates ascending """
+        return np.asarray(values)[self.rows, self.cols]
+
+    def pack(self, values, fill=np.nan):
+        """ (day, ticker) -> (bar, ticker): row i is each ticker's i-th bar """
+        values = np.asarray(values)
+        out = np.full((int(self.lengths.max(initial=0)), len(self.tickers)), fill,
+                      dtype=np.result_type(values.dtype, np.asarray(fill).dtype))
+        out[self.bars, self.cols] = values[self.rows, self.cols]
+        return out
+
+    def unpack(self, packed, fill=np.nan):
+        """ (bar, ticker) -> (day, ticker), fill where a ticker has no bar """
+        packed = np.asarray(packed)
+        out = np.full(self.shape, fill, dtype=np.result_type(packed.dtype, np.asarray(fill).dtype))
+        out[self.rows, self.cols] = packed[self.bars, self.cols]
+        return out
+
+    def shift(self, values, periods=1):
+        """ Each ticker's value `periods` bars earlier (later when negative) """
+        packed = self.pack(values)
+        out = np.full_like(packed, np.nan)
+        if periods >= 0:
+            out[periods:] = packed[:len(packed) - periods]
+        else:
+            out[:periods] = packed[-periods:]
+        return self.unpack(out)
+
+    def pct_change(self, values, periods=1):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return values / self.shift(values, periods) - 1
+
+    def rolling(self, values, window, how="mean", min_periods=None):
+        """
+        Trailing window of `window` bars per ticker. how is "mean" (pandas'
+        own roll_mean, so bit for bit Series.rolling().mean()), "sum" or
+        "std" (running sums; equal to pandas up to rounding) or "min"/"max".
+        Like pandas, a window needs min_periods (default window) non-NaN values.
+        """
+        min_periods = window if min_periods is None else min_periods
+        packed = self.pack(values)
+        if how == "mean":
+            # Signals compare means against each other, so they must round exactly as pandas does
+            out = np.full(packed.shape[::-1], np.nan)
+            columns = np.ascontiguousarray(packed.T, dtype=np.float64)
+            if njit is None:
+                for j, length in enumerate(self.lengths.tolist()):
+                    column = [0.0] * length
+                    _sma_kernel(columns[j, :length].tolist(), window, max(min_periods, 1), np.full(window, np.nan), [0.0] * 8, column)
+                    out[j, :length] = column
+            else:
+                _rolling_mean_panel_kernel(columns, self.lengths, window, max(min_periods, 1), out)
+            return self.unpack(out.T)
+        valid = ~np.isnan(packed)
+        counts = _window_sum(valid.astype(np.int64), window)
+        if how in ("min", "max"):
+            padded = np.concatenate([np.full((window - 1, packed.shape[1]), np.nan), packed])
+            windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=0)
+            with warnings.catch_warnings():
+                # All-NaN windows are expected and come out NaN
+                warnings.simplefilter("ignore", RuntimeWarning)
+                out = np.nanmax(windows, axis=-1) if how == "max" else np.nanmin(windows, axis=-1)
+        else:
+            filled = np.where(valid, packed, 0.0)
+            total = _window_sum(filled, window)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                if how == "sum":
+                    out = total
+                elif how == "std":
+                    mean = total / counts
+                    squares = _window_sum(filled * filled, window)
+                    out = np.sqrt(np.maximum(squares / counts - mean * mean, 0.0) * counts / (counts - 1))
+                else:
+                    raise ValueError(f"unknown rolling function {how!r}")
+        out = np.where(counts >= max(min_periods, 1), out, np.nan)
+        return self.unpack(out)
+
+    def rank(self, values, ascending=False, pct=False):
+        """
+        Rank of each ticker within its day, 1 = best (largest unless
+        ascending). Missing values get NaN; ties go to the earlier ticker.
+        """
+        values = np.where(self.mask, values, np.nan).astype(np.float64)
+        key = values if ascending else -values
+        order = np.argsort(np.where(np.isnan(key), np.inf, key), axis=1, kind="stable")
+        ranks = np.empty(values.shape)
+        np.put_along_axis(ranks, order, np.arange(1, values.shape[1] + 1, dtype=np.float64)[None, :], axis=1)
+        valid = ~np.isnan(values)
+        ranks[~valid] = np.nan
+        if pct:
+            ranks /= valid.sum(axis=1, keepdims=True)
+        return ranks
+
+    def top_k(self, values, k, ascending=False):
+        """ Boolean (day, ticker) array of the k best tickers each day """
+        return self.rank(values, ascending) <= k
+
+    def true_range(self, high="High", low="Low", close="Close"):
+        high, low, close = (self.pack(self[name] if isinstance(name, str) else name) for name in (high, low, close))
+        high_low = high - low
+        # pandas_ta nudges the whole range by epsilon when any bar of the ticker has high == low
+        high_low = high_low + np.where((high_low == 0).any(axis=0), sys.float_info.epsilon, 0.0)
+        prev_close = np.full_like(close, np.nan)
+        prev_close[1:] = close[:-1]
+        tr = np.fmax(np.abs(high_low), np.fmax(np.abs(high - prev_close), np.abs(prev_close - low)))
+        tr[:1] = np.nan
+        return tr
+
+    def supertrend(self, length, multiplier, high="High", low="Low", close="Close"):
+        """ Supertrend (trend, direction) of every ticker as (day, ticker) arrays, as supertrend_arrays computes them """
+        tr = self.true_range(high, low, close)
+        high, low, close = (self.pack(self[name] if isinstance(name, str) else name) for name in (high, low, close))
+        if njit is None:
+            atr = np.column_stack([rma(tr[:, j], length) for j in range(tr.shape[1])]) if tr.shape[1] else tr
+        else:
+            atr = _ewm_panel_kernel(np.ascontiguousarray(tr), 1.0 / length, max(int(length), 1))
+        hl2 = 0.5 * (high + low)
+        upper = np.ascontiguousarray(hl2 + float(multiplier) * atr)
+        lower = np.ascontiguousarray(hl2 - float(multiplier) * atr)
+        if njit is None:
+            trend = np.empty(upper.shape)
+            direction = np.empty(upper.shape, dtype=np.int8)
+            for j in range(upper.shape[1]):
+                trend[:, j], direction[:, j], _, _ = _supertrend_kernel(close[:, j].tolist(), upper[:, j].tolist(), lower[:, j].tolist())
+        else:
+            trend, direction = _supertrend_panel_kernel(np.ascontiguousarray(close), upper, lower)
+        # Packed rows past a ticker's last bar are padding; unpack only keeps real bars
+        return self.unpack(trend), self.unpack(direction, fill=0)
+
+    def to_partition(self, columns=None):
+        """ Long-format TickerPartition of the bars with the given (day, ticker) arrays as columns """
+        columns = self.columns if columns is None else columns
+        df = pd.DataFrame({
+            "ticker": self.tickers[self.cols],
+            "Date": self.days[self.rows].astype("datetime64[D]").astype("datetime64[ns]"),
+            **{name: self.gather(values) for name, values in columns.items()},
+        })
+        return TickerPartition(df, presorted=True)
+
+
+def _window_sum(packed, window):
+    """ Sum of the last `window` rows at every row, via a running sum """
+    totals = np.cumsum(packed, axis=0)
+    out = totals.copy()
+    out[window:] -= totals[:-window]
+    return out
+
+
+@jit
+def _rolling_mean_panel_kernel(columns, lengths, window, min_periods, out):
+    # indicators._sma_kernel over each ticker's bars; columns and out are (ticker, bar)
+    for j in range(columns.shape[0]):
+        ring = np.full(window, np.nan)
+        state = np.zeros(8)
+        _sma_kernel(columns[j, :lengths[j]], window, min_periods, ring, state, out[j, :lengths[j]])
+
+
+@jit
+def _ewm_panel_kernel(values, alpha, min_periods):
+    # supertrend._ewm_mean for every column, stepping all of them one row at a time
+    n, m = values.shape
+    out = np.empty((n, m))
+    if n == 0:
+        return out
+    old_wt_factor = 1.0 - alpha
+    weighted = values[0].copy()
+    old_wt = np.ones(m)
+    nobs = np.zeros(m, dtype=np.int64)
+    for j in range(m):
+        if weighted[j] == weighted[j]:
+            nobs[j] = 1
+        out[0, j] = weighted[j] if nobs[j] >= min_periods else np.nan
+    for i in range(1, n):
+        for j in range(m):
+            cur = values[i, j]
+            is_obs = cur == cur
+            if is_obs:
+                nobs[j] += 1
+            if weighted[j] == weighted[j]:
+                old_wt[j] *= old_wt_factor
+                if is_obs:
+                    if weighted[j] != cur:
+                        weighted[j] = ((old_wt[j] * weighted[j]) + cur) / (old_wt[j] + 1.0)
+                    old_wt[j] += 1.0
+            elif is_obs:
+                weighted[j] = cur
+            out[i, j] = weighted[j] if nobs[j] >= min_periods else np.nan
+    return out
+
+
+@jit
+def _supertrend_panel_kernel(close, upper, lower):
+    # supertrend._supertrend_grid_kernel with a close per column
+    n, m = upper.shape
+    trend = np.full((n, m), np.nan)
+    direction = np.ones((n, m), dtype=np.int8)
+    if n == 0:
+        return trend, direction
+    trend[0, :] = 0.0
+    for i in range(1, n):
+        for j in range(m):
+            if close[i, j] > upper[i - 1, j]:
+                direction[i, j] = 1
+            elif close[i, j] < lower[i - 1, j]:
+                direction[i, j] = -1
+            else:
+                direction[i, j] = direction[i - 1, j]
+                if direction[i, j] > 0 and lower[i, j] < lower[i - 1, j]:
+                    lower[i, j] = lower[i - 1, j]
+                if direction[i, j] < 0 and upper[i, j] > upper[i - 1, j]:
+                    upper[i, j] = upper[i - 1, j]
+
+            if direction[i, j] > 0:
+                trend[i, j] = lower[i, j]
+            else:
+                trend[i, j] = upper[i, j]
+    return trend, direction
+
+
+def sma_stack(panel, price="Close", windows=SMA_WINDOWS):
+    """ Entry of simulate_shitty_strategy.py: close > sma_5 > sma_10 > sma_20 > sma_60 > sma_120 """
+    stack = [panel[price]] + [panel.rolling(panel[price], window) for window in windows]
+    return np.logical_and.reduce([a > b for a, b in zip(stack, stack[1:])])
+
+
+def supertrend_consensus(panel, params=SUPERTREND_PARAMS, price="Close"):
+    """ simulate_supertrend.py's rules: enter when every Supertrend is below the close, exit when at most one is """
+    above = sum((panel[price] > panel.supertrend(length, multiplier, close=price)[0]).astype(np.int64)
+                for length, multiplier in params)
+    return above == len(params), above * 2 < len(params)
+
+
+def supertrend_distance_top(panel, k=50, length=10, multiplier=3.0, price="Close"):
+    """ Hold the k tickers whose close is furthest above their Supertrend, rebalanced daily """
+    trend, direction = panel.supertrend(length, multiplier, close=price)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distance = np.where(direction > 0, panel[price] / trend - 1, np.nan)
+    entry = panel.top_k(distance, k)
+    return entry, ~entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a strategy on the whole universe as date x ticker arrays")
+    parser.add_argument("--db", default="stock_data.db", help="SQLite database or saved universe directory")
+    parser.add_argument("--strategy", choices=["sma-stack", "supertrend", "supertrend-top"], default="supertrend")
+    parser.add_argument("--top", type=int, default=50, help="positions held by supertrend-top")
+    parser.add_argument("--out", default=None, help="defaults to roi_<strategy>.csv")
+    args = parser.parse_args()
+
+    panel = Panel.load(args.db, ["High", "Low", "Close"])
+    if args.strategy == "sma-stack":
+        entry, exit, hold_days = sma_stack(panel), None, 10
+    elif args.strategy == "supertrend":
+        (entry, exit), hold_days = supertrend_consensus(panel), None
+    else:
+        (entry, exit), hold_days = supertrend_distance_top(panel, args.top), None
+    signals = {"Close": panel["Close"], "entry": entry}
+    if exit is not None:
+        signals["exit"] = exit
+    data = panel.to_partition(signals)
+    roi_df = add_returns(simulate_trades(data, "entry", "exit" if exit is not None else None, hold_days, price="Close"))
+    out = args.out or f"roi_{args.strategy.replace('-', '_')}.csv"
+    write_roi(roi_df, out)
+    print(f"{len(roi_df)} trades over {panel.shape[1]} tickers and {panel.shape[0]} days written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import numpy as np
+
+# Work is handed out in chunks of roughly this many bars so that a worker
+# stuck on a 60-year ticker doesn't hold up the rest, and idle workers pick
+# up the next chunk as soon as they finish.
+CHUNK_ROWS = 250_000
+# Keeps the `ticker in (...)` list under SQLite's bound parameter limit
+MAX_CHUNK_TICKERS = 500
+
+
+def ticker_offsets(tickers):
+    """ (unique tickers, starts, ends) for an array already grouped by ticker """
+    tickers = np.asarray(tickers)
+    if len(tickers) == 0:
+        return tickers, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    boundaries = np.flatnonzero(tickers[1:] != tickers[:-1]) + 1
+    starts = np.concatenate([[0], boundaries]).astype(np.int64)
+    ends = np.concatenate([boundaries, [len(tickers)]]).astype(np.int64)
+    return tickers[starts], starts, ends
+
+
+def make_chunks(ticker_rows, chunk_rows=CHUNK_ROWS, max_tickers=MAX_CHUNK_TICKERS):
+    """ Group tickers into chunks of about chunk_rows bars, largest tickers first """
+    chunks = []
+    current, current_rows = [], 0
+    for ticker, rows in sorted(ticker_rows.items(), key=lambda item: -item[1]):
+        current.append(ticker)
+        current_rows += rows
+        if current_rows >= chunk_rows or len(current) >= max_tickers:
+            chunks.append(current)
+            current, current_rows = [], 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class TickerPartition:
+    """
+    A frame sorted once by (ticker, Date) plus the start/end row of every
+    ticker, replacing the `df[df["ticker"] == ticker].sort_values(by="Date")`
+    scan each script did per ticker. Per-ticker access is a slice: arrays()
+    returns NumPy views and frame() an iloc slice, neither copies the data.
+    """
+
+    def __init__(self, df, ticker_column="ticker", date_column="Date", presorted=False):
+        if not presorted:
+            df = df.sort_values(by=[ticker_column, date_column], kind="stable")
+        self.df = df.reset_index(drop=True)
+        self.ticker_column = ticker_column
+        self.tickers, self.starts, self.ends = ticker_offsets(self.df[ticker_column].to_numpy())
+        self.positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self.positions
+
+    def __iter__(self):
+        """ Yield (ticker, frame slice) in ticker order """
+        for ticker, start, end in zip(self.tickers, self.starts, self.ends):
+            yield ticker, self.df.iloc[start:end]
+
+    def rows(self, ticker):
+        i = self.positions[ticker]
+        return slice(int(self.starts[i]), int(self.ends[i]))
+
+    def frame(self, ticker):
+        return self.df.iloc[self.rows(ticker)]
+
+    def arrays(self, ticker, columns):
+        rows = self.rows(ticker)
+        return {column: self.df[column].to_numpy()[rows] for column in columns}
+
+    @property
+    def codes(self):
+        """ Position of each row's ticker in self.tickers """
+        return np.repeat(np.arange(len(self.tickers)), self.ends - self.starts)
+
+    def groupby(self, column):
+        """ Per-ticker groupby on the sorted frame without hashing ticker strings """
+        return self.df[column].groupby(self.codes, sort=False)
+
+    def ticker_of_row(self, rows):
+        return self.tickers[np.searchsorted(self.starts, rows, side="right") - 1]
+
+    def fill(self, column, func, columns, dtype=np.float64):
+        """
+        Run func(*arrays) on every ticker's slice of columns and store the
+        result, the same length as the slice, in a new column.
+        """
+        out = np.full(len(self.df), np.nan, dtype=dtype)
+        sources = [self.df[name].to_numpy() for name in columns]
+        for start, end in zip(self.starts, self.ends):
+            out[start:end] = func(*(source[start:end] for source in sources))
+        self.df[column] = out
+        return out
+
+
+def as_partition(df):
+    if isinstance(df, TickerPartition):
+        return df
+    # A universe.Universe (or anything else that can partition itself)
+    if hasattr(df, "partition"):
+        return df.partition()
+    return TickerPartition(df)
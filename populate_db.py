@@ -1,144 +1,463 @@
-import sqlite3
-import pandas as pd
-from tqdm import tqdm
-import yfinance as yf
-
-def load_tickers(file_path="tickers.txt"):
-    with open(file_path, "r") as file:
-        return [line.strip() for line in file]
-
-def create_database_connection():
-    try:
-        # This change ensures that multiple threads can share the connection safely.
-        return sqlite3.connect("stock_data.db", check_same_thread=False)
-    except Exception as e:
-        print(f"Error creating database connection: {e}")
-        return None
-
-def store_dataframe(dataframe, table_name, conn):
-    try:
-        dataframe.to_sql(table_name, conn, if_exists='append', index=False)
-    except sqlite3.OperationalError as e:
-        error_message = str(e)
-        if "has no column named" in error_message:
-            missing_column = error_message.split("named ")[1].strip()
-            if not check_column_exists(conn, table_name, missing_column):
-                result = alter_table_to_add_column(conn, table_name, missing_column, dataframe[missing_column].dtype)
-                if not result:
-                    dataframe.to_sql(table_name, conn, if_exists='append', index=False)
-                    return
-                store_dataframe(dataframe, table_name, conn)  # Retry storing the dataframe
-            else:
-                print(f"Attempted to add an existing column {missing_column} to {table_name}")
-        else:
-            print(f"Error storing data in {table_name}: {error_message}")
-    except Exception as e:
-        print(f"Unhandled error storing data in {table_name}: {e}")
-
-def check_column_exists(conn, table_name, column_name):
-    """ Check if the column exists in the table """
-    cursor = conn.execute(f"PRAGMA table_info({table_name})")
-    columns = [info[1] for info in cursor.fetchall()]
-    return column_name in columns
-
-def alter_table_to_add_column(conn, table_name, column_name, column_type):
-    """ Add a missing column to a table in the database """
-    try:
-        cursor = conn.cursor()
-        cursor.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{column_name}" {get_sql_type(column_type)}')
-        conn.commit()
-        print(f"Added missing column '{column_name}' to '{table_name}'")
-        return True
-    except sqlite3.OperationalError as e:
-        print(f"Error adding column {column_name} to {table_name}: {e}")
-        return False
-
-def create_table_from_dataframe(conn, table_name, dataframe):
-    """ Creates a table from a DataFrame's schema """
-    sql_type_dict = {col: get_sql_type(dtype) for col, dtype in dataframe.dtypes.items()}
-    columns_with_types = ", ".join([f"{col} {dtype}" for col, dtype in sql_type_dict.items()])
-    create_stmt = f"CREATE TABLE {table_name} ({columns_with_types})"
-    conn.execute(create_stmt)
-    conn.commit()
-
-def get_sql_type(pandas_type):
-    """ Map pandas dtype to SQL dtype """
-    if pd.api.types.is_string_dtype(pandas_type):
-        return 'TEXT'
-    elif pd.api.types.is_numeric_dtype(pandas_type):
-        return 'REAL'
-    elif pd.api.types.is_datetime64_any_dtype(pandas_type):
-        return 'DATETIME'
-    return 'BLOB'  # Default to BLOB if type is unclear
-
-def convert_timestamps(dataframe):
-    for col in dataframe.columns:
-        if pd.api.types.is_datetime64_any_dtype(dataframe[col]):
-            dataframe[col] = dataframe[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-    return dataframe
-
-def fetch_data_safely(stock: yf.Ticker, attribute):
-    try:
-        if attribute == "history":
-            return stock.history(period="max").reset_index()
-        elif attribute == "get_shares_full":
-            data = stock.get_shares_full(start="1970-01-01")
-            if data is not None:
-                data = data.reset_index()  # Reset the index first to turn the index into a column
-            else:
-                return pd.DataFrame()
-            data.columns = ['Date', 'value']  # Rename columns to appropriate names
-            return data
-        try:
-            data = getattr(stock, attribute)
-        except Exception as e:
-            print(f"Error getting field {attribute} due to {str(e)}")
-            return pd.DataFrame()
-        if attribute in ["dividends", "splits"]:
-            data = data.reset_index()  # Reset the index first to turn the index into a column
-            data.columns = ['Date', 'value']  # Rename columns to appropriate names
-            return data
-        elif attribute in ["quarterly_financials", "quarterly_balance_sheet", "quarterly_cash_flow"]:
-            data = data.T
-            data = data.reset_index()
-            return data
-        else:
-            data = data.reset_index()
-            return data
-    except Exception:
-        print(f"{attribute} not implemented for {stock.ticker}")
-        return pd.DataFrame()
-
-def get_stock_data_with_financials(ticker):
-    conn = create_database_connection()
-    stock = yf.Ticker(ticker)
-    if conn:
-        data = {
-            'prices': fetch_data_safely(stock, 'history'),
-            'dividends': fetch_data_safely(stock, 'dividends'),
-            'splits': fetch_data_safely(stock, 'splits'),
-            'share_counts': fetch_data_safely(stock, 'get_shares_full'),
-            'income_statements': fetch_data_safely(stock, 'quarterly_financials'),
-            'balance_sheets': fetch_data_safely(stock, 'quarterly_balance_sheet'),
-            'cash_flows': fetch_data_safely(stock, 'quarterly_cash_flow'),
-            'insider_transactions': fetch_data_safely(stock, 'insider_transactions'),
-            'upgrades_downgrades': fetch_data_safely(stock, 'upgrades_downgrades'),
-            'earnings': fetch_data_safely(stock, 'earnings')
-        }
-
-        for key, df in data.items():
-            if df is not None and not df.empty:
-                df['ticker'] = ticker
-                df = convert_timestamps(df)
-                store_dataframe(df, key, conn)
-                    
-        conn.close()
-
-def main():
-    tickers = load_tickers()
-    for ticker in tqdm(tickers):
-        get_stock_data_with_financials(ticker)
-
-
-if __name__ == "__main__":
-    main()
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from tqdm import tqdm
+import yfinance as yf
+
+from fundamentals import STATEMENTS, melt_statement, store_fundamentals
+from ingest_ledger import (DEFAULT_MAX_AGE_HOURS, failed_rows, load_ledger, parse_shard, plan, record_status,
+                           shard, shard_path, status_rows)
+from instrument import frame_bytes, metrics
+from schema import connect, ensure_schema, upsert_dataframe
+
+def load_tickers(file_path="tickers.txt"):
+    with open(file_path, "r") as file:
+        return [line.strip() for line in file]
+
+def create_database_connection(db_path="stock_data.db"):
+    try:
+        # This change ensures that multiple threads can share the connection safely.
+        conn = connect(db_path, check_same_thread=False)
+        ensure_schema(conn)
+        return conn
+    except Exception as e:
+        print(f"Error creating database connection: {e}")
+        return None
+
+def store_dataframe(dataframe, table_name, conn, commit=True):
+    """ Store a fetched frame, returning None or the (error class, message) it failed with """
+    try:
+        if table_name == 'fundamentals':
+            store_fundamentals(conn, dataframe, commit)
+        else:
+            upsert_dataframe(conn, table_name, dataframe, commit)
+    except sqlite3.Error as e:
+        print(f"Error storing data in {table_name}: {e}")
+        metrics.failure(None, type(e).__name__, f"store:{table_name}", str(e))
+        return type(e).__name__, str(e)
+    except Exception as e:
+        print(f"Unhandled error storing data in {table_name}: {e}")
+        metrics.failure(None, type(e).__name__, f"store:{table_name}", str(e))
+        return type(e).__name__, str(e)
+    return None
+
+def convert_timestamps(dataframe):
+    for col in dataframe.columns:
+        if pd.api.types.is_datetime64_any_dtype(dataframe[col]):
+            dataframe[col] = dataframe[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return dataframe
+
+def fetch_data(stock: yf.Ticker, attribute, start=None, raw=False):
+    """
+    Fetch one yfinance attribute as a flat DataFrame, raising on failure. With
+    raw, history is not dividend-adjusted (adjust.py applies the stored
+    dividends instead).
+    """
+    if attribute == "history":
+        if start:
+            return stock.history(start=start, auto_adjust=not raw).reset_index()
+        return stock.history(period="max", auto_adjust=not raw).reset_index()
+    elif attribute == "get_shares_full":
+        data = stock.get_shares_full(start=start or "1970-01-01")
+        if data is not None:
+            data = data.reset_index()  # Reset the index first to turn the index into a column
+        else:
+            return pd.DataFrame()
+        data.columns = ['Date', 'value']  # Rename columns to appropriate names
+        return data
+    data = getattr(stock, attribute)
+    if data is None:
+        return pd.DataFrame()
+    if attribute in ["dividends", "splits"]:
+        data = data.reset_index()  # Reset the index first to turn the index into a column
+        data.columns = ['Date', 'value']  # Rename columns to appropriate names
+        return data
+    elif attribute in ["quarterly_financials", "quarterly_balance_sheet", "quarterly_cash_flow"]:
+        data = data.T
+        data = data.reset_index()
+        return data
+    else:
+        data = data.reset_index()
+        return data
+
+def fetch_data_safely(stock: yf.Ticker, attribute, limiter=None, retries=0, backoff=1.0, start=None, raw=False, errors=None):
+    """
+    fetch_data with rate limiting and exponential backoff, returning an empty
+    frame on failure. The (error class, message) of a failure is appended to
+    errors when given.
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return fetch_data(stock, attribute, start, raw)
+        except NotImplementedError as e:
+            print(f"{attribute} not implemented for {stock.ticker}")
+            metrics.failure(stock.ticker, type(e).__name__, f"fetch:{attribute}")
+            if errors is not None:
+                errors.append((type(e).__name__, str(e)))
+            return pd.DataFrame()
+        except Exception as e:
+            if attempt == retries:
+                print(f"Error getting field {attribute} for {stock.ticker} due to {str(e)}")
+                metrics.failure(stock.ticker, type(e).__name__, f"fetch:{attribute}", str(e))
+                if errors is not None:
+                    errors.append((type(e).__name__, str(e)))
+                return pd.DataFrame()
+            time.sleep(backoff * 2 ** attempt)
+
+# table name -> yfinance attribute
+DATASETS = {
+    'prices': 'history',
+    'dividends': 'dividends',
+    'splits': 'splits',
+    'share_counts': 'get_shares_full',
+    'income_statements': 'quarterly_financials',
+    'balance_sheets': 'quarterly_balance_sheet',
+    'cash_flows': 'quarterly_cash_flow',
+    'insider_transactions': 'insider_transactions',
+    'upgrades_downgrades': 'upgrades_downgrades',
+    'earnings': 'earnings',
+}
+
+# Column each table's rows are keyed on together with ticker
+DATE_KEYS = {
+    'prices': 'Date',
+    'dividends': 'Date',
+    'splits': 'Date',
+    'share_counts': 'Date',
+    'fundamentals': 'period_end',
+    'upgrades_downgrades': 'GradeDate',
+}
+
+# Only these support fetching from a start date
+INCREMENTAL_DATASETS = {'prices', 'share_counts'}
+
+def price_mode(raw):
+    """ What sync_state.mode records for prices fetched with or without --raw """
+    return "raw" if raw else "adjusted"
+
+def load_sync_state(conn):
+    """ {ticker: {table_name: (last_date, last_close, mode)}} for every ticker synced so far """
+    state = {}
+    for ticker, table_name, last_date, last_close, mode in conn.execute(
+        "SELECT ticker, table_name, last_date, last_close, mode FROM sync_state"
+    ):
+        state.setdefault(ticker, {})[table_name] = (last_date, last_close, mode)
+    return state
+
+def is_restated(prices, last_date, last_close, actions=('Dividends', 'Stock Splits')):
+    """
+    yfinance back-adjusts history for splits and dividends, so a new corporate
+    action or a changed close on the last stored bar means every stored bar
+    for the ticker is stale. Raw history is still split-adjusted, so only
+    splits restate it.
+    """
+    new_bars = prices[prices['Date'] > last_date]
+    for column in actions:
+        if column in new_bars.columns and (new_bars[column].fillna(0) != 0).any():
+            return True
+    overlap = prices.loc[prices['Date'] == last_date, 'Close']
+    if last_close is not None and len(overlap):
+        return abs(overlap.iloc[0] - last_close) > 1e-6 * max(abs(last_close), 1.0)
+    return False
+
+class RateLimiter:
+    """ Token bucket shared by all fetch workers to cap requests per second """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def fetch_ticker(ticker, limiter=None, retries=0, backoff=1.0, ticker_factory=yf.Ticker, state=None, raw=False,
+                 datasets=None, outcomes=None):
+    """
+    Fetch every dataset (or only the given DATASETS keys) for one ticker,
+    ready to be stored. With a sync state ({table_name: (last_date,
+    last_close, mode)}) prices and share counts are only fetched from the last
+    stored date on, unless the stored prices are of the other raw/adjusted
+    mode, which are then re-downloaded in full so the two never mix. Returns (data, replace) where replace names the tables
+    whose stored rows for this ticker must be dropped first. The quarterly
+    statements come back melted into one 'fundamentals' frame. outcomes, when
+    given, gets {dataset: (rows, error)} for the ingest ledger.
+    """
+    actions = ('Stock Splits',) if raw else ('Dividends', 'Stock Splits')
+    state = state or {}
+    outcomes = {} if outcomes is None else outcomes
+    stock = ticker_factory(ticker)
+    data = {}
+    replace = set()
+    for key in DATASETS if datasets is None else datasets:
+        attribute = DATASETS[key]
+        last_date, last_close, mode = state.get(key, (None, None, None))
+        if key == 'prices' and mode is not None and mode != price_mode(raw):
+            last_date = None
+        start = last_date[:10] if last_date and key in INCREMENTAL_DATASETS else None
+        errors = []
+        df = fetch_data_safely(stock, attribute, limiter, retries, backoff, start, raw, errors)
+        if key == 'prices' and start and df is not None and not df.empty:
+            df = convert_timestamps(df)
+            if is_restated(df, last_date, last_close, actions):
+                start = None
+                df = fetch_data_safely(stock, attribute, limiter, retries, backoff, raw=raw, errors=errors)
+        outcomes[key] = (0, errors[-1] if errors else None)
+        if df is None or df.empty:
+            continue
+        df['ticker'] = ticker
+        df = convert_timestamps(df)
+        if key in STATEMENTS:
+            # Stored long rather than one column per line item, see fundamentals.py
+            long = melt_statement(df, STATEMENTS[key])
+            outcomes[key] = (len(long), None)
+            data['fundamentals'] = pd.concat([data['fundamentals'], long], ignore_index=True) if 'fundamentals' in data else long
+            continue
+        # Anything fetched in full replaces what is stored, so reruns never duplicate rows
+        if not start or key not in DATE_KEYS:
+            replace.add(key)
+        outcomes[key] = (len(df), None)
+        data[key] = df
+    return data, replace
+
+class BatchWriter:
+    """
+    Single writer thread that owns the SQLite connection. Fetch workers hand it
+    the output of fetch_ticker; it concatenates many tickers per table and
+    upserts each batch in a single transaction, recording the newest stored
+    date per ticker in sync_state and each fetch's outcome in the ingest
+    ledger. Each table's delete and upsert run under a savepoint, so a table
+    that fails to store keeps its old rows. An error that escapes a batch is
+    kept in self.error and the queue is drained, so workers never block on a
+    dead writer; ingest() re-raises it.
+    """
+
+    def __init__(self, conn, batch_rows=200_000, batch_tickers=50, max_pending=100, raw=False):
+        self.conn = conn
+        self.raw = raw
+        self.batch_rows = batch_rows
+        self.batch_tickers = batch_tickers
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.pending = {}
+        self.pending_replace = {}
+        self.pending_status = []
+        self.pending_rows = 0
+        self.pending_tickers = 0
+        self.error = None
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, ticker, data, replace=(), status=()):
+        """ status: ingest_ledger.status_rows of the fetch. Dropped once the writer has failed. """
+        if self.error is None:
+            self.queue.put((ticker, data, replace, status))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        try:
+            self._consume()
+        except Exception as e:
+            print(f"Writer failed: {e}")
+            metrics.failure(None, type(e).__name__, "write", str(e))
+            self.error = e
+            try:
+                self.conn.rollback()
+            except sqlite3.Error:
+                pass
+            # Unblock any worker waiting on a full queue until close() arrives
+            while self.queue.get() is not None:
+                pass
+
+    def _consume(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.flush()
+                return
+            ticker, data, replace, status = item
+            self.pending_status.extend(status)
+            for key, df in data.items():
+                self.pending.setdefault(key, []).append(df)
+                if key in replace:
+                    self.pending_replace.setdefault(key, []).append(ticker)
+                self.pending_rows += len(df)
+            self.pending_tickers += 1
+            if self.pending_rows >= self.batch_rows or self.pending_tickers >= self.batch_tickers:
+                self.flush()
+
+    def flush(self):
+        with metrics.stage("write") as stage:
+            store_errors = {}
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN")
+            for key, frames in self.pending.items():
+                df = pd.concat(frames, ignore_index=True)
+                self.conn.execute("SAVEPOINT store_table")
+                delete_tickers(self.conn, key, self.pending_replace.get(key, []))
+                error = store_dataframe(df, key, self.conn, commit=False)
+                if error:
+                    # Undo the delete too, so the stored rows survive a failed upsert
+                    self.conn.execute("ROLLBACK TO store_table")
+                    store_errors[key] = error
+                else:
+                    update_sync_state(self.conn, key, df, price_mode(self.raw) if key == 'prices' else None)
+                self.conn.execute("RELEASE store_table")
+                stage.add(rows=len(df))
+            statuses = []
+            for row in self.pending_status:
+                # A fetched dataset whose rows could not be stored failed too
+                table = 'fundamentals' if row[1] in STATEMENTS else row[1]
+                statuses.append(failed_rows(row[0], [row[1]], store_errors[table])[0] if table in store_errors else row)
+            record_status(self.conn, statuses)
+            self.conn.commit()
+        self.pending = {}
+        self.pending_replace = {}
+        self.pending_status = []
+        self.pending_rows = 0
+        self.pending_tickers = 0
+
+def delete_tickers(conn, table_name, tickers):
+    """ Drop every stored row of the given tickers before they are rewritten in full """
+    conn.executemany(f'DELETE FROM "{table_name}" WHERE ticker = ?', [(ticker,) for ticker in tickers])
+
+def update_sync_state(conn, table_name, dataframe, mode=None):
+    """ Remember the newest stored date (and close and raw/adjusted mode, for prices) per ticker """
+    date_key = DATE_KEYS.get(table_name)
+    if not date_key or date_key not in dataframe.columns:
+        return
+    latest = dataframe.sort_values(date_key).groupby('ticker').tail(1)
+    closes = latest['Close'] if 'Close' in latest.columns else [None] * len(latest)
+    updated_at = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.executemany(
+        "INSERT OR REPLACE INTO sync_state (ticker, table_name, last_date, last_close, updated_at, mode) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (ticker, table_name, str(last_date), None if pd.isna(close) else float(close), updated_at, mode)
+            for ticker, last_date, close in zip(latest['ticker'], latest[date_key], closes)
+        ],
+    )
+
+def get_stock_data_with_financials(ticker):
+    conn = create_database_connection()
+    if conn:
+        data, replace = fetch_ticker(ticker)
+        for key, df in data.items():
+            if key in replace:
+                delete_tickers(conn, key, [ticker])
+            store_dataframe(df, key, conn)
+        conn.close()
+
+def ingest(tickers, db_path="stock_data.db", workers=8, rate=5.0, retries=3, backoff=1.0,
+           batch_rows=200_000, batch_tickers=50, ticker_factory=yf.Ticker, incremental=True, raw=False,
+           max_age_hours=DEFAULT_MAX_AGE_HOURS, failed_only=False):
+    """
+    Fetch tickers concurrently under a global rate limit and store them through
+    one batching writer. Incremental runs only pull bars newer than sync_state.
+    Raw runs store unadjusted prices, so a new dividend no longer forces a
+    full re-download. The ingest ledger decides what is fetched: datasets
+    that succeeded within max_age_hours are skipped (so a crashed run
+    resumes), failed_only retries just the failures, and the stalest tickers
+    go first.
+    """
+    conn = create_database_connection(db_path)
+    if not conn:
+        return
+    with metrics.stage("load_sync_state") as stage:
+        sync_state = load_sync_state(conn)
+        ledger = load_ledger(conn)
+        stage.add(rows=len(sync_state))
+    if not incremental:
+        sync_state = {}
+        max_age_hours = 0
+    work = plan(ledger, tickers, list(DATASETS), max_age_hours, failed_only)
+    print(f"{len(work)} of {len(tickers)} tickers to fetch")
+    limiter = RateLimiter(rate, burst=workers)
+    writer = BatchWriter(conn, batch_rows, batch_tickers, max_pending=workers * 4, raw=raw).start()
+
+    def fetch_and_queue(ticker, datasets):
+        outcomes = {}
+        with metrics.stage("fetch") as stage, metrics.profile(ticker):
+            data, replace = fetch_ticker(ticker, limiter, retries, backoff, ticker_factory, sync_state.get(ticker), raw,
+                                         datasets, outcomes)
+            stage.add(rows=sum(len(df) for df in data.values()), bytes_read=sum(frame_bytes(df) for df in data.values()))
+        # Blocks while the writer is behind, which keeps memory bounded
+        with metrics.stage("queue_wait"):
+            writer.put(ticker, data, replace, status_rows(ticker, outcomes))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_and_queue, ticker, datasets): (ticker, datasets) for ticker, datasets in work}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    future.result()
+                except Exception as exc:
+                    ticker, datasets = futures[future]
+                    print(f'Ticker {ticker} generated an exception: {exc}')
+                    metrics.failure(ticker, type(exc).__name__, "ingest", str(exc))
+                    writer.put(ticker, {}, (), failed_rows(ticker, datasets, (type(exc).__name__, str(exc))))
+                if writer.error is not None:
+                    # Nothing more can be stored; skip the tickers not started yet
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+    finally:
+        writer.close()
+        conn.close()
+    if writer.error is not None:
+        raise writer.error
+
+def main():
+    parser = argparse.ArgumentParser(description="Download prices and financials for every ticker into stock_data.db")
+    parser.add_argument("--tickers", default="tickers.txt")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=5.0, help="max yfinance requests per second across all workers")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--batch-tickers", type=int, default=50)
+    parser.add_argument("--full", action="store_true", help="re-download full history instead of only new bars")
+    parser.add_argument("--raw", action="store_true", help="store unadjusted prices; run adjust.py for adjusted ones")
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE_HOURS,
+                        help="skip datasets fetched successfully within this many hours (0 fetches everything)")
+    parser.add_argument("--retry-failed", action="store_true", help="only retry the datasets that failed last time")
+    parser.add_argument("--shard", default=None,
+                        help="i/n: ingest only the i-th of n slices of the tickers into their own database, see ingest_ledger.py merge")
+    parser.add_argument("--metrics", default=None, help="JSON lines metrics file (defaults to $METRICS_PATH)")
+    parser.add_argument("--profile-top", type=int, default=0, help="keep cProfile output of the N slowest tickers")
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.profile_top)
+    tickers, db_path = load_tickers(args.tickers), args.db
+    if args.shard:
+        index, count = parse_shard(args.shard)
+        tickers, db_path = shard(tickers, index, count), shard_path(args.db, index, count)
+    with metrics.stage("ingest"):
+        ingest(tickers, db_path, args.workers, args.rate, args.retries,
+               batch_tickers=args.batch_tickers, incremental=not args.full, raw=args.raw,
+               max_age_hours=args.max_age, failed_only=args.retry_failed)
+    metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from numeric import jit, njit
+from partition import as_partition
+from simulate import find_trades
+
+# Portfolio simulation over the whole universe. The per-ticker trades of
+# simulate.find_trades are the candidate positions; they are merged onto one
+# date timeline and a single compiled sweep over the days closes positions,
+# opens new ones while there are free slots and cash, and marks everything to
+# market. A candidate that can't be taken is skipped outright rather than
+# re-timed, so the per-ticker entry/exit rules stay exactly those of the
+# simulate scripts. Trades whose exit hasn't come by the end of the data are
+# candidates too (the sweep can't know they stay open), held to the end and
+# marked at their ticker's last close.
+#
+# Returns here use the usual sign (sell / buy - 1, positive is a gain). The
+# `return` column the simulate scripts write is 1 - sell / buy, i.e. the
+# opposite sign; see simulate.add_returns.
+
+TRADING_DAYS = 252
+
+
+@jit
+def _portfolio_kernel(row_day, prices, entry_rows, exit_rows, entry_days, exit_days, n_days,
+                      capital, position_size, max_positions, fee_rate, fee_fixed, slippage,
+                      shares, equity, cash_out, open_out):
+    """
+    Day-by-day sweep. On each day positions due to exit are sold first, then
+    candidates entering that day are bought in order while a slot and cash
+    are free (each gets position_size of current equity), then positions
+    opened and closed on the same bar are sold, then open positions are
+    marked at their latest close. Fills move against the trade by slippage
+    and pay fee_rate of notional plus fee_fixed per fill.
+    """
+    cash = capital
+    slot_trade = np.full(max_positions, -1)
+    slot_row = np.zeros(max_positions, dtype=np.int64)
+    next_trade = 0
+    n_trades = len(entry_rows)
+    held = 0
+    for day in range(n_days):
+        for sweep in range(2):
+            # Exits (the second pass catches positions opened today that also close today)
+            for s in range(max_positions):
+                t = slot_trade[s]
+                if t >= 0 and exit_days[t] == day:
+                    gross = shares[t] * prices[exit_rows[t]] * (1.0 - slippage)
+                    cash += gross - gross * fee_rate - fee_fixed
+                    slot_trade[s] = -1
+                    held -= 1
+            if sweep == 1:
+                break
+
+            # Entries, sized on equity marked at the previous close
+            value = 0.0
+            for s in range(max_positions):
+                t = slot_trade[s]
+                if t >= 0:
+                    value += shares[t] * prices[slot_row[s]]
+            target = (cash + value) * position_size
+            while next_trade < n_trades and entry_days[next_trade] == day:
+                t = next_trade
+                next_trade += 1
+                if held >= max_positions:
+                    continue
+                fill = prices[entry_rows[t]] * (1.0 + slippage)
+                budget = min(target, cash) - fee_fixed
+                if not fill > 0 or budget <= 0:
+                    continue
+                shares[t] = budget / (fill * (1.0 + fee_rate))
+                cash -= shares[t] * fill * (1.0 + fee_rate) + fee_fixed
+                for s in range(max_positions):
+                    if slot_trade[s] < 0:
+                        slot_trade[s] = t
+                        slot_row[s] = entry_rows[t]
+                        break
+                held += 1
+
+        value = 0.0
+        for s in range(max_positions):
+            t = slot_trade[s]
+            if t >= 0:
+                # Walk the ticker's rows up to today; days it didn't trade keep the last close
+                while slot_row[s] < exit_rows[t] and row_day[slot_row[s] + 1] <= day:
+                    slot_row[s] += 1
+                value += shares[t] * prices[slot_row[s]]
+        equity[day] = cash + value
+        cash_out[day] = cash
+        open_out[day] = held
+
+
+def portfolio_stats(equity, dates):
+    """ CAGR, annualized Sharpe (zero risk-free rate), max drawdown and total return of an equity curve """
+    equity = np.asarray(equity, dtype=np.float64)
+    if len(equity) < 2:
+        return {"total_return": 0.0, "cagr": 0.0, "sharpe": 0.0, "max_drawdown": 0.0}
+    years = (pd.Timestamp(dates[-1]) - pd.Timestamp(dates[0])).days / 365.25
+    total = equity[-1] / equity[0]
+    daily = np.diff(equity) / equity[:-1]
+    std = daily.std(ddof=1) if len(daily) > 1 else 0.0
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    return {
+        "total_return": total - 1,
+        "cagr": total ** (1 / years) - 1 if years > 0 and total > 0 else 0.0,
+        "sharpe": daily.mean() / std * np.sqrt(TRADING_DAYS) if std > 0 else 0.0,
+        "max_drawdown": drawdown.min(),
+    }
+
+
+def simulate_portfolio(data, entry, exit=None, hold_days=None, price="Close_x", capital=100_000.0,
+                       max_positions=20, position_size=None, fee_rate=0.0, fee_fixed=0.0, slippage=0.0,
+                       priority=None):
+    """
+    Run a long-only strategy with a fixed capital base across the universe.
+
+    data, entry, exit, hold_days and price are as for simulate.simulate_trades.
+    position_size is the fraction of equity put into each new position
+    (default 1 / max_positions). When more tickers signal on one day than
+    there are free slots, higher values of the priority column win, then
+    ticker order. Returns (equity frame, trades frame, stats dict); trades
+    still open at the end are flagged open, with their last close as sell
+    price and no exit costs.
+    """
+    data = as_partition(data)
+    df = data.df
+    dates = df["Date"].to_numpy("datetime64[ns]")
+    prices = np.ascontiguousarray(df[price].to_numpy(np.float64))
+    entry_rows, exit_rows, still_open = find_trades(
+        data.starts, data.ends, df[entry].to_numpy(), None if exit is None else df[exit].to_numpy(),
+        dates if hold_days else None, hold_days, keep_open=True,
+    )
+
+    days = np.unique(dates)
+    row_day = np.searchsorted(days, dates).astype(np.int64)
+    rank = np.zeros(len(entry_rows)) if priority is None else -df[priority].to_numpy(np.float64)[entry_rows]
+    # lexsort keys go from least to most significant; ties keep ticker order
+    order = np.lexsort((entry_rows, rank, row_day[entry_rows]))
+    entry_rows, exit_rows, still_open = entry_rows[order], exit_rows[order], still_open[order]
+    n_days = len(days)
+    entry_days = row_day[entry_rows]
+    # Open trades never reach their exit day; the sweep marks them up to exit_rows
+    exit_days = np.where(still_open, n_days, row_day[exit_rows])
+
+    shares = np.zeros(len(entry_rows))
+    equity, cash = np.empty(n_days), np.empty(n_days)
+    held = np.zeros(n_days, dtype=np.int64)
+    position_size = 1.0 / max_positions if position_size is None else position_size
+    args = (row_day, prices, entry_rows, exit_rows, entry_days, exit_days)
+    if njit is None:
+        # Plain Python indexes lists much faster than NumPy arrays
+        args = tuple(array.tolist() for array in args)
+    _portfolio_kernel(*args, n_days, float(capital), float(position_size), int(max_positions),
+                      float(fee_rate), float(fee_fixed), float(slippage), shares, equity, cash, held)
+
+    taken = shares > 0
+    skipped = int((~taken).sum())
+    entry_rows, exit_rows, shares, still_open = entry_rows[taken], exit_rows[taken], shares[taken], still_open[taken]
+    buy_fill = prices[entry_rows] * (1 + slippage)
+    # Open positions are valued at the last close, as in the equity curve
+    sell_fill = np.where(still_open, prices[exit_rows], prices[exit_rows] * (1 - slippage))
+    cost = shares * buy_fill * (1 + fee_rate) + fee_fixed
+    proceeds = np.where(still_open, shares * sell_fill, shares * sell_fill * (1 - fee_rate) - fee_fixed)
+    trades = pd.DataFrame({
+        "ticker": data.ticker_of_row(entry_rows),
+        "buy_date": dates[entry_rows],
+        "sell_date": dates[exit_rows],
+        "buy_price": buy_fill,
+        "sell_price": sell_fill,
+        "shares": shares,
+        "pnl": proceeds - cost,
+        "return": proceeds / cost - 1,
+        "open": still_open,
+    })
+
+    curve = pd.DataFrame({"Date": days, "equity": equity, "cash": cash, "positions": held})
+    stats = portfolio_stats(equity, days)
+    stats.update({"trades": len(trades), "open": int(still_open.sum()), "skipped": skipped, "final_equity": equity[-1] if n_days else capital})
+    return curve, trades, stats
+
+
+def main():
+    from result_store import read_prepped
+
+    parser = argparse.ArgumentParser(description="Portfolio backtest of the Supertrend consensus strategy")
+    parser.add_argument("--results", default="dataset", help="backtest result store")
+    parser.add_argument("--capital", type=float, default=100_000.0)
+    parser.add_argument("--max-positions", type=int, default=20)
+    parser.add_argument("--position-size", type=float, default=None, help="fraction of equity per position")
+    parser.add_argument("--fee-rate", type=float, default=0.0005)
+    parser.add_argument("--fee-fixed", type=float, default=0.0)
+    parser.add_argument("--slippage", type=float, default=0.0005)
+    parser.add_argument("--out", default="equity.csv")
+    args = parser.parse_args()
+
+    data = as_partition(pd.concat(read_prepped(args.results), ignore_index=True))
+    indicators = ["super_12_3_indicator", "super_11_2_indicator", "super_10_1_indicator"]
+    data.df["entry"] = data.df[indicators].all(axis=1)
+    data.df["exit"] = data.df[indicators].astype(int).sum(axis=1) <= 1
+
+    curve, trades, stats = simulate_portfolio(
+        data, "entry", "exit", capital=args.capital, max_positions=args.max_positions,
+        position_size=args.position_size, fee_rate=args.fee_rate, fee_fixed=args.fee_fixed, slippage=args.slippage,
+    )
+    curve.to_csv(args.out, index=False)
+    stem, extension = os.path.splitext(args.out)
+    trades.to_csv(f"{stem}_trades{extension or '.csv'}", index=False)
+    for name, value in stats.items():
+        print(f"{name:>14}: {value:.4f}" if isinstance(value, float) else f"{name:>14}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+# Columnar copy of the `prices` table: one directory per ticker holding one
+# .npy file per column. Dates are int64 nanoseconds since the epoch, prices
+# are float64 (or float32 when exported with --float32). np.load(mmap_mode="r")
+# maps a column straight from disk, so nothing is parsed on load. Directory
+# names are the percent-encoded tickers, so tickers with a path separator
+# (or a "%") map back to themselves.
+
+DEFAULT_STORE = "price_store"
+DATE_COLUMN = "Date"
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Dividends", "Stock Splits"]
+MANIFEST = "manifest.json"
+
+
+def _ticker_dir(root, ticker):
+    # Keeps "^GSPC" and "ES=F" readable; "/", "\\" and "%" are encoded
+    return os.path.join(root, quote(ticker, safe="^="))
+
+
+def _column_file(column):
+    return column.replace(" ", "_") + ".npy"
+
+
+def dates_to_int64(values):
+    """ Parse the text dates written by convert_timestamps into int64 nanoseconds """
+    dates = pd.to_datetime(pd.Series(values), utc=True).dt.tz_localize(None)
+    return dates.to_numpy("datetime64[ns]").view(np.int64)
+
+
+def write_ticker(ticker, dataframe, root=DEFAULT_STORE, dtype=np.float64):
+    """ Write one ticker's bars, sorted by date, replacing any previous copy """
+    dataframe = dataframe.sort_values(by=DATE_COLUMN)
+    columns = {DATE_COLUMN: dates_to_int64(dataframe[DATE_COLUMN])}
+    for column in PRICE_COLUMNS:
+        if column in dataframe.columns:
+            columns[column] = pd.to_numeric(dataframe[column], errors="coerce").to_numpy(dtype)
+
+    # Write into a scratch directory and swap it in so readers never see half a ticker
+    target = _ticker_dir(root, ticker)
+    scratch = target + ".tmp"
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    for column, values in columns.items():
+        np.save(os.path.join(scratch, _column_file(column)), np.ascontiguousarray(values))
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(scratch, target)
+    return len(dataframe)
+
+
+def load_ticker_arrays(ticker, root=DEFAULT_STORE, columns=None, mmap=True):
+    """ Map one ticker's columns from disk. Returns {column: array}; Date is int64 ns """
+    directory = _ticker_dir(root, ticker)
+    if not os.path.isdir(directory):
+        raise KeyError(f"{ticker} is not in the price store at {root}")
+    columns = [DATE_COLUMN] + PRICE_COLUMNS if columns is None else columns
+    arrays = {}
+    for column in columns:
+        path = os.path.join(directory, _column_file(column))
+        if os.path.exists(path):
+            arrays[column] = np.load(path, mmap_mode="r" if mmap else None)
+    return arrays
+
+
+def load_ticker(ticker, root=DEFAULT_STORE, columns=None):
+    """ One ticker's bars as a DataFrame shaped like `select * from prices where ticker = ...` """
+    arrays = load_ticker_arrays(ticker, root, columns, mmap=False)
+    if DATE_COLUMN in arrays:
+        arrays[DATE_COLUMN] = arrays[DATE_COLUMN].view("datetime64[ns]")
+    df = pd.DataFrame(arrays)
+    df["ticker"] = ticker
+    return df
+
+
+def list_tickers(root=DEFAULT_STORE):
+    if not os.path.isdir(root):
+        return []
+    return sorted(unquote(name) for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)) and not name.endswith(".tmp"))
+
+
+def iter_tickers(root=DEFAULT_STORE, columns=None):
+    """ Yield (ticker, arrays) for the whole universe, one memory-mapped ticker at a time """
+    for ticker in list_tickers(root):
+        yield ticker, load_ticker_arrays(ticker, root, columns)
+
+
+def write_manifest(row_counts, root=DEFAULT_STORE, dtype=np.float64):
+    with open(os.path.join(root, MANIFEST), "w") as file:
+        json.dump({"dtype": np.dtype(dtype).name, "tickers": row_counts}, file)
+
+
+def export_prices(db_path="stock_data.db", root=DEFAULT_STORE, dtype=np.float64, chunksize=500_000):
+    """
+    Stream the `prices` table out of SQLite ordered by ticker and write each
+    ticker as soon as all of its rows have been read, so memory stays bounded
+    by the largest ticker rather than the whole table.
+    """
+    os.makedirs(root, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    row_counts = {}
+    pending = None
+    try:
+        chunks = pd.read_sql_query("select * from prices order by ticker", conn, chunksize=chunksize)
+        for chunk in chunks:
+            if pending is not None:
+                chunk = pd.concat([pending, chunk], ignore_index=True)
+            # The last ticker in a chunk may continue into the next one
+            last_ticker = chunk["ticker"].iloc[-1]
+            complete = chunk[chunk["ticker"] != last_ticker]
+            pending = chunk[chunk["ticker"] == last_ticker]
+            for ticker, ticker_df in complete.groupby("ticker", sort=False):
+                row_counts[ticker] = write_ticker(ticker, ticker_df, root, dtype)
+        if pending is not None and not pending.empty:
+            row_counts[pending["ticker"].iloc[0]] = write_ticker(pending["ticker"].iloc[0], pending, root, dtype)
+    finally:
+        conn.close()
+    write_manifest(row_counts, root, dtype)
+    return row_counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the prices table into the columnar price store")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--out", default=DEFAULT_STORE)
+    parser.add_argument("--float32", action="store_true", help="store OHLCV as float32 to halve the size")
+    args = parser.parse_args()
+    row_counts = export_prices(args.db, args.out, np.float32 if args.float32 else np.float64)
+    print(f"Exported {sum(row_counts.values())} rows for {len(row_counts)} tickers to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+
+from schema import connect
+
+# Read path for the research agents' query_db tool: a small pool of read-only
+# connections, a hard row cap enforced while fetching, and an LRU cache of
+# results keyed on the normalized SQL and the database file's version.
+
+
+def normalize_sql(query):
+    """ Collapse whitespace outside string literals and drop trailing semicolons """
+    parts = re.split(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")", query.strip())
+    normalized = "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts))
+    return normalized.strip().rstrip(";").strip()
+
+
+class QueryService:
+    def __init__(self, db_path="stock_data.db", pool_size=4, max_rows=1000, cache_bytes=64 * 1024 ** 2, fetch_size=256):
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self.cache_bytes = cache_bytes
+        self.fetch_size = fetch_size
+        self.pool = queue.Queue()
+        self.pool_size = pool_size
+        self.opened = 0
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"queries": 0, "hits": 0, "misses": 0, "errors": 0, "truncated": 0, "seconds": 0.0}
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a read-only connection, opening one lazily up to pool_size """
+        with self.lock:
+            conn = None
+            if self.pool.empty() and self.opened < self.pool_size:
+                # Only a connection that opened takes a slot, so failed opens can't exhaust the pool
+                conn = connect(self.db_path, readonly=True, check_same_thread=False)
+                self.opened += 1
+        if conn is None:
+            conn = self.pool.get()
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    def version(self):
+        """ Changes whenever the database (or its write-ahead log) is written """
+        stamps = []
+        for path in [self.db_path, self.db_path + "-wal"]:
+            # Readers create an empty -wal file on open, which isn't a write
+            if os.path.exists(path) and os.path.getsize(path):
+                stat = os.stat(path)
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamps)
+
+    def _fetch(self, query):
+        with self.connection() as conn:
+            cursor = conn.execute(query)
+            try:
+                columns = [column[0] for column in cursor.description or []]
+                rows = []
+                # Stop reading as soon as the cap is exceeded instead of materializing everything
+                while len(rows) <= self.max_rows:
+                    batch = cursor.fetchmany(self.fetch_size)
+                    if not batch:
+                        break
+                    rows.extend(batch)
+            finally:
+                cursor.close()
+        truncated = len(rows) > self.max_rows
+        return pd.DataFrame(rows[:self.max_rows], columns=columns), truncated
+
+    def _store(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.cache_bytes:
+            return
+        with self.lock:
+            if key in self.cache:
+                self.cached_bytes -= self.cache.pop(key)[1]
+            self.cache[key] = (df, size)
+            self.cached_bytes += size
+            while self.cached_bytes > self.cache_bytes:
+                _, (_, evicted) = self.cache.popitem(last=False)
+                self.cached_bytes -= evicted
+
+    def query(self, query):
+        start = time.perf_counter()
+        key = (normalize_sql(query), self.version())
+        with self.lock:
+            self.counters["queries"] += 1
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                self.counters["hits"] += 1
+        try:
+            if cached is not None:
+                df = cached[0]
+            else:
+                df, truncated = self._fetch(key[0])
+                with self.lock:
+                    self.counters["misses"] += 1
+                    self.counters["truncated"] += int(truncated)
+                self._store(key, df)
+        except Exception:
+            with self.lock:
+                self.counters["errors"] += 1
+            raise
+        finally:
+            with self.lock:
+                self.counters["seconds"] += time.perf_counter() - start
+        # Callers get their own copy so the cached frame can't be modified
+        return df.copy()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            counters["hit_rate"] = counters["hits"] / counters["queries"] if counters["queries"] else 0.0
+            counters["avg_latency_ms"] = 1000 * counters["seconds"] / counters["queries"] if counters["queries"] else 0.0
+            counters["cached_entries"] = len(self.cache)
+            counters["cached_bytes"] = self.cached_bytes
+        return counters
+
+    def close(self):
+        while not self.pool.empty():
+            self.pool.get().close()
+        self.opened = 0
@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from partition import ticker_offsets
+from price_store import dates_to_int64
+
+# Partitioned columnar output for the backtest. Every appended frame becomes
+# one part-NNNNN.npz file (one array per column, optionally zip-compressed)
+# and manifest.json records which rows of which part belong to each ticker,
+# so readers can pull single columns or single tickers without touching the rest.
+
+DEFAULT_RESULTS = "dataset"
+MANIFEST = "manifest.json"
+
+
+def _column_array(name, values):
+    if name == "Date":
+        return dates_to_int64(values).view("datetime64[ns]")
+    if values.dtype == object:
+        return values.to_numpy().astype(str)
+    return values.to_numpy()
+
+
+def write_partition(root, name, frame, compress=False):
+    """ Write frame as partition `name` of the store at root and return its manifest entry """
+    arrays = {column: _column_array(column, frame[column]) for column in frame.columns}
+    save = np.savez_compressed if compress else np.savez
+    scratch = os.path.join(root, name + ".tmp")
+    with open(scratch, "wb") as file:
+        save(file, **arrays)
+    os.replace(scratch, os.path.join(root, name))
+
+    tickers = {}
+    if "ticker" in arrays:
+        names, starts, ends = ticker_offsets(arrays["ticker"])
+        tickers = {str(name): [int(start), int(end)] for name, start, end in zip(names, starts, ends)}
+    return {"file": name, "rows": len(frame), "tickers": tickers}
+
+
+class ResultWriter:
+    """
+    Append-only sink: each append() is written to disk immediately and
+    dropped from memory. Worker processes can also write partitions
+    themselves with write_partition under a name from reserve(), and the
+    writer only records them with add().
+
+    With resume, an existing store is opened instead of cleared; keep()
+    then picks the partitions that stay and close() deletes the files of
+    the others.
+    """
+
+    def __init__(self, root=DEFAULT_RESULTS, compress=False, resume=False):
+        self.root = root
+        self.compress = compress
+        manifest = os.path.join(root, MANIFEST)
+        if os.path.isdir(root) and os.listdir(root) and not os.path.exists(manifest):
+            raise ValueError(f"{root} is not a result store (no {MANIFEST}); refusing to overwrite it")
+        if resume and os.path.exists(manifest):
+            self.manifest = read_manifest(root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+            os.makedirs(root)
+            self.manifest = {"columns": None, "partitions": []}
+        # Past every file on disk, including ones a previous run left unlisted
+        used = [int(name[5:10]) for name in os.listdir(root) if name.startswith("part-") and name[5:10].isdigit()]
+        self.next_part = max(used, default=-1) + 1
+
+    def reserve(self):
+        """ A partition file name no other partition of this store uses """
+        name = f"part-{self.next_part:05d}.npz"
+        self.next_part += 1
+        return name
+
+    def append(self, frame):
+        if frame.empty:
+            return
+        self.add(write_partition(self.root, self.reserve(), frame, self.compress), frame.columns)
+
+    def add(self, partition, columns):
+        """ Record a partition already written to the store by write_partition """
+        self.manifest["columns"] = self.manifest["columns"] or list(columns)
+        self.manifest["partitions"].append(partition)
+        self._write_manifest()
+
+    def keep(self, partitions, **fields):
+        """ List only these of the existing partitions, and set extra manifest fields """
+        self.manifest["partitions"] = list(partitions)
+        self.manifest.update(fields)
+        self._write_manifest()
+
+    def close(self):
+        """ Delete the partition files the manifest no longer lists """
+        listed = {partition["file"] for partition in self.manifest["partitions"]}
+        for name in os.listdir(self.root):
+            if name.startswith("part-") and name not in listed:
+                os.remove(os.path.join(self.root, name))
+
+    def _write_manifest(self):
+        scratch = os.path.join(self.root, MANIFEST + ".tmp")
+        with open(scratch, "w") as file:
+            json.dump(self.manifest, file)
+        os.replace(scratch, os.path.join(self.root, MANIFEST))
+
+
+def read_manifest(root=DEFAULT_RESULTS):
+    with open(os.path.join(root, MANIFEST), "r") as file:
+        return json.load(file)
+
+
+def _load_partition(root, partition, columns=None, rows=None):
+    with np.load(os.path.join(root, partition["file"])) as data:
+        names = data.files if columns is None else [column for column in columns if column in data.files]
+        if rows is None:
+            return pd.DataFrame({name: data[name] for name in names})
+        start, end = rows
+        return pd.DataFrame({name: data[name][start:end] for name in names})
+
+
+def iter_partitions(root=DEFAULT_RESULTS, columns=None):
+    """ Yield one DataFrame per partition, loading only the requested columns """
+    for partition in read_manifest(root)["partitions"]:
+        yield _load_partition(root, partition, columns)
+
+
+def read_results(root=DEFAULT_RESULTS, columns=None):
+    frames = list(iter_partitions(root, columns))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def read_ticker_results(ticker, root=DEFAULT_RESULTS, columns=None):
+    for partition in read_manifest(root)["partitions"]:
+        if ticker in partition["tickers"]:
+            return _load_partition(root, partition, columns, partition["tickers"][ticker])
+    raise KeyError(f"{ticker} is not in the results at {root}")
+
+
+def read_prepped(root=DEFAULT_RESULTS, signals=(("12", "3"), ("11", "2"), ("10", "1"))):
+    """
+    Yield, one partition at a time, the frame the simulate scripts used to
+    read from prepped_data.csv: ticker, Date, Close_x and one
+    super_<length>_<multiplier>_indicator column per Supertrend, built from
+    the backtest results directly. A ticker never spans two partitions.
+    """
+    supertrend_columns = [f"SUPERT_{length}_{multiplier}.0" for length, multiplier in signals]
+    for df in iter_partitions(root, ["ticker", "Date", "Close"] + supertrend_columns):
+        df = df.rename(columns={"Close": "Close_x"})
+        for (length, multiplier), column in zip(signals, supertrend_columns):
+            df[f"super_{length}_{multiplier}_indicator"] = df["Close_x"] > df[column]
+        yield df
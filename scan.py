@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import SMA_WINDOWS
+from indicators import SMA, HistoryChanged, Supertrend
+from schema import connect
+from simulate import find_trades
+from supertrend import SUPERTREND_PARAMS
+from universe import to_days
+
+# Daily scan: today's entry and exit signals of the simulate strategies for
+# every ticker, without rerunning the backtest over full history.
+#
+# Each ticker keeps a TickerScanner: the streaming indicators of indicators.py
+# (the three Supertrends and the SMA stack) and, per strategy, the day its
+# open position was entered. The first scan builds them from each ticker's
+# full history; the state is saved as versioned JSON (plain numbers from the
+# indicators' to_state(), no pickled classes), and every later scan only reads the
+# bars after a ticker's last scanned one and steps the state through them.
+# A ticker whose stored history changed underneath (the close of its first
+# or last scanned bar moved, e.g. after a split) is rebuilt from scratch, and
+# so is every ticker when the state file is from another STATE_VERSION.
+#
+# The rules are the ones simulate_trades applies: a position opens on an
+# entry bar while flat and closes on the exit signal or hold_days after it
+# opened. --window N builds new tickers from only their last N bars, which is
+# faster but only approximates the indicators' full-history values.
+
+DEFAULT_STATE = "scan_state.json"
+# Bumped whenever TickerScanner.to_state changes shape; older state files are rebuilt
+STATE_VERSION = 1
+# name: hold_days (None exits on the exit rule)
+STRATEGIES = {"supertrend": None, "sma_stack": 10}
+
+
+def strategy_rules(close, trends, smas):
+    """
+    {strategy: (entry, exit)} from one bar's or many bars' values; trends are
+    the SUPERTREND_PARAMS Supertrends and smas the SMA_WINDOWS averages
+    """
+    above = sum((close > trend) * 1 for trend in trends)
+    stack = [close] + list(smas)
+    sma_entry = np.logical_and.reduce([a > b for a, b in zip(stack, stack[1:])])
+    return {
+        # simulate_supertrend.py: every Supertrend below the close, exit when at most one is
+        "supertrend": (above == len(trends), above * 2 < len(trends)),
+        # simulate_shitty_strategy.py: close above a fully ordered SMA stack, exit after 10 days
+        "sma_stack": (sma_entry, None),
+    }
+
+
+class TickerScanner:
+    """ Streaming indicator and position state of one ticker """
+
+    def __init__(self):
+        self.supertrends = [Supertrend(length, multiplier) for length, multiplier in SUPERTREND_PARAMS]
+        self.smas = [SMA(window) for window in SMA_WINDOWS]
+        self.first = None  # (date, close) of the first bar read
+        self.last_date = None
+        self.last_close = None
+        self.opened = dict.fromkeys(STRATEGIES)  # strategy -> entry day of the open position
+        self.signals = {}  # strategy -> "entry" or "exit" on the last bar
+
+    def batch(self, dates, high, low, close):
+        """ Build the state from a whole history, oldest bar first """
+        days = to_days(dates)
+        trends = [supertrend.batch(high, low, close)[0] for supertrend in self.supertrends]
+        smas = [sma.batch(close) for sma in self.smas]
+        n = len(days)
+        bounds = np.array([0], dtype=np.int64), np.array([n], dtype=np.int64)
+        for name, (entry, exit) in strategy_rules(close, trends, smas).items():
+            hold_days = STRATEGIES[name]
+            instants = days.astype("datetime64[D]").astype("datetime64[ns]") if hold_days else None
+            entry_rows, exit_rows = find_trades(*bounds, entry, exit, instants, hold_days)
+            last_exit = int(exit_rows[-1]) if len(exit_rows) else -1
+            # find_trades drops a trade still open at the end: it opened on the first entry after the last exit
+            later = np.flatnonzero(entry[last_exit + 1:])
+            open_row = last_exit + 1 + int(later[0]) if len(later) else None
+            self.opened[name] = int(days[open_row]) if open_row is not None else None
+            self.signals[name] = "entry" if open_row == n - 1 else "exit" if last_exit == n - 1 else None
+        self.first = (dates[0], float(close[0]))
+        self.last_date = dates[-1]
+        self.last_close = float(close[-1])
+
+    def update(self, date, high, low, close):
+        """ Step the state through one new bar """
+        day = int(to_days([date])[0])
+        trends = [supertrend.update(high, low, close)[0] for supertrend in self.supertrends]
+        smas = [sma.update(close) for sma in self.smas]
+        for name, (entry, exit) in strategy_rules(close, trends, smas).items():
+            hold_days = STRATEGIES[name]
+            signal = None
+            opened = self.opened[name]
+            if opened is None and entry:
+                opened, signal = day, "entry"
+            if opened is not None and ((exit is not None and exit) or (hold_days and day - opened >= hold_days)):
+                opened, signal = None, "exit"
+            self.opened[name] = opened
+            self.signals[name] = signal
+        self.last_date = date
+        self.last_close = float(close)
+
+    def to_state(self):
+        return {
+            "supertrends": [supertrend.to_state() for supertrend in self.supertrends],
+            "smas": [sma.to_state() for sma in self.smas],
+            "first": [str(self.first[0]), self.first[1]],
+            "last_date": str(self.last_date),
+            "last_close": self.last_close,
+            "opened": self.opened,
+            "signals": self.signals,
+        }
+
+    @classmethod
+    def from_state(cls, saved):
+        scanner = cls()
+        scanner.supertrends = [Supertrend.from_state(supertrend) for supertrend in saved["supertrends"]]
+        scanner.smas = [SMA.from_state(sma) for sma in saved["smas"]]
+        scanner.first = tuple(saved["first"])
+        scanner.last_date = saved["last_date"]
+        scanner.last_close = saved["last_close"]
+        scanner.opened = dict(saved["opened"])
+        scanner.signals = dict(saved["signals"])
+        return scanner
+
+
+def load_state(path):
+    """ {ticker: TickerScanner}; empty, so every ticker is rebuilt, when the file is missing or from another version """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as file:
+            saved = json.load(file)
+        if saved.get("version") != STATE_VERSION:
+            return {}
+        return {ticker: TickerScanner.from_state(scanner) for ticker, scanner in saved["tickers"].items()}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return {}
+
+
+def save_state(state, path):
+    saved = {"version": STATE_VERSION, "tickers": {ticker: scanner.to_state() for ticker, scanner in state.items()}}
+    with open(path + ".tmp", "w") as file:
+        json.dump(saved, file)
+    os.replace(path + ".tmp", path)
+
+
+def latest_bars(conn):
+    """ {ticker: (date, close) of the newest bar} from populate_db's sync_state, or from prices when it has none """
+    rows = []
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sync_state'").fetchone():
+        rows = conn.execute("SELECT ticker, last_date, last_close FROM sync_state WHERE table_name = 'prices'").fetchall()
+    # SQLite takes the bare Close from the row holding MAX(Date)
+    rows = rows or conn.execute("SELECT ticker, MAX(Date), Close FROM prices GROUP BY ticker").fetchall()
+    return {ticker: (date, close) for ticker, date, close in rows}
+
+
+def _same_start(conn, ticker, scanner):
+    """ Whether the first bar the state was built from is still stored as it was """
+    date, close = scanner.first
+    row = conn.execute("SELECT Close FROM prices WHERE ticker = ? AND Date = ?", [ticker, date]).fetchone()
+    return row is not None and row[0] == close
+
+
+def _bars(conn, ticker, since=None, window=None):
+    if since is not None:
+        query, params = "SELECT Date, High, Low, Close FROM prices WHERE ticker = ? AND Date >= ? ORDER BY Date", [ticker, since]
+    elif window:
+        query = "SELECT * FROM (SELECT Date, High, Low, Close FROM prices WHERE ticker = ? ORDER BY Date DESC LIMIT ?) ORDER BY Date"
+        params = [ticker, window]
+    else:
+        query, params = "SELECT Date, High, Low, Close FROM prices WHERE ticker = ? ORDER BY Date", [ticker]
+    rows = conn.execute(query, params).fetchall()
+    dates = np.array([row[0] for row in rows], dtype=object)
+    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), 3)
+    return dates, values[:, 0], values[:, 1], values[:, 2]
+
+
+def scan(db_path="stock_data.db", state_path=DEFAULT_STATE, window=None, rebuild=False):
+    """
+    Bring every ticker's state up to its newest bar and return the signals of
+    the tickers that traded on the latest date, plus counts of what was done.
+    """
+    state = {} if rebuild else load_state(state_path)
+    counts = {"unchanged": 0, "updated": 0, "built": 0, "rebuilt": 0}
+    conn = connect(db_path, readonly=True)
+    try:
+        latest = latest_bars(conn)
+        for ticker, (last_date, last_close) in latest.items():
+            scanner = state.get(ticker)
+            if scanner is not None and scanner.last_date == last_date and scanner.last_close == last_close:
+                counts["unchanged"] += 1
+                continue
+            if scanner is not None:
+                dates, high, low, close = _bars(conn, ticker, since=scanner.last_date)
+                # Restated history (a split, or dividends under auto_adjust) moves the first or the last scanned close
+                if len(dates) and dates[0] == scanner.last_date and close[0] == scanner.last_close \
+                        and _same_start(conn, ticker, scanner):
+                    try:
+                        for i in range(1, len(dates)):
+                            scanner.update(dates[i], high[i], low[i], close[i])
+                        counts["updated"] += 1
+                        continue
+                    except HistoryChanged:
+                        pass
+                counts["rebuilt"] += 1
+            else:
+                counts["built"] += 1
+            dates, high, low, close = _bars(conn, ticker, window=window)
+            if not len(dates):
+                state.pop(ticker, None)
+                continue
+            scanner = TickerScanner()
+            scanner.batch(dates, high, low, close)
+            state[ticker] = scanner
+    finally:
+        conn.close()
+    state = {ticker: scanner for ticker, scanner in state.items() if ticker in latest}
+    save_state(state, state_path)
+
+    today = max((date for date, _ in latest.values()), default=None)
+    rows = [
+        {"ticker": ticker, "Date": scanner.last_date, "strategy": name, "signal": signal, "close": scanner.last_close}
+        for ticker, scanner in sorted(state.items()) if scanner.last_date == today
+        for name, signal in scanner.signals.items() if signal
+    ]
+    return pd.DataFrame(rows, columns=["ticker", "Date", "strategy", "signal", "close"]), counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Today's entry and exit signals of the simulate strategies")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--state", default=DEFAULT_STATE, help="indicator state kept between scans")
+    parser.add_argument("--out", default="signals.csv")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the stored state and rebuild every ticker")
+    parser.add_argument("--window", type=int, default=None, help="build new tickers from only their last N bars (approximate)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    signals, counts = scan(args.db, args.state, args.window, args.rebuild)
+    signals.to_csv(args.out, index=False)
+    print(", ".join(f"{count} {name}" for name, count in counts.items()) + f" tickers in {time.perf_counter() - start:.1f}s")
+    for (strategy, signal), group in signals.groupby(["strategy", "signal"]):
+        print(f"{strategy} {signal}: {', '.join(group['ticker'])}")
+
+
+if __name__ == "__main__":
+    main()
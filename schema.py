@@ -0,0 +1,368 @@
+import argparse
+import sqlite3
+
+# Managed schema for stock_data.db. Every table yfinance data lands in is
+# declared here with its key; line-item columns of the financial statements
+# are still added on demand by ensure_columns since yfinance decides them.
+
+PAGE_SIZE = 16384
+CACHE_SIZE_KB = 256 * 1024
+MMAP_SIZE = 1024 ** 3
+
+PRICE_COLUMNS = [
+    ("Open", "REAL"),
+    ("High", "REAL"),
+    ("Low", "REAL"),
+    ("Close", "REAL"),
+    ("Volume", "REAL"),
+    ("Dividends", "REAL"),
+    ("Stock Splits", "REAL"),
+]
+
+TABLES = {
+    "prices": {
+        "columns": [("ticker", "TEXT NOT NULL"), ("Date", "TEXT NOT NULL")] + PRICE_COLUMNS,
+        "primary_key": ["ticker", "Date"],
+    },
+    "dividends": {
+        "columns": [("ticker", "TEXT NOT NULL"), ("Date", "TEXT NOT NULL"), ("value", "REAL")],
+        "primary_key": ["ticker", "Date"],
+    },
+    "splits": {
+        "columns": [("ticker", "TEXT NOT NULL"), ("Date", "TEXT NOT NULL"), ("value", "REAL")],
+        "primary_key": ["ticker", "Date"],
+    },
+    "share_counts": {
+        "columns": [("ticker", "TEXT NOT NULL"), ("Date", "TEXT NOT NULL"), ("value", "REAL")],
+        "primary_key": ["ticker", "Date"],
+    },
+    "income_statements": {
+        "columns": [("ticker", "TEXT NOT NULL"), ("index", "TEXT NOT NULL")],
+        "primary_key": ["ticker", "index"],
+    },
+    "balance_sheets": {
+        "columns": [("ticker", "TEXT NOT NULL"), ("index", "TEXT NOT NULL")],
+        "primary_key": ["ticker", "index"],
+    },
+    "cash_flows": {
+        "columns": [("ticker", "TEXT NOT NULL"), ("index", "TEXT NOT NULL")],
+        "primary_key": ["ticker", "index"],
+    },
+    "upgrades_downgrades": {
+        "columns": [
+            ("ticker", "TEXT NOT NULL"),
+            ("GradeDate", "TEXT NOT NULL"),
+            ("Firm", "TEXT NOT NULL"),
+            ("ToGrade", "TEXT"),
+            ("FromGrade", "TEXT"),
+            ("Action", "TEXT"),
+        ],
+        "primary_key": ["ticker", "GradeDate", "Firm"],
+    },
+    # No natural key: rows are replaced per ticker on refresh
+    "insider_transactions": {
+        "columns": [("ticker", "TEXT NOT NULL")],
+        "primary_key": None,
+    },
+    "earnings": {
+        "columns": [("ticker", "TEXT NOT NULL")],
+        "primary_key": None,
+    },
+    "sync_state": {
+        "columns": [
+            ("ticker", "TEXT NOT NULL"),
+            ("table_name", "TEXT NOT NULL"),
+            ("last_date", "TEXT"),
+            ("last_close", "REAL"),
+            ("updated_at", "TEXT"),
+            # prices only: "raw" (populate_db --raw) or "adjusted" (yfinance auto_adjust)
+            ("mode", "TEXT"),
+        ],
+        "primary_key": ["ticker", "table_name"],
+    },
+    # Outcome of the last fetch of every (ticker, dataset), kept by ingest_ledger.py
+    "ingest_status": {
+        "columns": [
+            ("ticker", "TEXT NOT NULL"),
+            ("dataset", "TEXT NOT NULL"),
+            ("status", "TEXT NOT NULL"),
+            ("rows", "INTEGER"),
+            ("error_class", "TEXT"),
+            ("error", "TEXT"),
+            ("attempts", "INTEGER"),
+            ("last_attempt", "TEXT"),
+            ("last_success", "TEXT"),
+        ],
+        "primary_key": ["ticker", "dataset"],
+    },
+    # Derived daily indicators, materialized by features.py
+    "features": {
+        "columns": [
+            ("ticker", "TEXT NOT NULL"),
+            ("Date", "TEXT NOT NULL"),
+            ("Close", "REAL"),
+            ("sma_5", "REAL"),
+            ("sma_10", "REAL"),
+            ("sma_20", "REAL"),
+            ("sma_60", "REAL"),
+            ("sma_120", "REAL"),
+            ("atr_14", "REAL"),
+            ("supert_12_3", "REAL"),
+            ("supertd_12_3", "INTEGER"),
+            ("supert_11_2", "REAL"),
+            ("supertd_11_2", "INTEGER"),
+            ("supert_10_1", "REAL"),
+            ("supertd_10_1", "INTEGER"),
+            ("fwd_return_1", "REAL"),
+            ("fwd_return_5", "REAL"),
+            ("fwd_return_10", "REAL"),
+            ("fwd_return_20", "REAL"),
+        ],
+        "primary_key": ["ticker", "Date"],
+    },
+    # Quarterly statements in long format, written by populate_db and fundamentals.py
+    "fundamentals": {
+        "columns": [
+            ("ticker", "TEXT NOT NULL"),
+            ("period_end", "TEXT NOT NULL"),
+            ("field_id", "INTEGER NOT NULL"),
+            ("value", "REAL"),
+        ],
+        "primary_key": ["ticker", "period_end", "field_id"],
+    },
+    "fundamental_fields": {
+        "columns": [("statement", "TEXT NOT NULL"), ("name", "TEXT NOT NULL"), ("field_id", "INTEGER NOT NULL")],
+        "primary_key": ["statement", "name"],
+    },
+    # Split/dividend adjusted prices and what they were computed from, materialized by adjust.py
+    "prices_adjusted": {
+        "columns": [("ticker", "TEXT NOT NULL"), ("Date", "TEXT NOT NULL")] + PRICE_COLUMNS[:5] + [("factor", "REAL")],
+        "primary_key": ["ticker", "Date"],
+    },
+    "adjustment_state": {
+        "columns": [
+            ("ticker", "TEXT NOT NULL"),
+            ("actions", "TEXT"),
+            ("last_date", "TEXT"),
+            ("last_close", "REAL"),
+        ],
+        "primary_key": ["ticker"],
+    },
+    # features.FeatureState.to_state() JSON after each ticker's last materialized bar
+    "feature_state": {
+        "columns": [
+            ("ticker", "TEXT NOT NULL"),
+            ("last_date", "TEXT"),
+            ("last_close", "REAL"),
+            ("state", "BLOB"),
+        ],
+        "primary_key": ["ticker"],
+    },
+}
+
+# (index name, table, columns). Keyed tables are clustered on their primary
+# key (WITHOUT ROWID), so per-ticker reads are already range scans.
+INDEXES = [
+    ("prices_date", "prices", ["Date", "ticker"]),
+    ("features_date", "features", ["Date", "ticker"]),
+    ("prices_adjusted_date", "prices_adjusted", ["Date", "ticker"]),
+    ("fundamentals_field", "fundamentals", ["field_id", "ticker", "period_end"]),
+    ("insider_transactions_ticker", "insider_transactions", ["ticker"]),
+    ("earnings_ticker", "earnings", ["ticker"]),
+]
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get_sql_type(pandas_type):
+    """ Map pandas dtype to SQL dtype """
+    # Imported here so that scripts which only connect do not pay for pandas
+    import pandas as pd
+
+    if pd.api.types.is_string_dtype(pandas_type):
+        return 'TEXT'
+    elif pd.api.types.is_numeric_dtype(pandas_type):
+        return 'REAL'
+    elif pd.api.types.is_datetime64_any_dtype(pandas_type):
+        return 'DATETIME'
+    return 'BLOB'  # Default to BLOB if type is unclear
+
+
+def connect(db_path="stock_data.db", readonly=False, check_same_thread=True):
+    """ Open stock_data.db with WAL and the cache/mmap settings used everywhere """
+    if readonly:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+        conn.execute(f"PRAGMA page_size = {PAGE_SIZE}")  # only takes effect on a new file
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def create_table_sql(table_name, spec, extra_columns=()):
+    columns = list(spec["columns"]) + [column for column in extra_columns if column[0] not in dict(spec["columns"])]
+    definitions = [f"{quote(name)} {sql_type}" for name, sql_type in columns]
+    if spec["primary_key"]:
+        definitions.append(f"PRIMARY KEY ({', '.join(quote(name) for name in spec['primary_key'])})")
+        return f"CREATE TABLE IF NOT EXISTS {quote(table_name)} ({', '.join(definitions)}) WITHOUT ROWID"
+    return f"CREATE TABLE IF NOT EXISTS {quote(table_name)} ({', '.join(definitions)})"
+
+
+def create_indexes(conn):
+    for index_name, table_name, columns in INDEXES:
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote(index_name)} ON {quote(table_name)} "
+            f"({', '.join(quote(column) for column in columns)})"
+        )
+
+
+def ensure_schema(conn):
+    """ Create any missing managed tables and indexes, and add nullable managed columns older databases lack """
+    for table_name, spec in TABLES.items():
+        conn.execute(create_table_sql(table_name, spec))
+        existing = set(table_columns(conn, table_name))
+        for name, sql_type in spec["columns"]:
+            if name not in existing and "NOT NULL" not in sql_type:
+                conn.execute(f"ALTER TABLE {quote(table_name)} ADD COLUMN {quote(name)} {sql_type}")
+    create_indexes(conn)
+    conn.commit()
+
+
+def table_columns(conn, table_name):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote(table_name)})")]
+
+
+def ensure_columns(conn, table_name, dataframe):
+    """ Add any DataFrame column the table does not have yet """
+    existing = set(table_columns(conn, table_name))
+    for column, dtype in dataframe.dtypes.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {quote(table_name)} ADD COLUMN {quote(column)} {get_sql_type(dtype)}")
+            print(f"Added missing column '{column}' to '{table_name}'")
+
+
+def _sql_rows(dataframe):
+    # sqlite3 only binds plain Python scalars, and missing values must become NULL
+    values = dataframe.astype(object).where(dataframe.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+def upsert_dataframe(conn, table_name, dataframe, commit=True):
+    """
+    Bulk upsert with executemany. Rows whose primary key already exists are
+    updated in place, so reruns never duplicate data.
+    """
+    if dataframe.empty:
+        return 0
+    spec = TABLES.get(table_name)
+    if spec is None:
+        raise KeyError(f"{table_name} is not a managed table")
+    conn.execute(create_table_sql(table_name, spec))
+    ensure_columns(conn, table_name, dataframe)
+
+    columns = list(dataframe.columns)
+    insert = (
+        f"INSERT INTO {quote(table_name)} ({', '.join(quote(column) for column in columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)})"
+    )
+    key = spec["primary_key"]
+    if key:
+        updates = [column for column in columns if column not in key]
+        if updates:
+            assignments = ", ".join(f"{quote(column)} = excluded.{quote(column)}" for column in updates)
+            insert += f" ON CONFLICT ({', '.join(quote(column) for column in key)}) DO UPDATE SET {assignments}"
+        else:
+            insert += " ON CONFLICT DO NOTHING"
+        # Rows without a full key cannot be stored
+        dataframe = dataframe.dropna(subset=[column for column in key if column in dataframe.columns])
+    conn.executemany(insert, _sql_rows(dataframe))
+    if commit:
+        conn.commit()
+    return len(dataframe)
+
+
+def migrate(db_path="stock_data.db"):
+    """
+    Convert a stock_data.db created by DataFrame.to_sql in place: rebuild every
+    managed table with its key (duplicate rows collapse, last one wins), add the
+    indexes, switch to the managed page size and enable WAL. Each table is
+    rebuilt in one transaction, and a <table>_legacy left by an interrupted
+    run is picked up again.
+    """
+    # isolation_level=None: no implicit transactions, so the BEGIN below covers the DDL too
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table_name, spec in TABLES.items():
+        key = spec["primary_key"]
+        legacy = f"{table_name}_legacy"
+        if not key or (table_name not in existing and legacy not in existing):
+            continue
+        source = legacy if legacy in existing else table_name
+        info = conn.execute(f"PRAGMA table_info({quote(source)})").fetchall()
+        old_columns = [(row[1], row[2] or "BLOB") for row in info]
+        if source == table_name and [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]] == key:
+            print(f"{table_name} is already migrated")
+            continue
+        if not all(name in dict(old_columns) for name in key):
+            print(f"Skipping {table_name}: it has no {', '.join(key)} columns to key on")
+            continue
+        print(f"Resuming the migration of {table_name}" if source == legacy else f"Migrating {table_name}")
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            sources = [legacy]
+            if source == table_name:
+                conn.execute(f"ALTER TABLE {quote(table_name)} RENAME TO {quote(legacy)}")
+            elif table_name in existing:
+                # Rows written to the rebuilt table since the interruption are copied last, so they win
+                newer = f"{table_name}_newer"
+                conn.execute(f"ALTER TABLE {quote(table_name)} RENAME TO {quote(newer)}")
+                sources.append(newer)
+                old_columns += [(row[1], row[2] or "BLOB") for row in conn.execute(f"PRAGMA table_info({quote(newer)})")
+                                if row[1] not in dict(old_columns)]
+            conn.execute(create_table_sql(table_name, spec, old_columns))
+            not_null = " AND ".join(f"{quote(name)} IS NOT NULL" for name in key)
+            for table in sources:
+                column_list = ", ".join(quote(name) for name in table_columns(conn, table))
+                order = " ORDER BY rowid" if table == legacy else ""
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {quote(table_name)} ({column_list}) "
+                    f"SELECT {column_list} FROM {quote(table)} WHERE {not_null}{order}"
+                )
+                conn.execute(f"DROP TABLE {quote(table)}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    ensure_schema(conn)
+
+    # page_size can only change through a VACUUM outside WAL mode
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute(f"PRAGMA page_size = {PAGE_SIZE}")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the stock_data.db schema")
+    parser.add_argument("command", choices=["init", "migrate"])
+    parser.add_argument("--db", default="stock_data.db")
+    args = parser.parse_args()
+    if args.command == "init":
+        conn = connect(args.db)
+        ensure_schema(conn)
+        conn.close()
+    else:
+        migrate(args.db)
+
+
+if __name__ == "__main__":
+    main()
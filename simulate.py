@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from numeric import jit, njit
+from partition import as_partition
+
+ROI_COLUMNS = ["ticker", "buy_price", "sell_price", "buy_date", "sell_date"]
+# The text the roi files always had, from the dates stored in prices
+ROI_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+NS_PER_DAY = 86_400 * 10 ** 9
+
+
+@jit
+def _trade_kernel(starts, ends, entry, exit, dates, hold_ns, keep_open, entry_out, exit_out, open_out):
+    """
+    The per-row state machine of the simulate scripts, run over every ticker's
+    slice [start, end). A trade opens on the first entry row while flat and
+    closes on the first row (possibly the same one) where the exit signal is
+    set or hold_ns has elapsed since entry. Trades still open at the end of a
+    ticker are dropped, or with keep_open recorded with the ticker's last row
+    as exit and flagged in open_out. Fills entry_out/exit_out and returns the
+    trade count.
+    """
+    count = 0
+    for t in range(len(starts)):
+        in_trade = False
+        opened = 0
+        for i in range(starts[t], ends[t]):
+            if not in_trade and entry[i]:
+                in_trade = True
+                opened = i
+            if in_trade and (exit[i] or (hold_ns > 0 and dates[i] - dates[opened] >= hold_ns)):
+                entry_out[count] = opened
+                exit_out[count] = i
+                open_out[count] = False
+                count += 1
+                in_trade = False
+        if in_trade and keep_open:
+            entry_out[count] = opened
+            exit_out[count] = ends[t] - 1
+            open_out[count] = True
+            count += 1
+    return count
+
+
+def find_trades(starts, ends, entry, exit=None, dates=None, hold_days=None, keep_open=False):
+    """
+    Entry and exit row indices of every trade, as two int64 arrays. With
+    keep_open, trades still open on a ticker's last row are kept with that
+    row as exit, and a third boolean array flags them.
+    """
+    n = len(entry)
+    entry = np.ascontiguousarray(entry, dtype=np.bool_)
+    exit = np.zeros(n, dtype=np.bool_) if exit is None else np.ascontiguousarray(exit, dtype=np.bool_)
+    hold_ns = int(hold_days * NS_PER_DAY) if hold_days else 0
+    dates = np.zeros(n, dtype=np.int64) if dates is None else np.asarray(dates, dtype="datetime64[ns]").view(np.int64)
+    entry_out = np.empty(n, dtype=np.int64)
+    exit_out = np.empty(n, dtype=np.int64)
+    open_out = np.zeros(n, dtype=np.bool_)
+    if njit is None:
+        # Plain Python indexes lists much faster than NumPy arrays
+        count = _trade_kernel(starts.tolist(), ends.tolist(), entry.tolist(), exit.tolist(), dates.tolist(), hold_ns,
+                              bool(keep_open), entry_out, exit_out, open_out)
+    else:
+        count = _trade_kernel(starts, ends, entry, exit, dates, hold_ns, bool(keep_open), entry_out, exit_out, open_out)
+    if keep_open:
+        return entry_out[:count], exit_out[:count], open_out[:count]
+    return entry_out[:count], exit_out[:count]
+
+
+def simulate_trades(data, entry, exit=None, hold_days=None, price="Close_x", tickers=None):
+    """
+    Simulate a long-only strategy over the whole universe in one pass.
+
+    data is a TickerPartition (or a frame to partition) with ticker, Date and
+    the price column; entry/exit name boolean columns of it. Exits happen on
+    the exit signal and/or hold_days after entry. tickers restricts and orders
+    the output the way the scripts' `select distinct(ticker)` loop did.
+    Returns the roi frame the simulate scripts write, without the return column.
+    """
+    data = as_partition(data)
+    df = data.df
+    entry_rows, exit_rows = find_trades(
+        data.starts, data.ends, df[entry].to_numpy(), None if exit is None else df[exit].to_numpy(),
+        df["Date"].to_numpy() if hold_days else None, hold_days,
+    )
+
+    prices = df[price].to_numpy()
+    dates = df["Date"].to_numpy()
+    roi_df = pd.DataFrame({
+        "ticker": data.ticker_of_row(entry_rows),
+        "buy_price": prices[entry_rows],
+        "sell_price": prices[exit_rows],
+        "buy_date": dates[entry_rows],
+        "sell_date": dates[exit_rows],
+    }, columns=ROI_COLUMNS)
+    return roi_df if tickers is None else order_by_tickers(roi_df, tickers)
+
+
+def order_by_tickers(roi_df, tickers):
+    """
+    Only the trades of tickers, grouped in that order; each ticker's trades
+    keep their order. Lets trades simulated partition by partition be
+    concatenated and then ordered like a single pass.
+    """
+    order = {ticker: rank for rank, ticker in enumerate(tickers)}
+    ranks = roi_df["ticker"].map(order)
+    known = ranks.notna().to_numpy()
+    keep = np.argsort(ranks.to_numpy()[known], kind="stable")
+    return roi_df[known].iloc[keep].reset_index(drop=True)
+
+
+def add_returns(roi_df):
+    # Kept as the scripts always wrote it: 1 - sell/buy is positive for a
+    # losing trade. portfolio.py reports returns with the usual sign.
+    roi_df["return"] = (1 - (roi_df["sell_price"] / roi_df["buy_price"])) * 100
+    return roi_df
+
+
+def write_roi(roi_df, out):
+    """
+    Write an roi frame as csv. Dates come out of the result store as
+    datetime64, which to_csv would shorten to YYYY-MM-DD, so they are
+    written in ROI_DATE_FORMAT like the per-row scripts did.
+    """
+    roi_df = roi_df.copy()
+    for column in ("buy_date", "sell_date"):
+        if pd.api.types.is_datetime64_any_dtype(roi_df[column]):
+            roi_df[column] = roi_df[column].dt.strftime(ROI_DATE_FORMAT)
+    roi_df.to_csv(out)
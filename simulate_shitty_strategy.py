@@ -1,52 +1,73 @@
+import argparse
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
 import sqlite3
 
+from instrument import frame_bytes, metrics
+from partition import TickerPartition
+from result_store import DEFAULT_RESULTS, read_prepped
+from simulate import ROI_COLUMNS, add_returns, order_by_tickers, simulate_trades, write_roi
+
 def query_db(query, db_path="stock_data.db"):
     conn = sqlite3.connect(db_path)
     df = pd.read_sql_query(query, conn)
     conn.close()
     return df
 
-def days_between(d1, d2):
-    # d1 = datetime.strptime(d1, "%Y-%m-%d")
-    # d2 = datetime.strptime(d2, "%Y-%m-%d")
-    return (d2 - d1).days
-
-df = pd.read_csv("prepped_data.csv", low_memory=False)
-print(df.head())
-print("getting tickers")
-
-tickers = query_db('select distinct(ticker) from prices')["ticker"].tolist()
-
-roi_df = pd.DataFrame(columns=["ticker", "buy_price", "sell_price", "buy_date", "sell_date"])
-
-for ticker in tqdm(tickers):
-    in_trade = False
-    current_trade_price = None
-    current_trade_date = None
-    sub_df = df[df["ticker"] == ticker]
-    sub_df = sub_df.sort_values(by="Date")
-    sub_df["sma_5"] = sub_df["Close_x"].rolling(5).mean()
-    sub_df["sma_10"] = sub_df["Close_x"].rolling(10).mean()
-    sub_df["sma_20"] = sub_df["Close_x"].rolling(20).mean()
-    sub_df["sma_60"] = sub_df["Close_x"].rolling(60).mean()
-    sub_df["sma_120"] = sub_df["Close_x"].rolling(120).mean()
-    for row in sub_df.itertuples(index=False):
-        if not in_trade:
-            if row.Close_x > row.sma_5 > row.sma_10 > row.sma_20 > row.sma_60 > row.sma_120:
-                in_trade = True
-                current_trade_price = row.Close_x
-                current_trade_date = row.Date
-        if in_trade:
-            if days_between(current_trade_date, row.Date) >= 10:
-                new_row = pd.DataFrame([{"ticker": ticker, 
-                                        "buy_price": current_trade_price, 
-                                        "sell_price": row.Close_x, 
-                                        "buy_date": current_trade_date, 
-                                        "sell_date": row.Date}])
-                roi_df = pd.concat([roi_df, new_row], ignore_index=True)
-                in_trade = False
-
-roi_df["return"] = (1 - (roi_df["sell_price"] / roi_df["buy_price"])) * 100
-roi_df.to_csv("roi_shitty_strategy.csv")
\ No newline at end of file
+SMA_WINDOWS = [5, 10, 20, 60, 120]
+
+def run(results=DEFAULT_RESULTS, db_path="stock_data.db", out="roi_shitty_strategy.csv"):
+    """ Trades of the SMA stack strategy over the backtest results, written to out """
+    with metrics.stage("tickers") as stage:
+        tickers = query_db('select distinct(ticker) from prices', db_path)["ticker"].tolist()
+        stage.add(rows=len(tickers))
+
+    # One result partition at a time; every ticker lives in a single partition
+    frames = []
+    partitions = read_prepped(results)
+    while True:
+        with metrics.stage("load") as stage:
+            df = next(partitions, None)
+            if df is None:
+                break
+            stage.add(rows=len(df), bytes_read=frame_bytes(df))
+        if not frames:
+            print(df.head())
+
+        with metrics.stage("signals") as stage:
+            data = TickerPartition(df)
+            closes = data.groupby("Close_x")
+            for window in SMA_WINDOWS:
+                data.df[f"sma_{window}"] = closes.rolling(window).mean().reset_index(level=0, drop=True)
+
+            # Close_x > sma_5 > sma_10 > sma_20 > sma_60 > sma_120
+            stack = ["Close_x"] + [f"sma_{window}" for window in SMA_WINDOWS]
+            data.df["entry"] = np.logical_and.reduce([data.df[a] > data.df[b] for a, b in zip(stack, stack[1:])])
+            stage.add(rows=len(data.df))
+
+        with metrics.stage("simulate") as stage:
+            frames.append(simulate_trades(data, "entry", hold_days=10, price="Close_x"))
+            stage.add(rows=len(frames[-1]))
+
+    roi_df = order_by_tickers(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ROI_COLUMNS), tickers)
+    roi_df = add_returns(roi_df)
+
+    with metrics.stage("write") as stage:
+        write_roi(roi_df, out)
+        stage.add(rows=len(roi_df))
+    return roi_df
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the SMA stack strategy with a 10 day hold")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="result store written by backtest_supertrend_2.py")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--out", default="roi_shitty_strategy.csv")
+    parser.add_argument("--metrics", default=None, help="JSON lines metrics file (defaults to $METRICS_PATH)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+    run(args.results, args.db, args.out)
+    metrics.close()
+
+
+if __name__ == "__main__":
+    main()
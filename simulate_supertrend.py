@@ -1,6 +1,12 @@
-import pandas as pd
+import argparse
 import sqlite3
-from tqdm import tqdm
+
+import pandas as pd
+
+from instrument import frame_bytes, metrics
+from partition import TickerPartition
+from result_store import DEFAULT_RESULTS, read_prepped
+from simulate import ROI_COLUMNS, add_returns, order_by_tickers, simulate_trades, write_roi
 
 def query_db(query, db_path="stock_data.db"):
     conn = sqlite3.connect(db_path)
@@ -9,54 +15,58 @@ def query_db(query, db_path="stock_data.db"):
     return df
 
 
-# # Use tqdm to show the progress bar
-# df = pd.read_csv("dataset.csv", low_memory=False)
-
-# df.reset_index(drop=True, inplace=True)
-# print("querying prices")
-# prices = query_db("select ticker, Date, Close from prices")
-
-# print("merging dfs")
+# prepped_data.csv used to be built here by merging dataset.csv with prices;
+# read_prepped now derives the same Close_x/super_*_indicator columns,
+# partition by partition, straight from the backtest result store.
 
-# df = pd.merge(df, prices, how="left", on=["Date", "ticker"])
+def run(results=DEFAULT_RESULTS, db_path="stock_data.db", out="roi.csv"):
+    """ Trades of the Supertrend consensus strategy over the backtest results, written to out """
+    with metrics.stage("tickers") as stage:
+        tickers = query_db('select distinct(ticker) from prices', db_path)["ticker"].tolist()
+        stage.add(rows=len(tickers))
 
-# print("assigning indicators")
+    # One result partition at a time; every ticker lives in a single partition
+    frames = []
+    partitions = read_prepped(results)
+    while True:
+        with metrics.stage("load") as stage:
+            df = next(partitions, None)
+            if df is None:
+                break
+            stage.add(rows=len(df), bytes_read=frame_bytes(df))
+        if not frames:
+            print(df.head())
 
-# df["super_12_3_indicator"] = df["Close_x"] > df["SUPERT_12_3.0"]
-# df["super_11_2_indicator"] = df["Close_x"] > df["SUPERT_11_2.0"]
-# df["super_10_1_indicator"] = df["Close_x"] > df["SUPERT_10_1.0"]
+        with metrics.stage("signals") as stage:
+            data = TickerPartition(df)
+            indicators = ["super_12_3_indicator", "super_11_2_indicator", "super_10_1_indicator"]
+            data.df["entry"] = data.df[indicators].all(axis=1)
+            data.df["exit"] = data.df[indicators].astype(int).sum(axis=1) <= 1
+            stage.add(rows=len(data.df))
 
-# df.to_csv("prepped_data.csv")
+        with metrics.stage("simulate") as stage:
+            frames.append(simulate_trades(data, "entry", "exit", price="Close_x"))
+            stage.add(rows=len(frames[-1]))
 
-df = pd.read_csv("prepped_data.csv", low_memory=False)
-print(df.head())
-print("getting tickers")
+    roi_df = order_by_tickers(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ROI_COLUMNS), tickers)
+    roi_df = add_returns(roi_df)
 
-tickers = query_db('select distinct(ticker) from prices')["ticker"].tolist()
+    with metrics.stage("write") as stage:
+        write_roi(roi_df, out)
+        stage.add(rows=len(roi_df))
+    return roi_df
 
-roi_df = pd.DataFrame(columns=["ticker", "buy_price", "sell_price", "buy_date", "sell_date"])
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the Supertrend consensus strategy")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="result store written by backtest_supertrend_2.py")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--out", default="roi.csv")
+    parser.add_argument("--metrics", default=None, help="JSON lines metrics file (defaults to $METRICS_PATH)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+    run(args.results, args.db, args.out)
+    metrics.close()
 
-for ticker in tqdm(tickers):
-    in_trade = False
-    current_trade_price = None
-    current_trade_date = None
-    sub_df = df[df["ticker"] == ticker]
-    sub_df = sub_df.sort_values(by="Date")
-    for row in sub_df.itertuples(index=False):
-        if not in_trade:
-            if row.super_12_3_indicator and row.super_11_2_indicator and row.super_10_1_indicator:
-                in_trade = True
-                current_trade_price = row.Close_x
-                current_trade_date = row.Date
-        if in_trade:
-            if sum([int(row.super_12_3_indicator), int(row.super_11_2_indicator), int(row.super_10_1_indicator)]) <= 1:
-                new_row = pd.DataFrame([{"ticker": ticker, 
-                                        "buy_price": current_trade_price, 
-                                        "sell_price": row.Close_x, 
-                                        "buy_date": current_trade_date, 
-                                        "sell_date": row.Date}])
-                roi_df = pd.concat([roi_df, new_row], ignore_index=True)
-                in_trade = False
 
-roi_df["return"] = (1 - (roi_df["sell_price"] / roi_df["buy_price"])) * 100
-roi_df.to_csv("roi.csv")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from numeric import as_array, jit, njit
+
+# (length, multiplier) pairs the backtest, features, scan and panel strategies use
+SUPERTREND_PARAMS = [(12, 3), (11, 2), (10, 1)]
+
+
+def true_range(high, low, close):
+    """ True range as computed by pandas_ta (first bar is NaN) """
+    high, low, close = as_array(high), as_array(low), as_array(close)
+    high_low = high - low
+    # pandas_ta nudges the whole range by epsilon when any bar has high == low
+    if (high_low == 0).any():
+        high_low = high_low + sys.float_info.epsilon
+    prev_close = np.empty_like(close)
+    prev_close[:1] = np.nan
+    prev_close[1:] = close[:-1]
+    tr = np.fmax(np.abs(high_low), np.fmax(np.abs(high - prev_close), np.abs(prev_close - low)))
+    tr[:1] = np.nan
+    return tr
+
+
+@jit
+def _ewm_mean(values, alpha, min_periods):
+    # Mirrors pandas' ewm(alpha=..., adjust=True, ignore_na=False).mean()
+    n = values.shape[0]
+    out = np.empty(n)
+    if n == 0:
+        return out
+    old_wt_factor = 1.0 - alpha
+    weighted = values[0]
+    old_wt = 1.0
+    nobs = 1 if weighted == weighted else 0
+    out[0] = weighted if nobs >= min_periods else np.nan
+    for i in range(1, n):
+        cur = values[i]
+        is_obs = cur == cur
+        if is_obs:
+            nobs += 1
+        if weighted == weighted:
+            old_wt *= old_wt_factor
+            if is_obs:
+                if weighted != cur:
+                    weighted = ((old_wt * weighted) + cur) / (old_wt + 1.0)
+                old_wt += 1.0
+        elif is_obs:
+            weighted = cur
+        out[i] = weighted if nobs >= min_periods else np.nan
+    return out
+
+
+def rma(values, length):
+    """ Wilder's moving average, i.e. pandas_ta's default ATR smoothing """
+    values = as_array(values)
+    if njit is None:
+        # pandas runs the same recurrence in Cython, so results are identical
+        return pd.Series(values).ewm(alpha=1.0 / length, min_periods=length).mean().to_numpy()
+    return _ewm_mean(values, 1.0 / length, max(int(length), 1))
+
+
+def atr(high, low, close, length):
+    return rma(true_range(high, low, close), length)
+
+
+@jit
+def _supertrend_kernel(close, upper, lower):
+    # upper and lower are modified in place as the bands ratchet
+    n = len(close)
+    trend = np.full(n, np.nan)
+    direction = np.ones(n, dtype=np.int64)
+    long = np.full(n, np.nan)
+    short = np.full(n, np.nan)
+    if n == 0:
+        return trend, direction, long, short
+    trend[0] = 0.0
+    for i in range(1, n):
+        if close[i] > upper[i - 1]:
+            direction[i] = 1
+        elif close[i] < lower[i - 1]:
+            direction[i] = -1
+        else:
+            direction[i] = direction[i - 1]
+            if direction[i] > 0 and lower[i] < lower[i - 1]:
+                lower[i] = lower[i - 1]
+            if direction[i] < 0 and upper[i] > upper[i - 1]:
+                upper[i] = upper[i - 1]
+
+        if direction[i] > 0:
+            trend[i] = lower[i]
+            long[i] = lower[i]
+        else:
+            trend[i] = upper[i]
+            short[i] = upper[i]
+    return trend, direction, long, short
+
+
+def supertrend_arrays(high, low, close, length=7, multiplier=3.0, atr_values=None):
+    """ Supertrend over plain arrays, returns (trend, direction, long, short) """
+    high, low, close = as_array(high), as_array(low), as_array(close)
+    if atr_values is None:
+        atr_values = atr(high, low, close, length)
+    hl2 = 0.5 * (high + low)
+    matr = multiplier * atr_values
+    upper, lower = hl2 + matr, hl2 - matr
+    if njit is None:
+        # Plain Python indexes lists much faster than NumPy arrays
+        return _supertrend_kernel(close.tolist(), upper.tolist(), lower.tolist())
+    return _supertrend_kernel(close, upper, lower)
+
+
+def supertrend(high, low, close, length=7, multiplier=3.0):
+    """ Drop-in replacement for pandas_ta.supertrend with the same column names """
+    length = int(length) if length and length > 0 else 7
+    multiplier = float(multiplier) if multiplier and multiplier > 0 else 3.0
+    trend, direction, long, short = supertrend_arrays(high, low, close, length, multiplier)
+
+    props = f"_{length}_{multiplier}"
+    return pd.DataFrame(
+        {
+            f"SUPERT{props}": trend,
+            f"SUPERTd{props}": direction,
+            f"SUPERTl{props}": long,
+            f"SUPERTs{props}": short,
+        },
+        index=close.index if isinstance(close, pd.Series) else None,
+    )
+
+
+@jit
+def _supertrend_grid_kernel(close, upper, lower):
+    # Same recurrence as _supertrend_kernel, run for every column (parameter set) at once
+    n, p = upper.shape
+    trend = np.full((n, p), np.nan)
+    direction = np.ones((n, p), dtype=np.int8)
+    if n == 0:
+        return trend, direction
+    trend[0, :] = 0.0
+    for i in range(1, n):
+        for j in range(p):
+            if close[i] > upper[i - 1, j]:
+                direction[i, j] = 1
+            elif close[i] < lower[i - 1, j]:
+                direction[i, j] = -1
+            else:
+                direction[i, j] = direction[i - 1, j]
+                if direction[i, j] > 0 and lower[i, j] < lower[i - 1, j]:
+                    lower[i, j] = lower[i - 1, j]
+                if direction[i, j] < 0 and upper[i, j] > upper[i - 1, j]:
+                    upper[i, j] = upper[i - 1, j]
+
+            if direction[i, j] > 0:
+                trend[i, j] = lower[i, j]
+            else:
+                trend[i, j] = upper[i, j]
+    return trend, direction
+
+
+def param_grid(lengths, multipliers):
+    """ Every (length, multiplier) combination, lengths varying slowest """
+    return [(int(length), float(multiplier)) for length in lengths for multiplier in multipliers]
+
+
+def supertrend_grid(high, low, close, params):
+    """
+    Supertrend for many (length, multiplier) pairs in one go. True range is
+    computed once and the ATR once per distinct length; the multipliers are
+    broadcast on top. Returns (trend, direction) as (time x parameter set)
+    arrays with columns in the order of params. The long/short columns of
+    pandas_ta are trend masked by direction > 0 / direction < 0.
+    """
+    params = [(int(length), float(multiplier)) for length, multiplier in params]
+    high, low, close = as_array(high), as_array(low), as_array(close)
+    tr = true_range(high, low, close)
+    atrs = {length: rma(tr, length) for length in sorted({length for length, _ in params})}
+
+    atr_matrix = np.column_stack([atrs[length] for length, _ in params]) if params else np.empty((len(close), 0))
+    multipliers = np.array([multiplier for _, multiplier in params])
+    hl2 = 0.5 * (high + low)
+    matr = multipliers * atr_matrix
+    upper = np.ascontiguousarray(hl2[:, None] + matr)
+    lower = np.ascontiguousarray(hl2[:, None] - matr)
+
+    if njit is not None:
+        return _supertrend_grid_kernel(close, upper, lower)
+
+    trend = np.empty(upper.shape)
+    direction = np.empty(upper.shape, dtype=np.int8)
+    closes = close.tolist()
+    for j in range(len(params)):
+        trend[:, j], direction[:, j], _, _ = _supertrend_kernel(closes, upper[:, j].tolist(), lower[:, j].tolist())
+    return trend, direction
+
+
+def supertrend_grid_columns(trend, direction, params, starts=(0,)):
+    """
+    Expand supertrend_grid output into the pandas_ta columns. starts are the
+    first rows of each series when several tickers are stacked in one array.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    starts = starts[starts < len(trend)]
+    columns = {}
+    for j, (length, multiplier) in enumerate(params):
+        props = f"_{int(length)}_{float(multiplier)}"
+        long = np.where(direction[:, j] > 0, trend[:, j], np.nan)
+        short = np.where(direction[:, j] < 0, trend[:, j], np.nan)
+        # pandas_ta leaves both bands empty on the seed bar
+        long[starts] = np.nan
+        short[starts] = np.nan
+        columns[f"SUPERT{props}"] = trend[:, j]
+        columns[f"SUPERTd{props}"] = direction[:, j].astype(np.int64)
+        columns[f"SUPERTl{props}"] = long
+        columns[f"SUPERTs{props}"] = short
+    return columns
+
+
+def supertrend_grid_frame(high, low, close, params):
+    """ supertrend_grid laid out with the same columns as repeated pandas_ta.supertrend calls """
+    params = [(int(length), float(multiplier)) for length, multiplier in params]
+    trend, direction = supertrend_grid(high, low, close, params)
+    return pd.DataFrame(supertrend_grid_columns(trend, direction, params), index=close.index if isinstance(close, pd.Series) else None)
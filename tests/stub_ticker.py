@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+
+# Offline stand-in for yf.Ticker serving the recorded responses in fixtures/.
+# Every attribute populate_db.fetch_data reads comes back in the shape
+# yfinance returns it; `bars` truncates the history so a later call can
+# "see" new bars, and `fail` names attributes that raise like a network error.
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+TIMEZONE = "America/New_York"
+
+
+def _read_series(path):
+    series = pd.read_csv(path, index_col=0).iloc[:, 0]
+    series.index = pd.to_datetime(series.index, utc=True).tz_convert(TIMEZONE).rename("Date")
+    return series
+
+
+def _read_statement(path):
+    statement = pd.read_csv(path, index_col=0)
+    statement.columns = pd.to_datetime(statement.columns)
+    return statement
+
+
+class StubTicker:
+    def __init__(self, ticker, bars=None, fail=(), fixtures=FIXTURES):
+        self.ticker = ticker
+        self.bars = bars
+        self.fail = set(fail)
+        self.fixtures = fixtures
+        self.calls = []
+
+    def _fixture(self, attribute):
+        self.calls.append(attribute)
+        if attribute in self.fail:
+            raise ConnectionError(f"recorded failure of {attribute}")
+        return os.path.join(self.fixtures, f"{self.ticker}_{attribute}.csv")
+
+    def history(self, period=None, start=None, auto_adjust=True):
+        df = pd.read_csv(self._fixture("history"), index_col=0)
+        df.index = pd.to_datetime(df.index, utc=True).tz_convert(TIMEZONE).rename("Date")
+        if self.bars is not None:
+            df = df.iloc[:self.bars]
+        if start:
+            df = df[df.index >= pd.Timestamp(start, tz=TIMEZONE)]
+        return df
+
+    @property
+    def dividends(self):
+        return _read_series(self._fixture("dividends"))
+
+    @property
+    def splits(self):
+        self._fixture("splits")
+        return pd.Series([], dtype=float, index=pd.DatetimeIndex([], tz=TIMEZONE, name="Date"))
+
+    def get_shares_full(self, start=None):
+        self._fixture("get_shares_full")
+        return None
+
+    @property
+    def quarterly_financials(self):
+        return _read_statement(self._fixture("quarterly_financials"))
+
+    @property
+    def quarterly_balance_sheet(self):
+        return _read_statement(self._fixture("quarterly_balance_sheet"))
+
+    @property
+    def quarterly_cash_flow(self):
+        return _read_statement(self._fixture("quarterly_cash_flow"))
+
+    @property
+    def insider_transactions(self):
+        self._fixture("insider_transactions")
+        return pd.DataFrame()
+
+    @property
+    def upgrades_downgrades(self):
+        self._fixture("upgrades_downgrades")
+        return pd.DataFrame()
+
+    @property
+    def earnings(self):
+        self._fixture("earnings")
+        # yfinance no longer serves Ticker.earnings
+        raise NotImplementedError("earnings")
@@ -0,0 +1,80 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from adjust import adjustment_factors, refresh_adjusted
+from schema import connect, ensure_schema, upsert_dataframe
+
+DATES = pd.bdate_range("2024-01-01", periods=6).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def test_adjustment_factors():
+    close = np.array([10.0, 10.0, 8.0, 8.0, 4.0, 4.0])
+    price, volume = adjustment_factors(
+        DATES, close,
+        # 2-for-1 on bar 4; one before the first bar is already in every price
+        split_dates=["2023-12-01", DATES[4]], split_ratios=[3.0, 2.0],
+        # 2.0 on bar 2 is 20% of the previous close; 1.0 after the last bar is 25% of the last close
+        dividend_dates=[DATES[2], "2024-02-01"], dividends=[2.0, 1.0],
+    )
+    np.testing.assert_allclose(price, [0.3, 0.3, 0.375, 0.375, 0.75, 0.75])
+    np.testing.assert_allclose(volume, [2.0, 2.0, 2.0, 2.0, 1.0, 1.0])
+
+
+def write_db(db_path, bars, mode="raw", dividends=()):
+    close = np.linspace(10.0, 15.0, 6)[:bars]
+    prices = pd.DataFrame({"ticker": "AAA", "Date": DATES[:bars], "Open": close, "High": close, "Low": close,
+                           "Close": close, "Volume": 100.0})
+    conn = connect(db_path)
+    ensure_schema(conn)
+    upsert_dataframe(conn, "prices", prices)
+    if dividends:
+        upsert_dataframe(conn, "dividends", pd.DataFrame({"ticker": "AAA", "Date": [DATES[i] for i, _ in dividends],
+                                                          "value": [value for _, value in dividends]}))
+    conn.execute("INSERT OR REPLACE INTO sync_state (ticker, table_name, last_date, mode) VALUES ('AAA', 'prices', ?, ?)",
+                 [DATES[bars - 1], mode])
+    conn.commit()
+    conn.close()
+
+
+def adjusted(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT Date, Close, factor FROM prices_adjusted ORDER BY Date").fetchall()
+    finally:
+        conn.close()
+
+
+def test_refresh_adjusted_appends_then_rewrites(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    write_db(db_path, 4)
+    assert refresh_adjusted(db_path) == (1, 0)
+    assert [factor for _, _, factor in adjusted(db_path)] == [1.0] * 4
+
+    # Two new bars and no new action: only they are added
+    write_db(db_path, 6)
+    assert refresh_adjusted(db_path) == (0, 1)
+    assert len(adjusted(db_path)) == 6
+    assert refresh_adjusted(db_path) == (0, 0)
+
+    # A dividend on bar 3 rewrites the ticker and scales every earlier bar
+    write_db(db_path, 6, dividends=[(3, 1.2)])
+    assert refresh_adjusted(db_path) == (1, 0)
+    factors = [factor for _, _, factor in adjusted(db_path)]
+    np.testing.assert_allclose(factors, [0.9] * 3 + [1.0] * 3)
+
+
+def test_refresh_adjusted_refuses_adjusted_prices(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    write_db(db_path, 6, mode="adjusted", dividends=[(3, 1.2)])
+    with pytest.raises(ValueError, match="not recorded as raw"):
+        refresh_adjusted(db_path)
+    assert adjusted(db_path) == []
+
+    # No recorded mode is only accepted when the caller vouches for the prices
+    write_db(db_path, 6, mode=None, dividends=[(3, 1.2)])
+    with pytest.raises(ValueError):
+        refresh_adjusted(db_path)
+    assert refresh_adjusted(db_path, assume_raw=True) == (1, 0)
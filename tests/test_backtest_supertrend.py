@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from backtest_supertrend import calculate_supertrend, supertrend_line
+from partition import TickerPartition
+
+
+def reference_line(df, multiplier, length):
+    # The script's original per-row pandas version
+    tr = pd.concat([df["High"] - df["Low"], (df["High"] - df["Close"].shift(1)).abs(),
+                    (df["Low"] - df["Close"].shift(1)).abs()], axis=1).max(axis=1)
+    atr = tr.rolling(window=length).mean()
+    upper = ((df["High"] + df["Low"]) / 2 + multiplier * atr).tolist()
+    lower = ((df["High"] + df["Low"]) / 2 - multiplier * atr).tolist()
+    close = df["Close"].tolist()
+    final_upper, final_lower = [0.0], [0.0]
+    for i in range(1, len(df)):
+        final_upper.append(min(upper[i], final_upper[-1]) if close[i - 1] <= final_upper[-1] else upper[i])
+        final_lower.append(max(lower[i], final_lower[-1]) if close[i - 1] >= final_lower[-1] else lower[i])
+    return np.array([fl if c > fu else fu for c, fu, fl in zip(close, final_upper, final_lower)])
+
+
+def prices(ticker, n, seed):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    spread = np.abs(rng.normal(0, 0.01, n)) * close
+    return pd.DataFrame({
+        "Date": pd.date_range("2020-01-01", periods=n).strftime("%Y-%m-%d %H:%M:%S"),
+        "ticker": ticker, "High": close + spread, "Low": close - spread, "Close": close,
+    })
+
+
+def test_keeps_the_scripts_own_supertrend():
+    df = prices("AAA", 400, 0)
+    for multiplier, length in [(3, 12), (2, 11), (1, 10)]:
+        line = supertrend_line(df["High"], df["Low"], df["Close"], multiplier, length)
+        np.testing.assert_allclose(line, reference_line(df, multiplier, length), rtol=0, atol=1e-9)
+
+
+def test_per_ticker():
+    df = pd.concat([prices("AAA", 300, 1), prices("BBB", 200, 2)], ignore_index=True)
+    out = calculate_supertrend(TickerPartition(df), 2, 11)
+    for ticker, group in df.groupby("ticker"):
+        np.testing.assert_allclose(out.loc[out["ticker"] == ticker, "Supertrend_2_11"].to_numpy(),
+                                   reference_line(group.reset_index(drop=True), 2, 11), rtol=0, atol=1e-9)
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import backtest_supertrend_2
+from backtest_supertrend_2 import process_chunk, run_backtest, write_chunk
+from result_store import ResultWriter, read_manifest, read_results
+from supertrend import supertrend_grid
+
+
+def write_prices(db_path, bars):
+    rng = np.random.default_rng(0)
+    frames = []
+    for ticker, n in bars.items():
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+        frames.append(pd.DataFrame({
+            "ticker": ticker, "Date": pd.bdate_range("2023-01-02", periods=n).strftime("%Y-%m-%d %H:%M:%S"),
+            "Open": close, "High": close * 1.01, "Low": close * 0.99, "Close": close, "Volume": 1000.0,
+        }))
+    conn = sqlite3.connect(db_path)
+    pd.concat(frames).to_sql("prices", conn, index=False)
+    conn.close()
+
+
+def test_chunk_frame_skips_failures(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "stock_data.db")
+    write_prices(db_path, {"AAA": 40, "BBB": 25, "CCC": 30})
+
+    def failing_grid(high, low, close, params):
+        if len(close) == 25:
+            raise FloatingPointError("recorded failure")
+        return supertrend_grid(high, low, close, params)
+
+    monkeypatch.setattr(backtest_supertrend_2, "supertrend_grid", failing_grid)
+    result = process_chunk(["AAA", "BBB", "CCC"], db_path)
+    assert result["errors"] == [("BBB", "FloatingPointError", "recorded failure")]
+
+    frame = result["frame"]
+    assert frame["ticker"].unique().tolist() == ["AAA", "CCC"]
+    assert len(frame) == 70
+    assert not frame["SUPERT_12_3.0"].iloc[1:40].isna().all()
+    # pandas_ta leaves the bands empty on each ticker's seed bar
+    assert np.isnan(frame["SUPERTl_10_1.0"].iloc[40]) and np.isnan(frame["SUPERTs_10_1.0"].iloc[40])
+    expected, _ = supertrend_grid(frame["High"][40:], frame["Low"][40:], frame["Close"][40:], backtest_supertrend_2.SUPERTREND_PARAMS)
+    np.testing.assert_array_equal(frame["SUPERT_10_1.0"][40:].to_numpy(), expected[:, 2])
+
+
+def test_worker_writes_its_partition(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    write_prices(db_path, {"AAA": 40, "BBB": 25})
+    root = str(tmp_path / "dataset")
+    writer = ResultWriter(root)
+    result = write_chunk(["AAA", "BBB"], root, writer.reserve(), db_path)
+    assert "frame" not in result
+    assert result["partition"] == {"file": "part-00000.npz", "rows": 65, "tickers": {"AAA": [0, 40], "BBB": [40, 65]}}
+    writer.add(result["partition"], result["columns"])
+    assert read_results(root, ["ticker"])["ticker"].tolist() == ["AAA"] * 40 + ["BBB"] * 25
+
+
+def test_run_backtest_matches_the_single_chunk_frame(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    write_prices(db_path, {"AAA": 40, "BBB": 25, "CCC": 30})
+    root = str(tmp_path / "dataset")
+    run_backtest(db_path, root, workers=1, chunk_rows=50)
+    assert len(read_manifest(root)["partitions"]) > 1
+    stored = read_results(root).sort_values(["ticker", "Date"], ignore_index=True)
+    expected = process_chunk(["AAA", "BBB", "CCC"], db_path)["frame"]
+    expected["Date"] = pd.to_datetime(expected["Date"])
+    pd.testing.assert_frame_equal(stored, expected, check_dtype=False)
+
+
+def test_rerun_keeps_unchanged_partitions(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    write_prices(db_path, {"AAA": 40, "BBB": 25, "CCC": 30})
+    root = str(tmp_path / "dataset")
+    run_backtest(db_path, root, workers=1, chunk_rows=50)
+    before = {partition["file"]: sorted(partition["tickers"]) for partition in read_manifest(root)["partitions"]}
+
+    run_backtest(db_path, root, workers=1, chunk_rows=50)
+    assert {partition["file"]: sorted(partition["tickers"]) for partition in read_manifest(root)["partitions"]} == before
+
+    # A restated close on BBB's last bar only recomputes BBB's partition
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE prices SET Close = Close * 1.1 WHERE ticker = 'BBB' AND Date = (SELECT MAX(Date) FROM prices WHERE ticker = 'BBB')")
+    conn.commit()
+    conn.close()
+    run_backtest(db_path, root, workers=1, chunk_rows=50)
+    after = {partition["file"]: sorted(partition["tickers"]) for partition in read_manifest(root)["partitions"]}
+    assert {file: tickers for file, tickers in after.items() if "BBB" not in tickers} == \
+        {file: tickers for file, tickers in before.items() if "BBB" not in tickers}
+    assert sorted(os.listdir(root)) == sorted(list(after) + ["manifest.json"])
+
+    incremental = read_results(root).sort_values(["ticker", "Date"], ignore_index=True)
+    run_backtest(db_path, str(tmp_path / "full"), workers=1, chunk_rows=50, full=True)
+    pd.testing.assert_frame_equal(incremental, read_results(str(tmp_path / "full")).sort_values(["ticker", "Date"], ignore_index=True))
@@ -0,0 +1,71 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from features import compute_features, refresh_features
+from schema import connect, ensure_schema, upsert_dataframe
+
+
+def bars(ticker, n, seed, flat=()):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    high, low = close * 1.01, close * 0.99
+    for i in flat:
+        high[i] = low[i] = close[i]
+    return pd.DataFrame({
+        "ticker": ticker, "Date": pd.bdate_range("2020-01-01", periods=n).strftime("%Y-%m-%d %H:%M:%S"),
+        "Open": close, "High": high, "Low": low, "Close": close, "Volume": 1000.0,
+    })
+
+
+def store(db_path, prices):
+    conn = connect(db_path)
+    ensure_schema(conn)
+    upsert_dataframe(conn, "prices", prices)
+    conn.close()
+
+
+def features(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return pd.read_sql_query("SELECT * FROM features ORDER BY ticker, Date", conn)
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("flat", [(), (280,)])
+def test_incremental_refresh_equals_a_rebuild(tmp_path, flat):
+    prices = pd.concat([bars("AAA", 300, 0, flat), bars("BBB", 250, 1)], ignore_index=True)
+    db_path = str(tmp_path / "stock_data.db")
+    # Three refreshes, each seeing a few more bars; a bar with high == low forces a rebuild
+    for cut in (200, 203, 240, 300):
+        store(db_path, prices.groupby("ticker").head(cut))
+        written = refresh_features(db_path)
+    assert written == 300 - 240 + 250 - 240 + (240 if flat else 0)
+
+    expected = []
+    for ticker, group in prices.groupby("ticker"):
+        expected.append(compute_features(ticker, group["Date"].to_numpy(), group["High"].to_numpy(),
+                                         group["Low"].to_numpy(), group["Close"].to_numpy()))
+    pd.testing.assert_frame_equal(features(db_path), pd.concat(expected, ignore_index=True), check_dtype=False)
+    assert refresh_features(db_path) == 0
+
+
+@pytest.mark.parametrize("saved", [b"\x80\x05pickled by an older version", '{"version": 0}'])
+def test_state_from_another_version_is_rebuilt(tmp_path, saved):
+    prices = bars("AAA", 300, 0)
+    db_path = str(tmp_path / "stock_data.db")
+    store(db_path, prices.head(200))
+    refresh_features(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE feature_state SET state = ?", [saved])
+    conn.commit()
+    conn.close()
+
+    store(db_path, prices)
+    assert refresh_features(db_path) == 300
+    expected = compute_features("AAA", prices["Date"].to_numpy(), prices["High"].to_numpy(),
+                                prices["Low"].to_numpy(), prices["Close"].to_numpy())
+    pd.testing.assert_frame_equal(features(db_path), expected, check_dtype=False)
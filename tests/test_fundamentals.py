@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from fundamentals import REPORT_LAG_DAYS, attach, store_fundamentals
+from schema import connect, ensure_schema, upsert_dataframe
+from universe import Universe
+
+DATES = ["2024-05-14", "2024-05-15", "2024-08-13", "2024-08-14", "2024-09-02"]
+
+
+def write_db(db_path):
+    conn = connect(db_path)
+    ensure_schema(conn)
+    upsert_dataframe(conn, "prices", pd.DataFrame({
+        "ticker": np.repeat(["AAA", "BBB"], len(DATES)),
+        "Date": [f"{date} 00:00:00" for date in DATES] * 2,
+        "Open": 1.0, "High": 1.0, "Low": 1.0, "Close": 1.0, "Volume": 1.0,
+    }))
+    # Only AAA files; the quarters become known REPORT_LAG_DAYS after they end
+    store_fundamentals(conn, pd.DataFrame({
+        "ticker": "AAA", "period_end": ["2024-03-31 00:00:00", "2024-06-30 00:00:00"],
+        "statement": "income", "name": "Revenue", "value": [100.0, 120.0],
+    }))
+    conn.close()
+
+
+def test_attach_uses_only_values_known_after_the_report_lag(tmp_path):
+    assert REPORT_LAG_DAYS == 45
+    db_path = str(tmp_path / "stock_data.db")
+    write_db(db_path)
+    universe = attach(Universe.from_sqlite(db_path), db_path, ["Revenue"])
+    np.testing.assert_array_equal(universe.arrays("AAA")["Revenue"], [np.nan, 100.0, 100.0, 120.0, 120.0])
+    np.testing.assert_array_equal(universe.arrays("BBB")["Revenue"], [np.nan] * len(DATES))
+
+
+def test_attach_with_a_shorter_lag(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    write_db(db_path)
+    universe = attach(Universe.from_sqlite(db_path, tickers=["AAA"]), db_path, ["income:Revenue"], lag_days=0)
+    np.testing.assert_array_equal(universe.arrays("AAA")["income:Revenue"], [100.0, 100.0, 120.0, 120.0, 120.0])
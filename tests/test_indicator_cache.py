@@ -0,0 +1,26 @@
+import numpy as np
+
+from indicator_cache import IndicatorCache
+from supertrend import supertrend_grid
+
+PARAMS = [(12, 3), (11, 2), (10, 1), (10, 3), (7, 0.5)]
+
+
+def test_append_equals_a_full_grid(tmp_path):
+    rng = np.random.default_rng(0)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, 600)))
+    high, low = close * 1.01, close * 0.99
+    dates = np.arange(600, dtype=np.int64)
+    cache = IndicatorCache(str(tmp_path))
+    for n in (400, 450, 450, 600):
+        trend, direction = cache.supertrend_grid("AAA", dates[:n], high[:n], low[:n], close[:n], PARAMS)
+        expected_trend, expected_direction = supertrend_grid(high[:n], low[:n], close[:n], PARAMS)
+        np.testing.assert_array_equal(trend, expected_trend)
+        np.testing.assert_array_equal(direction, expected_direction)
+    assert cache.counts == {"hit": 1, "append": 2, "miss": 1}
+
+    # A bar with high == low rewrites the true range of every earlier bar
+    high[500] = low[500] = close[500]
+    trend, _ = cache.supertrend_grid("AAA", dates, high, low, close, PARAMS)
+    np.testing.assert_array_equal(trend, supertrend_grid(high, low, close, PARAMS)[0])
+    assert cache.counts["miss"] == 2
@@ -0,0 +1,45 @@
+import json
+
+import numpy as np
+import pytest
+
+from backtest_supertrend import calculate_atr
+from indicators import ATR, SMA, RollingATR, Supertrend
+
+
+def ohlc(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    high = close * (1 + rng.uniform(0, 0.02, n))
+    low = close * (1 - rng.uniform(0, 0.02, n))
+    # A few flat bars, which pandas_ta would nudge but calculate_atr doesn't
+    high[::17] = low[::17]
+    return high, low, close
+
+
+@pytest.mark.parametrize("length", [1, 10, 14])
+def test_rolling_atr_matches_calculate_atr(length):
+    high, low, close = ohlc(300)
+    expected = calculate_atr(high, low, close, length)
+    np.testing.assert_array_equal(RollingATR(length).batch(high, low, close), expected)
+
+    # The same values one batch and one bar at a time
+    atr = RollingATR(length)
+    streamed = list(atr.batch(high[:120], low[:120], close[:120]))
+    streamed += [atr.update(h, l, c) for h, l, c in zip(high[120:], low[120:], close[120:])]
+    np.testing.assert_array_equal(np.array(streamed), expected)
+
+
+@pytest.mark.parametrize("factory", [lambda: SMA(10), lambda: ATR(14), lambda: RollingATR(14), lambda: Supertrend(10, 1.0)])
+def test_state_round_trips_through_json(factory):
+    high, low, close = ohlc(200)
+    full = factory()
+    expected = full.batch(close) if isinstance(full, SMA) else full.batch(high, low, close)
+
+    first = factory()
+    inputs = [close] if isinstance(first, SMA) else [high, low, close]
+    first.batch(*(values[:120] for values in inputs))
+    resumed = type(first).from_state(json.loads(json.dumps(first.to_state())))
+    rest = resumed.batch(*(values[120:] for values in inputs))
+    for got, want in zip(rest if isinstance(rest, tuple) else [rest], expected if isinstance(expected, tuple) else [expected]):
+        np.testing.assert_array_equal(got, want[120:])
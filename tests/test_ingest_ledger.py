@@ -0,0 +1,100 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from fundamentals import store_fundamentals
+from ingest_ledger import TIME_FORMAT, merge, parse_shard, plan, record_status, shard, shard_path, status_rows
+from schema import connect, ensure_schema, upsert_dataframe
+
+
+def hours_ago(hours):
+    return (datetime.now() - timedelta(hours=hours)).strftime(TIME_FORMAT)
+
+
+LEDGER = {
+    "FRESH": {"prices": ("ok", hours_ago(1)), "dividends": ("ok", hours_ago(1))},
+    "OLD": {"prices": ("ok", hours_ago(48)), "dividends": ("ok", hours_ago(30))},
+    "FAILED": {"prices": ("failed", hours_ago(20)), "dividends": ("ok", hours_ago(2))},
+}
+
+
+def test_plan_orders_stalest_first_and_skips_fresh_datasets():
+    tickers = ["FRESH", "OLD", "FAILED", "NEW"]
+    assert plan(LEDGER, tickers, ["prices", "dividends"], max_age_hours=12) == [
+        ("NEW", ["prices", "dividends"]), ("OLD", ["prices", "dividends"]), ("FAILED", ["prices"]),
+    ]
+    # A failure is retried even when its last success is recent
+    assert plan(LEDGER, tickers, ["prices", "dividends"], max_age_hours=24) == [
+        ("NEW", ["prices", "dividends"]), ("OLD", ["prices", "dividends"]), ("FAILED", ["prices"]),
+    ]
+    assert plan(LEDGER, tickers, ["prices", "dividends"], max_age_hours=36) == [
+        ("NEW", ["prices", "dividends"]), ("OLD", ["prices"]), ("FAILED", ["prices"]),
+    ]
+    # 0 fetches everything, still stalest first; ties keep the ticker order
+    assert [ticker for ticker, _ in plan(LEDGER, tickers, ["prices"], max_age_hours=0)] == ["NEW", "OLD", "FAILED", "FRESH"]
+
+
+def test_plan_failed_only():
+    assert plan(LEDGER, ["FRESH", "OLD", "FAILED", "NEW"], ["prices", "dividends"], failed_only=True) == [("FAILED", ["prices"])]
+
+
+def test_shard_splits_tickers_disjointly_and_stably():
+    tickers = [f"T{i:03d}" for i in range(200)]
+    shards = [shard(tickers, index, 4) for index in range(4)]
+    assert sorted(sum(shards, [])) == tickers
+    assert all(shards) and shards == [shard(tickers, index, 4) for index in range(4)]
+    assert parse_shard("2/4") == (1, 4)
+    assert shard_path("data/stock_data.db", 1, 4) == "data/stock_data.shard-2-of-4.db"
+
+
+def write_shard(db_path, tickers, fields, close, attempted):
+    conn = connect(db_path)
+    ensure_schema(conn)
+    upsert_dataframe(conn, "prices", pd.DataFrame({
+        "ticker": tickers, "Date": "2024-01-02 00:00:00", "Close": close,
+    }))
+    # Fields are interned per database, so an extra field shifts the ids of the others
+    store_fundamentals(conn, pd.DataFrame([
+        {"ticker": ticker, "period_end": "2023-12-31 00:00:00", "statement": statement, "name": name, "value": value}
+        for ticker in tickers for statement, name, value in fields
+    ]))
+    record_status(conn, status_rows(tickers[0], {"prices": (1, None)}, when=attempted), commit=True)
+    for ticker in tickers[1:]:
+        record_status(conn, status_rows(ticker, {"prices": (1, None)}, when=hours_ago(100)), commit=True)
+    conn.close()
+
+
+def query(db_path, sql):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_merge_remaps_field_ids_and_copies_only_new_attempts(tmp_path):
+    first, second, main = (str(tmp_path / name) for name in ("first.db", "second.db", "stock_data.db"))
+    write_shard(first, ["AAA", "BBB"], [("income", "Revenue", 1.0), ("balance", "Cash", 2.0)], 10.0, hours_ago(50))
+    write_shard(second, ["CCC"], [("balance", "Assets", 5.0), ("balance", "Cash", 3.0), ("income", "Revenue", 4.0)],
+                20.0, hours_ago(50))
+    assert query(first, "SELECT field_id FROM fundamental_fields WHERE name = 'Cash'") != \
+        query(second, "SELECT field_id FROM fundamental_fields WHERE name = 'Cash'")
+
+    assert merge(main, [first, second]) == {first: 2, second: 1}
+    assert query(main, "SELECT ticker, Close FROM prices ORDER BY ticker") == [("AAA", 10.0), ("BBB", 10.0), ("CCC", 20.0)]
+    assert query(main, "SELECT f.ticker, n.name, f.value FROM fundamentals f JOIN fundamental_fields n USING (field_id) "
+                       "ORDER BY f.ticker, n.name") == [
+        ("AAA", "Cash", 2.0), ("AAA", "Revenue", 1.0), ("BBB", "Cash", 2.0), ("BBB", "Revenue", 1.0),
+        ("CCC", "Assets", 5.0), ("CCC", "Cash", 3.0), ("CCC", "Revenue", 4.0),
+    ]
+
+    # AAA is fetched again in its shard; BBB's rows change without a new attempt and are left alone
+    conn = connect(first)
+    conn.execute("UPDATE prices SET Close = 11.0")
+    record_status(conn, status_rows("AAA", {"prices": (1, None)}, when=hours_ago(1)), commit=True)
+    conn.close()
+    assert merge(main, [first, second]) == {first: 1, second: 0}
+    assert query(main, "SELECT ticker, Close FROM prices ORDER BY ticker") == [("AAA", 11.0), ("BBB", 10.0), ("CCC", 20.0)]
+    assert merge(main, [first], full=True) == {first: 2}
+    assert query(main, "SELECT Close FROM prices WHERE ticker = 'BBB'") == [(11.0,)]
@@ -0,0 +1,24 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrument import Metrics
+
+
+def test_profile_blocks_can_overlap_across_threads():
+    # Python 3.12+ refuses a second active cProfile profiler; overlapping blocks must not raise
+    metrics = Metrics(profile_top=10)
+    barrier = threading.Barrier(4)
+
+    def work(key):
+        with metrics.profile(key):
+            barrier.wait(timeout=10)
+            sum(range(10_000))
+        return key
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert sorted(executor.map(work, "abcd")) == list("abcd")
+    assert len(metrics.profiles) == 1
+
+    with metrics.profile("after"):
+        pass
+    assert len(metrics.profiles) == 2
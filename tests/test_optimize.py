@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import pytest
+
+from optimize import fold_stats, rank_configs, walk_forward_selection
+
+DAY = 86_400 * 10 ** 9
+
+
+def signals(n, entries, exits):
+    entry, exit = np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)
+    entry[entries] = True
+    exit[exits] = True
+    return entry, exit
+
+
+def test_trades_are_closed_at_their_window_end():
+    # One ticker, 10 daily bars; train is days 0-4, test days 5-9
+    dates = np.arange(10, dtype=np.int64) * DAY
+    close = np.arange(100.0, 110.0)
+    starts, ends = np.array([0]), np.array([10])
+    folds = [(0, 5 * DAY, 10 * DAY)]
+    # Entered on day 3, exits on day 7 in the test window; entered again on day 8, never exits
+    entry, exit = signals(10, [3, 8], [7])
+    stats = fold_stats(starts, ends, dates, close, entry, exit, folds)
+
+    train, test = stats[0]
+    assert train[0] == 1
+    # Scored at day 4's close, the last train bar, not day 7's
+    assert train[1] == pytest.approx(104 / 103 - 1)
+    assert test[0] == 1
+    assert test[1] == pytest.approx(109 / 108 - 1)
+
+
+def test_window_end_is_per_ticker():
+    # Ticker B stops trading on day 2, inside the train window
+    dates = np.concatenate([np.arange(10), np.arange(3)]).astype(np.int64) * DAY
+    close = np.concatenate([np.full(10, 50.0), [10.0, 11.0, 12.0]])
+    starts, ends = np.array([0, 10]), np.array([10, 13])
+    entry, exit = signals(13, [10], [])
+    stats = fold_stats(starts, ends, dates, close, entry, exit, [(0, 5 * DAY, 10 * DAY)])
+    assert stats[0, 0, :2].tolist() == pytest.approx([1, 12 / 10 - 1])
+    assert stats[0, 1, 0] == 0
+
+
+def test_rank_and_select():
+    configs = [[(10, 1.0)], [(11, 2.0)]]
+    stats = np.zeros((2, 2, 2, 5))
+    # (trades, sum, sum_sq, sum_log, wins) per config, fold and split
+    stats[0, :, 0] = [2, 0.2, 0.02, np.log(1.1) * 2, 2]
+    stats[0, :, 1] = [2, -0.1, 0.005, np.log(0.95) * 2, 0]
+    stats[1, :, 0] = [2, 0.1, 0.005, np.log(1.05) * 2, 2]
+    stats[1, :, 1] = [2, 0.04, 0.0008, np.log(1.02) * 2, 2]
+
+    ranking = rank_configs(stats, configs)
+    assert ranking["config"].tolist() == [json.dumps(configs[1]), json.dumps(configs[0])]
+    assert ranking["test_trades"].tolist() == [4, 4]
+    assert ranking["test_mean_return"].tolist() == pytest.approx([0.02, -0.05])
+    assert ranking["test_folds_positive"].tolist() == [2, 0]
+
+    # Training prefers config 0 in every fold, which then loses out of sample
+    selection = walk_forward_selection(stats, configs)
+    assert selection["config"].tolist() == [json.dumps(configs[0])] * 2
+    assert selection["test_mean_return"].tolist() == pytest.approx([-0.05, -0.05])
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulate_shitty_strategy
+from panel import SMA_WINDOWS, Panel, sma_stack
+from result_store import ResultWriter
+from simulate import add_returns, order_by_tickers, simulate_trades
+
+TICKERS = ["AAA", "BBB", "CCC"]
+
+
+def prices(lengths=(400, 250, 130), seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for ticker, n in zip(TICKERS, lengths):
+        # Closes far from 1 with many digits, where a running-sum mean drifts from pandas
+        close = 1e4 * np.exp(np.cumsum(rng.normal(0.002, 0.01, n)))
+        dates = pd.bdate_range("2023-01-02", periods=n + 20)
+        # Tickers miss different days, so bar time differs from calendar time
+        keep = np.sort(rng.choice(len(dates), n, replace=False))
+        frames.append(pd.DataFrame({"ticker": ticker, "Date": dates[keep], "Close": close}))
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.mark.parametrize("window,min_periods", [(5, None), (60, None), (20, 3)])
+def test_rolling_mean_matches_pandas_exactly(window, min_periods):
+    df = prices()
+    df.loc[[7, 300, 301], "Close"] = np.nan
+    panel = Panel.from_frame(df, ["Close"])
+    got = panel.gather(panel.rolling(panel["Close"], window, min_periods=min_periods))
+    expected = df.groupby("ticker")["Close"].rolling(window, min_periods=min_periods).mean().to_numpy()
+    np.testing.assert_array_equal(got, expected)
+
+
+def test_sma_stack_matches_simulate_shitty_strategy(tmp_path):
+    df = prices()
+    root, db_path = str(tmp_path / "dataset"), str(tmp_path / "stock_data.db")
+    writer = ResultWriter(root)
+    for _, frame in df.groupby("ticker"):
+        frame = frame.reset_index(drop=True)
+        for length, multiplier in [(12, 3), (11, 2), (10, 1)]:
+            frame[f"SUPERT_{length}_{multiplier}.0"] = frame["Close"]
+        writer.append(frame)
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE prices (ticker TEXT, Date TEXT)")
+    conn.executemany("INSERT INTO prices VALUES (?, '2023-01-02 00:00:00')", [(ticker,) for ticker in TICKERS])
+    conn.commit()
+    conn.close()
+    expected = simulate_shitty_strategy.run(root, db_path, str(tmp_path / "roi.csv"))
+    assert expected["ticker"].nunique() > 1 and len(expected) > 10
+
+    panel = Panel.from_frame(df, ["Close"])
+    data = panel.to_partition({"Close": panel["Close"], "entry": sma_stack(panel, windows=SMA_WINDOWS)})
+    got = add_returns(order_by_tickers(simulate_trades(data, "entry", hold_days=10, price="Close"), TICKERS))
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
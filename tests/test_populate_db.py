@@ -0,0 +1,114 @@
+import sqlite3
+
+import pytest
+
+import populate_db
+from stub_ticker import StubTicker
+
+TICKERS = ["AAA", "BBB"]
+
+
+def run_ingest(db_path, factory, **kwargs):
+    populate_db.ingest(TICKERS, str(db_path), workers=2, rate=0, retries=0, backoff=0,
+                       batch_tickers=1, ticker_factory=factory, **kwargs)
+
+
+def query(db_path, sql, params=()):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def statuses(db_path):
+    return {(ticker, dataset): (status, attempts) for ticker, dataset, status, attempts in
+            query(db_path, "SELECT ticker, dataset, status, attempts FROM ingest_status")}
+
+
+def test_full_then_incremental_then_retry(tmp_path):
+    db_path = tmp_path / "stock_data.db"
+
+    run_ingest(db_path, lambda ticker: StubTicker(ticker, bars=8))
+    assert query(db_path, "SELECT ticker, COUNT(*) FROM prices GROUP BY ticker ORDER BY ticker") == [("AAA", 8), ("BBB", 8)]
+    assert query(db_path, "SELECT COUNT(*) FROM dividends") == [(2,)]
+    assert query(db_path, "SELECT COUNT(*) FROM fundamentals") == [(2 * 7,)]
+    ledger = statuses(db_path)
+    assert ledger[("AAA", "prices")] == ("ok", 0)
+    assert ledger[("AAA", "earnings")] == ("unsupported", 0)
+
+    # Two more recorded bars: only they are appended, nothing is duplicated
+    run_ingest(db_path, lambda ticker: StubTicker(ticker, bars=10), max_age_hours=0)
+    assert query(db_path, "SELECT ticker, COUNT(*) FROM prices GROUP BY ticker ORDER BY ticker") == [("AAA", 10), ("BBB", 10)]
+    assert query(db_path, "SELECT last_date FROM sync_state WHERE ticker = 'AAA' AND table_name = 'prices'") == \
+        [("2024-01-15 00:00:00",)]
+
+    # A failing dataset is recorded, and a failed_only run fetches just that one
+    run_ingest(db_path, lambda ticker: StubTicker(ticker, bars=10, fail={"quarterly_cash_flow"} if ticker == "AAA" else ()),
+               max_age_hours=0)
+    ledger = statuses(db_path)
+    assert ledger[("AAA", "cash_flows")] == ("failed", 1)
+    assert ledger[("BBB", "cash_flows")] == ("ok", 0)
+    assert query(db_path, "SELECT error_class FROM ingest_status WHERE ticker = 'AAA' AND dataset = 'cash_flows'") == \
+        [("ConnectionError",)]
+
+    stubs = {}
+    run_ingest(db_path, lambda ticker: stubs.setdefault(ticker, StubTicker(ticker, bars=10)), failed_only=True)
+    assert list(stubs) == ["AAA"]
+    assert stubs["AAA"].calls == ["quarterly_cash_flow"]
+    assert statuses(db_path)[("AAA", "cash_flows")] == ("ok", 0)
+    assert query(db_path, "SELECT COUNT(*) FROM prices") == [(20,)]
+
+
+def test_failed_store_keeps_old_rows(tmp_path, monkeypatch):
+    db_path = tmp_path / "stock_data.db"
+    run_ingest(db_path, lambda ticker: StubTicker(ticker, bars=8))
+
+    def failing_store(dataframe, table_name, conn, commit=True):
+        if table_name == "prices":
+            return "IntegrityError", "recorded failure"
+        return store_dataframe(dataframe, table_name, conn, commit)
+
+    store_dataframe = populate_db.store_dataframe
+    monkeypatch.setattr(populate_db, "store_dataframe", failing_store)
+    # A full run deletes each ticker's prices before the upsert; the failed upsert must undo that
+    run_ingest(db_path, lambda ticker: StubTicker(ticker, bars=10), incremental=False)
+    assert query(db_path, "SELECT COUNT(*) FROM prices") == [(16,)]
+    assert statuses(db_path)[("AAA", "prices")] == ("failed", 1)
+
+
+def test_writer_error_fails_the_run(tmp_path, monkeypatch):
+    db_path = tmp_path / "stock_data.db"
+
+    def broken_record_status(conn, rows, commit=False):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(populate_db, "record_status", broken_record_status)
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        populate_db.ingest(["AAA", "BBB"] * 20, str(db_path), workers=2, rate=0, retries=0, batch_tickers=1,
+                           ticker_factory=lambda ticker: StubTicker(ticker))
+
+
+def test_price_mode_is_recorded_and_a_switch_reloads_in_full(tmp_path):
+    db_path = tmp_path / "stock_data.db"
+    starts = []
+
+    class RecordingTicker(StubTicker):
+        def history(self, period=None, start=None, auto_adjust=True):
+            starts.append((start, auto_adjust))
+            return super().history(period, start, auto_adjust)
+
+    run_ingest(db_path, lambda ticker: RecordingTicker(ticker, bars=8), raw=True)
+    assert query(db_path, "SELECT DISTINCT mode FROM sync_state WHERE table_name = 'prices'") == [("raw",)]
+
+    # Incremental runs in the same mode only fetch from the last bar on
+    starts.clear()
+    run_ingest(db_path, lambda ticker: RecordingTicker(ticker, bars=9), raw=True, max_age_hours=0)
+    assert all(start is not None for start, _ in starts)
+
+    # Adjusted bars must not be appended to raw ones: the whole history is fetched again
+    starts.clear()
+    run_ingest(db_path, lambda ticker: RecordingTicker(ticker, bars=10), max_age_hours=0)
+    assert starts == [(None, True)] * len(TICKERS)
+    assert query(db_path, "SELECT DISTINCT mode FROM sync_state WHERE table_name = 'prices'") == [("adjusted",)]
+    assert query(db_path, "SELECT COUNT(*) FROM prices") == [(20,)]
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from portfolio import simulate_portfolio
+
+
+def frame(rows):
+    df = pd.DataFrame(rows, columns=["ticker", "Date", "Close_x", "entry", "exit"])
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df
+
+
+def test_unclosed_entry_is_held_and_marked():
+    df = frame([
+        ("A", "2020-01-02", 10.0, True, False),
+        ("A", "2020-01-03", 11.0, False, True),
+        ("A", "2020-01-06", 12.0, False, False),
+        ("A", "2020-01-07", 12.0, False, False),
+        ("B", "2020-01-02", 20.0, False, False),
+        ("B", "2020-01-03", 20.0, False, False),
+        ("B", "2020-01-06", 20.0, True, False),
+        ("B", "2020-01-07", 25.0, False, False),
+    ])
+    curve, trades, stats = simulate_portfolio(df, "entry", "exit", capital=1000.0, max_positions=1)
+    assert stats["trades"] == 2
+    assert stats["open"] == 1
+    bought = trades[trades["ticker"] == "B"].iloc[0]
+    assert bought["open"] and bought["buy_date"] == pd.Timestamp("2020-01-06")
+    assert bought["sell_price"] == 25.0
+    # A's round trip turns 1000 into 1100, all of which goes into B at 20 and is marked at 25
+    np.testing.assert_allclose(curve["equity"].to_numpy(), [1000.0, 1100.0, 1100.0, 1375.0])
+    assert curve["positions"].tolist() == [1, 0, 1, 1]
+
+
+def test_open_position_keeps_its_slot():
+    df = frame([
+        ("A", "2020-01-02", 10.0, True, False),
+        ("A", "2020-01-03", 10.0, False, False),
+        ("B", "2020-01-02", 10.0, False, False),
+        ("B", "2020-01-03", 10.0, True, True),
+    ])
+    _, trades, stats = simulate_portfolio(df, "entry", "exit", capital=1000.0, max_positions=1)
+    # A never exits, so B's same-day round trip finds no free slot
+    assert trades["ticker"].tolist() == ["A"]
+    assert stats["skipped"] == 1
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from price_store import export_prices, list_tickers, load_ticker
+from schema import connect, ensure_schema, upsert_dataframe
+from universe import Universe
+
+# "BRK/B" and "BRK_B" used to share a directory; "%" must survive the encoding too
+TICKERS = ["AAA", "BRK/B", "BRK_B", "X%2FY", "^GSPC"]
+
+
+def write_prices(db_path):
+    rng = np.random.default_rng(0)
+    frames = []
+    for i, ticker in enumerate(TICKERS):
+        n = 5 + 3 * i
+        frames.append(pd.DataFrame({
+            "ticker": ticker, "Date": pd.bdate_range("2024-01-01", periods=n).strftime("%Y-%m-%d %H:%M:%S"),
+            "Open": rng.normal(50, 1, n), "High": rng.normal(51, 1, n), "Low": rng.normal(49, 1, n),
+            "Close": rng.normal(50, 1, n), "Volume": rng.integers(100, 1000, n).astype(float),
+        }))
+    prices = pd.concat(frames, ignore_index=True)
+    conn = connect(db_path)
+    ensure_schema(conn)
+    upsert_dataframe(conn, "prices", prices)
+    conn.close()
+    return prices
+
+
+def test_export_round_trips_every_ticker(tmp_path):
+    db_path, root = str(tmp_path / "stock_data.db"), str(tmp_path / "price_store")
+    prices = write_prices(db_path)
+    # A chunk smaller than a ticker, so tickers continue across chunks
+    row_counts = export_prices(db_path, root, chunksize=4)
+    assert row_counts == prices.groupby("ticker").size().to_dict()
+    assert list_tickers(root) == sorted(TICKERS)
+    assert len(os.listdir(root)) == len(TICKERS) + 1
+
+    for ticker, expected in prices.groupby("ticker"):
+        loaded = load_ticker(ticker, root)
+        assert (loaded["Date"].to_numpy() == pd.to_datetime(expected["Date"]).to_numpy()).all()
+        for column in ["Open", "High", "Low", "Close", "Volume"]:
+            np.testing.assert_array_equal(loaded[column], expected[column])
+
+    from_store, from_sqlite = Universe.from_price_store(root), Universe.from_sqlite(db_path)
+    np.testing.assert_array_equal(from_store.tickers, from_sqlite.tickers)
+    np.testing.assert_array_equal(from_store.days, from_sqlite.days)
+    for column, values in from_sqlite.columns.items():
+        np.testing.assert_array_equal(from_store.columns[column], values)
+
+
+def test_export_float32(tmp_path):
+    db_path, root = str(tmp_path / "stock_data.db"), str(tmp_path / "price_store")
+    prices = write_prices(db_path)
+    export_prices(db_path, root, dtype=np.float32)
+    loaded = load_ticker("BRK/B", root)
+    assert loaded["Close"].dtype == np.float32
+    np.testing.assert_allclose(loaded["Close"], prices.loc[prices["ticker"] == "BRK/B", "Close"], rtol=1e-6)
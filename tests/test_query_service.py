@@ -0,0 +1,40 @@
+import sqlite3
+
+import pytest
+
+from query_service import QueryService
+
+
+def test_failed_opens_do_not_exhaust_the_pool(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    service = QueryService(db_path, pool_size=2)
+    # mode=ro cannot open a missing file; every failure must give its slot back
+    for _ in range(3):
+        with pytest.raises(sqlite3.OperationalError):
+            service.query("SELECT 1")
+    assert service.opened == 0
+
+    sqlite3.connect(db_path).close()
+    assert service.query("SELECT 1 AS one")["one"].tolist() == [1]
+
+
+def test_stats_count_hits_misses_and_truncation(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE prices (ticker TEXT)")
+    conn.executemany("INSERT INTO prices VALUES (?)", [(f"T{i}",) for i in range(5)])
+    conn.commit()
+    conn.close()
+
+    service = QueryService(db_path, max_rows=3)
+    assert len(service.query("SELECT * FROM prices")) == 3
+    # The same query up to whitespace and a trailing semicolon is served from the cache
+    assert len(service.query("SELECT *   FROM prices;")) == 3
+    with pytest.raises(sqlite3.OperationalError):
+        service.query("SELECT * FROM missing")
+    stats = service.stats()
+    service.close()
+    assert {key: stats[key] for key in ["queries", "hits", "misses", "errors", "truncated", "cached_entries"]} == {
+        "queries": 3, "hits": 1, "misses": 1, "errors": 1, "truncated": 1, "cached_entries": 1,
+    }
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
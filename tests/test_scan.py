@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scan import scan
+from schema import connect, ensure_schema, upsert_dataframe
+
+
+def store(db_path, n):
+    rng = np.random.default_rng(0)
+    frames = []
+    for ticker in ["AAA", "BBB"]:
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, 300)))[:n]
+        frames.append(pd.DataFrame({
+            "ticker": ticker, "Date": pd.bdate_range("2020-01-01", periods=n).strftime("%Y-%m-%d %H:%M:%S"),
+            "Open": close, "High": close * 1.01, "Low": close * 0.99, "Close": close, "Volume": 1000.0,
+        }))
+    conn = connect(db_path)
+    ensure_schema(conn)
+    upsert_dataframe(conn, "prices", pd.concat(frames, ignore_index=True))
+    conn.close()
+
+
+@pytest.mark.parametrize("stale", [False, True])
+def test_saved_state_resumes_like_a_rebuild(tmp_path, stale):
+    db_path, state_path = str(tmp_path / "stock_data.db"), str(tmp_path / "scan_state.json")
+    store(db_path, 250)
+    scan(db_path, state_path)
+    with open(state_path) as file:
+        assert json.load(file)["version"] == 1
+    if stale:
+        with open(state_path, "w") as file:
+            json.dump({"version": 0, "tickers": {}}, file)
+
+    store(db_path, 300)
+    signals, counts = scan(db_path, state_path)
+    assert counts == ({"unchanged": 0, "updated": 0, "built": 2, "rebuilt": 0} if stale else
+                      {"unchanged": 0, "updated": 2, "built": 0, "rebuilt": 0})
+    rebuilt, _ = scan(db_path, str(tmp_path / "fresh.json"))
+    pd.testing.assert_frame_equal(signals, rebuilt)
+    with open(state_path) as resumed, open(str(tmp_path / "fresh.json")) as fresh:
+        assert json.load(resumed) == json.load(fresh)
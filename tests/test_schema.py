@@ -0,0 +1,77 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import schema
+from schema import migrate
+
+
+def write_legacy_prices(db_path):
+    # What DataFrame.to_sql left behind: no key, and a duplicated bar
+    conn = sqlite3.connect(db_path)
+    pd.DataFrame({
+        "ticker": ["AAA", "AAA", "AAA", "BBB"],
+        "Date": ["2023-01-02 00:00:00", "2023-01-03 00:00:00", "2023-01-03 00:00:00", "2023-01-02 00:00:00"],
+        "Close": [10.0, 11.0, 12.0, 20.0],
+    }).to_sql("prices", conn, index=False)
+    conn.close()
+
+
+def prices(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT ticker, Date, Close FROM prices ORDER BY ticker, Date").fetchall()
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    return rows, tables
+
+
+def test_migrate_keys_the_table_and_keeps_the_last_duplicate(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    write_legacy_prices(db_path)
+    migrate(db_path)
+    rows, tables = prices(db_path)
+    assert rows == [("AAA", "2023-01-02 00:00:00", 10.0), ("AAA", "2023-01-03 00:00:00", 12.0), ("BBB", "2023-01-02 00:00:00", 20.0)]
+    assert "prices_legacy" not in tables
+    conn = sqlite3.connect(db_path)
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO prices (ticker, Date, Close) VALUES ('BBB', '2023-01-02 00:00:00', 1.0)")
+    conn.close()
+
+
+@pytest.mark.parametrize("written_since", [False, True])
+def test_migrate_resumes_from_a_legacy_table(tmp_path, written_since):
+    # An interrupted run left the rows in prices_legacy and an empty keyed prices
+    db_path = str(tmp_path / "stock_data.db")
+    write_legacy_prices(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("ALTER TABLE prices RENAME TO prices_legacy")
+    conn.execute("CREATE TABLE prices (ticker TEXT NOT NULL, Date TEXT NOT NULL, Close REAL, PRIMARY KEY (ticker, Date)) WITHOUT ROWID")
+    if written_since:
+        conn.execute("INSERT INTO prices VALUES ('BBB', '2023-01-02 00:00:00', 21.0), ('BBB', '2023-01-03 00:00:00', 22.0)")
+    conn.commit()
+    conn.close()
+
+    migrate(db_path)
+    rows, tables = prices(db_path)
+    expected = [("AAA", "2023-01-02 00:00:00", 10.0), ("AAA", "2023-01-03 00:00:00", 12.0)]
+    if written_since:
+        expected += [("BBB", "2023-01-02 00:00:00", 21.0), ("BBB", "2023-01-03 00:00:00", 22.0)]
+    else:
+        expected += [("BBB", "2023-01-02 00:00:00", 20.0)]
+    assert rows == expected
+    assert not {"prices_legacy", "prices_newer"} & tables
+
+
+def test_interrupted_migration_leaves_the_table_untouched(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "stock_data.db")
+    write_legacy_prices(db_path)
+
+    def failing_create(*args):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(schema, "create_table_sql", failing_create)
+    with pytest.raises(KeyboardInterrupt):
+        migrate(db_path)
+    rows, tables = prices(db_path)
+    assert len(rows) == 4
+    assert "prices_legacy" not in tables
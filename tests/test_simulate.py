@@ -0,0 +1,55 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulate_supertrend
+from result_store import ResultWriter, read_prepped
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+TICKERS = ["AAA", "BBB", "CCC"]
+
+
+def write_results(root, db_path, n=120):
+    # Supertrend lines hovering around the close, so the signals flip often
+    rng = np.random.default_rng(0)
+    frames = []
+    for ticker in TICKERS:
+        close = np.round(50 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 4)
+        frame = pd.DataFrame({"ticker": ticker, "Date": pd.bdate_range("2023-01-02", periods=n), "Close": close})
+        for length, multiplier in [(12, 3), (11, 2), (10, 1)]:
+            frame[f"SUPERT_{length}_{multiplier}.0"] = np.round(close * (1 + rng.normal(0, 0.02, n)), 4)
+        frames.append(frame)
+    writer = ResultWriter(str(root))
+    for frame in frames:
+        writer.append(frame)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE prices (ticker TEXT, Date TEXT)")
+    conn.executemany("INSERT INTO prices VALUES (?, ?)", [(ticker, "2023-01-02 00:00:00") for ticker in TICKERS])
+    conn.commit()
+    conn.close()
+
+
+def test_roi_matches_the_per_row_script(tmp_path):
+    # fixtures/roi.csv was written by the original per-row loop over prepped_data.csv
+    write_results(tmp_path / "dataset", str(tmp_path / "stock_data.db"))
+    out = str(tmp_path / "roi.csv")
+    simulate_supertrend.run(str(tmp_path / "dataset"), str(tmp_path / "stock_data.db"), out)
+    with open(out) as written, open(os.path.join(FIXTURES, "roi.csv")) as baseline:
+        assert written.read() == baseline.read()
+
+
+def test_result_writer_refuses_a_directory_that_is_not_a_store(tmp_path):
+    (tmp_path / "notes.txt").write_text("keep me")
+    with pytest.raises(ValueError):
+        ResultWriter(str(tmp_path))
+    assert (tmp_path / "notes.txt").exists()
+
+
+def test_read_prepped_yields_one_frame_per_partition(tmp_path):
+    write_results(tmp_path / "dataset", str(tmp_path / "stock_data.db"))
+    frames = list(read_prepped(str(tmp_path / "dataset")))
+    assert [frame["ticker"].unique().tolist() for frame in frames] == [[ticker] for ticker in TICKERS]
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import reference_supertrend
+from supertrend import supertrend, supertrend_grid_frame
+
+PARAMS = [(7, 3.0), (10, 1.0), (11, 2.0), (12, 3.0), (20, 0.5), (3, 4.5)]
+
+
+def ohlc(n=1500, seed=0, flat_bars=()):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    spread = np.abs(rng.normal(0, 0.01, n)) * close
+    high = close + spread * rng.random(n)
+    low = close - spread * rng.random(n)
+    for i in flat_bars:
+        # A bar with no range makes pandas_ta nudge every bar's high - low
+        high[i] = low[i] = close[i]
+    return pd.Series(high), pd.Series(low), pd.Series(close)
+
+
+@pytest.mark.parametrize("flat_bars", [(), (0,), (5, 400, 1499)])
+@pytest.mark.parametrize("length, multiplier", PARAMS)
+def test_supertrend_matches_pandas_ta(length, multiplier, flat_bars):
+    ta = pytest.importorskip("pandas_ta", reason="install the test extra: pip install .[test]")
+    high, low, close = ohlc(flat_bars=flat_bars)
+    expected = ta.supertrend(high, low, close, length, multiplier)
+    pd.testing.assert_frame_equal(supertrend(high, low, close, length, multiplier), expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("flat_bars", [(), (5, 400)])
+def test_supertrend_grid_frame_matches_pandas_ta(flat_bars):
+    ta = pytest.importorskip("pandas_ta", reason="install the test extra: pip install .[test]")
+    high, low, close = ohlc(seed=1, flat_bars=flat_bars)
+    expected = pd.concat([ta.supertrend(high, low, close, length, multiplier) for length, multiplier in PARAMS], axis=1)
+    pd.testing.assert_frame_equal(supertrend_grid_frame(high, low, close, PARAMS), expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("flat_bars", [(), (0,), (5, 400)])
+@pytest.mark.parametrize("length, multiplier", PARAMS)
+def test_supertrend_matches_reference_loop(length, multiplier, flat_bars):
+    # pandas_ta's row loop transcribed in benchmark.py (pandas_ta itself when installed), so this always runs
+    high, low, close = ohlc(n=600, seed=2, flat_bars=flat_bars)
+    expected = reference_supertrend(high, low, close, length, multiplier)
+    pd.testing.assert_frame_equal(supertrend(high, low, close, length, multiplier), expected, check_dtype=False)
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from schema import connect, ensure_schema, upsert_dataframe
+from universe import COLUMNS, Universe
+
+
+def write_prices(db_path):
+    rng = np.random.default_rng(0)
+    frames = []
+    for ticker, n in [("AAA", 30), ("BBB", 1), ("CCC", 45)]:
+        frame = pd.DataFrame({column: rng.normal(50, 1, n) for column in COLUMNS})
+        frame.insert(0, "Date", pd.bdate_range("2024-01-01", periods=n).strftime("%Y-%m-%d %H:%M:%S"))
+        frame.insert(0, "ticker", ticker)
+        frames.append(frame)
+    prices = pd.concat(frames, ignore_index=True)
+    prices.loc[3, "Volume"] = np.nan
+    conn = connect(db_path)
+    ensure_schema(conn)
+    # Shuffled, so the reader has to order the rows itself
+    upsert_dataframe(conn, "prices", prices.sample(frac=1, random_state=0))
+    conn.close()
+    return prices
+
+
+def assert_same(universe, expected):
+    np.testing.assert_array_equal(universe.tickers, expected.tickers)
+    np.testing.assert_array_equal(universe.offsets, expected.offsets)
+    np.testing.assert_array_equal(universe.days, expected.days)
+    assert list(universe.columns) == list(expected.columns)
+    for column, values in expected.columns.items():
+        np.testing.assert_array_equal(universe.columns[column], values)
+
+
+def test_from_sqlite_reads_every_ticker_in_order(tmp_path):
+    db_path = str(tmp_path / "stock_data.db")
+    prices = write_prices(db_path)
+    # A chunk smaller than a ticker, so tickers continue across chunks
+    universe = Universe.from_sqlite(db_path, chunksize=7)
+    frame = universe.frame()
+    pd.testing.assert_frame_equal(
+        frame.drop(columns="Date"), prices.drop(columns="Date").reset_index(drop=True), check_dtype=False,
+    )
+    assert (frame["Date"] == pd.to_datetime(prices["Date"])).all()
+    assert_same(Universe.from_sqlite(db_path, tickers=["CCC", "BBB", "ZZZ"]), universe.select(["BBB", "CCC"]))
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_and_load_round_trip(tmp_path, mmap):
+    db_path = str(tmp_path / "stock_data.db")
+    write_prices(db_path)
+    universe = Universe.from_sqlite(db_path)
+    root = str(tmp_path / "universe")
+    universe.save(root)
+    assert_same(Universe.load(root, mmap=mmap), universe)
+    loaded = Universe.load(root, columns=["Close"])
+    assert list(loaded.columns) == ["Close"]
+    np.testing.assert_array_equal(loaded.arrays("CCC")["Close"], universe.arrays("CCC")["Close"])
+
+    # Saving again replaces the previous copy
+    universe.select(["AAA"]).save(root)
+    assert Universe.load(root).tickers.tolist() == ["AAA"]
+
+
+def test_save_refuses_a_directory_that_is_not_a_universe(tmp_path):
+    (tmp_path / "notes.txt").write_text("keep me")
+    with pytest.raises(ValueError):
+        Universe([], [0], np.empty(0, np.int32), {}).save(str(tmp_path))
+    assert (tmp_path / "notes.txt").exists()
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from partition import TickerPartition
+from price_store import DATE_COLUMN, MANIFEST, list_tickers, load_ticker_arrays
+from schema import connect
+
+# Compact in-memory copy of the `prices` table. Rows are sorted by (ticker,
+# Date) and held as one contiguous array per column: int32 day numbers
+# (days since 1970-01-01) instead of date strings, float64 or float32 OHLCV,
+# and the ticker of each row implied by per-ticker offsets instead of a
+# string per row. A 40M-bar universe is about 1.8 GB in float64 and 0.9 GB in
+# float32, where the same frame from `select * from prices` is several times
+# that.
+#
+# Build it from SQLite or the price store once, save() it, and load() maps
+# the arrays back in well under a second. Anything that takes a
+# TickerPartition takes a Universe through partition(), and the workers of
+# backtest_supertrend_2 and optimize read from a saved universe when --db
+# points at its directory.
+
+DEFAULT_UNIVERSE = "universe"
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+NS_PER_DAY = 86_400 * 10 ** 9
+# Keeps the `ticker in (...)` list under SQLite's bound parameter limit
+MAX_QUERY_TICKERS = 500
+
+
+def text_to_days(values):
+    """ Day numbers of the '%Y-%m-%d %H:%M:%S' text dates convert_timestamps writes """
+    return np.asarray(values).astype("U10").astype("datetime64[D]").astype(np.int32)
+
+
+def to_days(values):
+    """ Day numbers of text dates or datetime64 values """
+    values = np.asarray(values)
+    if values.dtype == object or values.dtype.kind == "U":
+        return text_to_days(values)
+    return values.astype("datetime64[D]").astype(np.int32)
+
+
+def _ticker_batches(tickers):
+    if tickers is None:
+        return [None]
+    tickers = sorted(set(tickers))
+    return [tickers[i:i + MAX_QUERY_TICKERS] for i in range(0, len(tickers), MAX_QUERY_TICKERS)]
+
+
+class Universe:
+    """
+    Every ticker's bars in contiguous arrays. tickers[i]'s rows are
+    starts[i]:ends[i] of days and of each array in columns.
+    """
+
+    def __init__(self, tickers, offsets, days, columns):
+        self.tickers = np.asarray(tickers, dtype=str)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.days = days
+        self.columns = columns
+        self.positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    @property
+    def starts(self):
+        return self.offsets[:-1]
+
+    @property
+    def ends(self):
+        return self.offsets[1:]
+
+    @property
+    def codes(self):
+        """ Position of each row's ticker in self.tickers, as int32 """
+        return np.repeat(np.arange(len(self.tickers), dtype=np.int32), np.diff(self.offsets))
+
+    @property
+    def dates(self):
+        return self.days.astype("datetime64[D]")
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.days.nbytes + sum(values.nbytes for values in self.columns.values())
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self.positions
+
+    def rows(self, ticker):
+        i = self.positions[ticker]
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def arrays(self, ticker, columns=None):
+        """ Views of one ticker's rows; "days" is among the names """
+        rows = self.rows(ticker)
+        columns = ["days"] + list(self.columns) if columns is None else columns
+        return {column: (self.days if column == "days" else self.columns[column])[rows] for column in columns}
+
+    def select(self, tickers):
+        """ A new Universe with only these tickers (those present), in ticker order """
+        positions = sorted(self.positions[ticker] for ticker in set(tickers) if ticker in self.positions)
+        if not positions:
+            return Universe([], [0], self.days[:0], {name: values[:0] for name, values in self.columns.items()})
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in positions])
+        lengths = np.diff(self.offsets)[positions]
+        return Universe(
+            self.tickers[positions], np.concatenate([[0], np.cumsum(lengths)]), self.days[rows],
+            {name: values[rows] for name, values in self.columns.items()},
+        )
+
+    def frame(self, columns=None):
+        """ The rows as a `prices`-shaped DataFrame (ticker, Date as datetime64, columns) """
+        columns = list(self.columns) if columns is None else [column for column in columns if column in self.columns]
+        df = pd.DataFrame({column: self.columns[column] for column in columns})
+        df.insert(0, DATE_COLUMN, self.dates.astype("datetime64[ns]"))
+        df.insert(0, "ticker", self.tickers[self.codes].astype(object))
+        return df
+
+    def partition(self, columns=None):
+        return TickerPartition(self.frame(columns), presorted=True)
+
+    @classmethod
+    def from_sqlite(cls, db_path="stock_data.db", tickers=None, columns=COLUMNS, dtype=np.float64, chunksize=1_000_000):
+        """
+        Read the prices table in (ticker, Date) order straight into
+        preallocated arrays, chunksize rows at a time, so the string-heavy
+        frame never exists for more than one chunk. The offsets come from a
+        count per ticker, so the ticker column itself is never read.
+        """
+        conn = connect(db_path, readonly=True)
+        try:
+            # One read transaction, so the counts and the rows agree while ingest writes
+            conn.execute("BEGIN")
+            names, counts, queries = [], [], []
+            select = ", ".join(f'"{column}"' for column in [DATE_COLUMN] + list(columns))
+            for batch in _ticker_batches(tickers):
+                where = "" if batch is None else f" where ticker in ({', '.join('?' for _ in batch)})"
+                for name, count in conn.execute(f"select ticker, count(*) from prices{where} group by ticker order by ticker", batch or []):
+                    names.append(name)
+                    counts.append(count)
+                queries.append((f"select {select} from prices{where} order by ticker, Date", batch))
+            offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+            days = np.empty(offsets[-1], dtype=np.int32)
+            arrays = {column: np.empty(offsets[-1], dtype=dtype) for column in columns}
+            row = 0
+            for query, params in queries:
+                for chunk in pd.read_sql_query(query, conn, params=params, chunksize=chunksize):
+                    end = row + len(chunk)
+                    days[row:end] = text_to_days(chunk[DATE_COLUMN].to_numpy())
+                    for column in columns:
+                        arrays[column][row:end] = chunk[column].to_numpy(dtype, na_value=np.nan)
+                    row = end
+        finally:
+            conn.close()
+        return cls(names, offsets, days, arrays)
+
+    @classmethod
+    def from_price_store(cls, root="price_store", tickers=None, columns=COLUMNS, dtype=np.float64):
+        """ Gather the columnar price store's per-ticker files into one universe """
+        names = list_tickers(root) if tickers is None else sorted(set(tickers) & set(list_tickers(root)))
+        sources = [load_ticker_arrays(ticker, root, [DATE_COLUMN] + list(columns)) for ticker in names]
+        offsets = np.concatenate([[0], np.cumsum([len(source[DATE_COLUMN]) for source in sources], dtype=np.int64)])
+        days = np.empty(offsets[-1], dtype=np.int32)
+        arrays = {column: np.full(offsets[-1], np.nan, dtype=dtype) for column in columns}
+        for source, start, end in zip(sources, offsets[:-1], offsets[1:]):
+            days[start:end] = np.asarray(source[DATE_COLUMN]) // NS_PER_DAY
+            for column in columns:
+                if column in source:
+                    arrays[column][start:end] = source[column]
+        return cls(names, offsets, days, arrays)
+
+    def save(self, root=DEFAULT_UNIVERSE):
+        """ One .npy per array, written to a scratch directory and swapped in """
+        if os.path.isdir(root) and os.listdir(root) and not is_universe(root):
+            raise ValueError(f"{root} is not a saved universe; refusing to overwrite it")
+        scratch = root.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(scratch, ignore_errors=True)
+        os.makedirs(scratch)
+        np.save(os.path.join(scratch, "tickers.npy"), self.tickers)
+        np.save(os.path.join(scratch, "offsets.npy"), self.offsets)
+        np.save(os.path.join(scratch, "days.npy"), np.ascontiguousarray(self.days))
+        for i, values in enumerate(self.columns.values()):
+            np.save(os.path.join(scratch, f"column-{i}.npy"), np.ascontiguousarray(values))
+        with open(os.path.join(scratch, MANIFEST), "w") as file:
+            json.dump({"columns": list(self.columns), "rows": int(self.offsets[-1]), "tickers": len(self.tickers)}, file)
+        shutil.rmtree(root, ignore_errors=True)
+        os.replace(scratch, root)
+
+    @classmethod
+    def load(cls, root=DEFAULT_UNIVERSE, columns=None, mmap=True):
+        """ Map a saved universe back in; with mmap the arrays are paged in from disk as they are touched """
+        with open(os.path.join(root, MANIFEST), "r") as file:
+            manifest = json.load(file)
+        mode = "r" if mmap else None
+        wanted = manifest["columns"] if columns is None else columns
+        arrays = {column: np.load(os.path.join(root, f"column-{i}.npy"), mmap_mode=mode)
+                  for i, column in enumerate(manifest["columns"]) if column in wanted}
+        return cls(np.load(os.path.join(root, "tickers.npy")), np.load(os.path.join(root, "offsets.npy")),
+                   np.load(os.path.join(root, "days.npy"), mmap_mode=mode), arrays)
+
+
+def is_universe(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "offsets.npy"))
+
+
+def load_prices(source, tickers=None, columns=None):
+    """
+    Bars of tickers (all when None) sorted by ticker and Date, from a saved
+    universe directory or a SQLite database, so workers can be pointed at
+    either. columns=None reads every stored column.
+    """
+    if is_universe(source):
+        universe = Universe.load(source, columns)
+        return (universe if tickers is None else universe.select(tickers)).frame(columns)
+    select = "*" if columns is None else ", ".join(f'"{column}"' for column in ["ticker", DATE_COLUMN] + list(columns))
+    conn = connect(source, readonly=True)
+    frames = []
+    try:
+        for batch in _ticker_batches(tickers):
+            where = "" if batch is None else f" where ticker in ({', '.join('?' for _ in batch)})"
+            frames.append(pd.read_sql_query(f"select {select} from prices{where} order by ticker, Date", conn, params=batch))
+    finally:
+        conn.close()
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def ticker_rows(source):
+    """ {ticker: number of bars} of a saved universe or a SQLite database """
+    if is_universe(source):
+        universe = Universe.load(source, columns=[])
+        return dict(zip(universe.tickers.tolist(), np.diff(universe.offsets).tolist()))
+    conn = connect(source, readonly=True)
+    try:
+        return dict(conn.execute("select ticker, count(*) from prices group by ticker").fetchall())
+    finally:
+        conn.close()
+
+
+def ticker_fingerprints(source):
+    """
+    {ticker: [bars, last date, last close]} of a saved universe or a SQLite
+    database, to tell which tickers changed without reading their bars. The
+    values are plain JSON types; a missing close is None.
+    """
+    if is_universe(source):
+        universe = Universe.load(source, columns=["Close"])
+        last = universe.ends - 1
+        return {
+            ticker: [int(rows), int(day), None if close != close else float(close)]
+            for ticker, rows, day, close in zip(universe.tickers.tolist(), np.diff(universe.offsets).tolist(),
+                                                universe.days[last].tolist(), universe.columns["Close"][last].tolist())
+        }
+    conn = connect(source, readonly=True)
+    try:
+        # SQLite takes the bare Close column from the row holding max(Date)
+        found = conn.execute("select ticker, count(*), max(Date), Close from prices group by ticker").fetchall()
+    finally:
+        conn.close()
+    return {ticker: [bars, last, None if close is None or close != close else float(close)] for ticker, bars, last, close in found}
+
+
+def date_bounds(source):
+    """ First and last bar date as int64 nanoseconds """
+    if is_universe(source):
+        days = Universe.load(source, columns=[]).days
+        return int(days.min()) * NS_PER_DAY, int(days.max()) * NS_PER_DAY
+    conn = connect(source, readonly=True)
+    try:
+        first, last = conn.execute("select min(Date), max(Date) from prices").fetchone()
+    finally:
+        conn.close()
+    return tuple(int(day) * NS_PER_DAY for day in text_to_days([first, last]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the compact universe from stock_data.db or the price store")
+    parser.add_argument("--db", default="stock_data.db")
+    parser.add_argument("--price-store", default=None, help="build from this columnar price store instead of --db")
+    parser.add_argument("--out", default=DEFAULT_UNIVERSE)
+    parser.add_argument("--float32", action="store_true", help="store OHLCV as float32 to halve the size")
+    args = parser.parse_args()
+    dtype = np.float32 if args.float32 else np.float64
+    if args.price_store:
+        universe = Universe.from_price_store(args.price_store, dtype=dtype)
+    else:
+        universe = Universe.from_sqlite(args.db, dtype=dtype)
+    universe.save(args.out)
+    print(f"Saved {universe.offsets[-1]} bars of {len(universe)} tickers ({universe.nbytes / 1024 ** 2:.0f} MB) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()